@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+提示词前缀复用基准测试
+启动一个模拟 Ollama 的本地 OpenAI 兼容服务：与上一次请求的最长公共前缀视为 KV 缓存命中，
+其余部分按固定速度计入 prompt eval 时间。比较两种提示词布局的每轮 prompt eval 时间：
+- legacy：当前语言写入系统提示词，超出预算后每轮压缩一次历史
+- stable：系统提示词和工具定义不变，语言标记放在用户消息末尾，压缩带回差
+
+用法: python bench_prompt_cache.py [--turns 40] [--ms-per-token 2]
+"""
+
+import argparse
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from openai import OpenAI
+
+import main as agent
+from history import ConversationHistory, estimate_tokens
+
+QUESTIONS_CN = ["北京明天天气怎么样？", "上海需要带伞吗？", "深圳穿什么合适？", "成都这周会下雨吗？"]
+QUESTIONS_EN = ["What's the weather in Paris?", "Do I need a coat in London?", "Is it hot in Dubai?", "Will it rain in Tokyo?"]
+
+
+def render_prompt(body: dict) -> str:
+    """按请求内容拼出模型实际看到的提示词（工具定义在最前面，与常见聊天模板一致）"""
+    parts = [json.dumps(body.get("tools") or [], ensure_ascii=False, sort_keys=True)]
+    for message in body["messages"]:
+        parts.append(f"<|{message['role']}|>{message.get('content') or ''}")
+        if message.get("tool_calls"):
+            parts.append(json.dumps(message["tool_calls"], ensure_ascii=False, sort_keys=True))
+    return "".join(parts)
+
+
+class StandInServer:
+    """
+    模拟模型服务
+    记录每次请求的提示词 token 数、复用的前缀 token 数和估算的 prompt eval 时间
+    """
+
+    def __init__(self, ms_per_token: float):
+        self.ms_per_token = ms_per_token
+        self.last_prompt = ""
+        self.records = []
+        self._lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                prompt_tokens = stand_in.evaluate(render_prompt(body))
+                payload = json.dumps({
+                    "id": "chatcmpl-bench",
+                    "object": "chat.completion",
+                    "created": 0,
+                    "model": body.get("model"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "晴，15~22°C，建议穿薄外套。Sunny, 15-22°C, light jacket."},
+                        "finish_reason": "stop"
+                    }],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 20, "total_tokens": prompt_tokens + 20}
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def evaluate(self, prompt: str) -> int:
+        """与上一次提示词比较最长公共前缀，返回提示词 token 数"""
+        with self._lock:
+            common = 0
+            limit = min(len(prompt), len(self.last_prompt))
+            while common < limit and prompt[common] == self.last_prompt[common]:
+                common += 1
+            total = estimate_tokens(prompt)
+            reused = estimate_tokens(prompt[:common]) if common else 0
+            self.records.append({
+                "prompt_tokens": total,
+                "reused_tokens": reused,
+                "eval_ms": (total - reused) * self.ms_per_token
+            })
+            self.last_prompt = prompt
+            return total
+
+    def reset(self):
+        with self._lock:
+            self.last_prompt = ""
+            self.records = []
+
+
+def run_session(server: StandInServer, layout: str, turns: int) -> list:
+    """按指定布局运行一段对话，返回每轮的服务端记录"""
+    server.reset()
+    history = ConversationHistory(
+        agent.SYSTEM_PROMPT,
+        token_budget=1200,
+        keep_turns=3,
+        low_water=1.0 if layout == "legacy" else 0.6
+    )
+    for turn in range(turns):
+        # 每 8 轮切换一次提问语言
+        lang = "cn" if (turn // 8) % 2 == 0 else "en"
+        agent.SETTINGS["language"] = lang
+        question = (QUESTIONS_CN if lang == "cn" else QUESTIONS_EN)[turn % 4]
+        if layout == "legacy":
+            language = "Chinese" if lang == "cn" else "English"
+            history.set_system(f"**[Current System Language: {language}]**\n\n" + agent.SYSTEM_PROMPT)
+            history.add("user", question)
+        else:
+            history.add("user", agent.with_language_tag(question))
+        answer, _ = agent.ask_qwen(question, messages=history.messages(), use_tools=True)
+        history.add("assistant", answer)
+    return list(server.records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="提示词前缀复用基准测试")
+    parser.add_argument("--turns", type=int, default=40, help="对话轮数")
+    parser.add_argument("--ms-per-token", type=float, default=2.0, help="模拟的 prompt eval 速度（毫秒/token）")
+    args = parser.parse_args()
+
+    server = StandInServer(args.ms_per_token)
+    agent.client = OpenAI(base_url=server.base_url, api_key="bench")
+
+    results = {layout: run_session(server, layout, args.turns) for layout in ("legacy", "stable")}
+    server.server.shutdown()
+
+    print(f"{'轮次':>4} | {'legacy 复用/总计':>18} {'eval ms':>8} | {'stable 复用/总计':>18} {'eval ms':>8}")
+    print("-" * 68)
+    for turn, (old, new) in enumerate(zip(results["legacy"], results["stable"]), 1):
+        print(
+            f"{turn:>4} | {old['reused_tokens']:>8}/{old['prompt_tokens']:<9} {old['eval_ms']:>8.0f} | "
+            f"{new['reused_tokens']:>8}/{new['prompt_tokens']:<9} {new['eval_ms']:>8.0f}"
+        )
+    print("-" * 68)
+    for layout, records in results.items():
+        total = sum(r["prompt_tokens"] for r in records)
+        reused = sum(r["reused_tokens"] for r in records)
+        eval_ms = sum(r["eval_ms"] for r in records) / len(records)
+        print(f"{layout:>6}: 前缀复用率 {reused / total:.0%}，平均 prompt eval {eval_ms:.0f} ms/轮")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+启动耗时基准测试
+- import main 的耗时：解析 python -X importtime 的输出，只统计模块导入本身，不含解释器启动
+- 启动到输入提示符的耗时：运行 main.py 直到打印出输入提示符（含加载 .env、readline、启动预热线程和欢迎信息），
+  减去同一台机器上空解释器的启动时间
+- 启动时不应导入的重量级模块（openai、requests、httpx 等）
+启动到提示符超出预算或导入了重量级模块时退出码为 1，可直接用于 CI
+
+用法: python bench_startup.py [--runs 5] [--budget-ms 150]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# 启动路径上不应出现的模块（首次调用模型或工具时才导入）
+HEAVY_MODULES = ("openai", "requests", "httpx", "geocoding", "weather", "http_transport")
+
+
+def _env(**overrides) -> dict:
+    env = dict(os.environ, WARMUP="0", PYTHONDONTWRITEBYTECODE="1")
+    env.update(overrides)
+    env.pop("PYTHONPROFILEIMPORTTIME", None)
+    return env
+
+
+def measure_import(module: str = "main") -> tuple:
+    """
+    用 -X importtime 测量一次模块导入
+
+    Args:
+        module: 模块名
+
+    Returns:
+        (导入耗时毫秒, {模块名: 累计耗时毫秒})
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=HERE, env=_env(), capture_output=True, text=True, check=True
+    )
+    loaded = {}
+    total = 0.0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        loaded[name.strip()] = int(cumulative) / 1000
+        if name.strip() == module:
+            total = int(cumulative) / 1000
+    return total, loaded
+
+
+def measure_interpreter() -> float:
+    """测量空解释器的启动耗时（毫秒）"""
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], cwd=HERE, env=_env(), check=True)
+    return (time.perf_counter() - started) * 1000
+
+
+def measure_time_to_prompt(marker: bytes = b"User") -> float:
+    """
+    运行 main.py 直到输出输入提示符
+    预热线程照常启动，但指向本机一个未监听的端口：只计入启动线程的开销，不依赖 Ollama 是否在运行
+
+    Args:
+        marker: 输入提示符的开头
+
+    Returns:
+        启动到提示符的耗时（毫秒）
+    """
+    env = _env(WARMUP="1", OLLAMA_BASE_URL="http://127.0.0.1:9/v1")
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-u", "main.py"],
+        cwd=HERE, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    output = b""
+    try:
+        while marker not in output:
+            chunk = os.read(proc.stdout.fileno(), 4096)
+            if not chunk:
+                raise RuntimeError("main.py 在显示输入提示符前退出")
+            output += chunk
+        return (time.perf_counter() - started) * 1000
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动耗时基准测试")
+    parser.add_argument("--runs", type=int, default=5, help="重复次数（取中位数）")
+    parser.add_argument(
+        "--budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_MS", 150)),
+        help="启动到输入提示符（扣除解释器启动）的耗时预算（毫秒）"
+    )
+    args = parser.parse_args()
+
+    imports = [measure_import() for _ in range(args.runs)]
+    import_ms = statistics.median(total for total, _ in imports)
+    loaded = imports[-1][1]
+    interpreter_ms = statistics.median(measure_interpreter() for _ in range(args.runs))
+    prompt_ms = statistics.median(measure_time_to_prompt() for _ in range(args.runs))
+
+    startup_ms = prompt_ms - interpreter_ms
+
+    print(f"import main:            {import_ms:7.1f} ms")
+    print(f"启动到输入提示符:       {prompt_ms:7.1f} ms（其中解释器启动 {interpreter_ms:.1f} ms）")
+    print(f"扣除解释器启动后:       {startup_ms:7.1f} ms（预算 {args.budget_ms:.0f} ms）")
+    print("\n导入耗时最多的模块：")
+    for name, ms in sorted(loaded.items(), key=lambda item: -item[1])[:10]:
+        print(f"  {ms:7.1f} ms  {name}")
+
+    failed = False
+    heavy = [name for name in HEAVY_MODULES if name in loaded]
+    if heavy:
+        print(f"\n❌ 启动时导入了重量级模块: {', '.join(heavy)}")
+        failed = True
+    if startup_ms > args.budget_ms:
+        print(f"\n❌ 启动到输入提示符耗时 {startup_ms:.1f} ms，超出预算 {args.budget_ms:.0f} ms")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print("\n✅ 启动耗时在预算内")
+
+
+if __name__ == "__main__":
+    main()
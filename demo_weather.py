@@ -60,21 +60,21 @@ def demo_compare():
     cities = ["北京", "上海", "广州"]
     results = []
     
-    for city in cities:
-        print(f"\n🔍 正在查询: {city}")
-        
-        # 获取坐标
-        location = geocoder.geocode(city)
-        if not location:
-            continue
-        
-        # 查询天气
-        weather_data = weather.get_weather(
-            location['latitude'],
-            location['longitude'],
-            forecast_days=1
-        )
-        
+    # 批量地理编码
+    print(f"\n🔍 正在查询: {', '.join(cities)}")
+    located = [
+        (city, location)
+        for city, location in geocoder.geocode_many(cities)
+        if location
+    ]
+    
+    # 批量查询天气：所有城市合并为一次请求
+    weather_list = weather.get_weather_many(
+        [(location['latitude'], location['longitude']) for _, location in located],
+        forecast_days=1
+    )
+    
+    for (city, _), weather_data in zip(located, weather_list):
         if weather_data:
             current = weather_data['current']
             results.append({
@@ -82,7 +82,7 @@ def demo_compare():
                 'temp': current['temperature'],
                 'weather': current['weather_description'].split('/')[0].strip()
             })
-            print(f"   ✅ 温度: {current['temperature']}°C")
+            print(f"   ✅ {city} 温度: {current['temperature']}°C")
     
     # 显示对比
     print("\n📊 温度对比:")
@@ -0,0 +1,411 @@
+"""
+离线地名索引（Gazetteer）
+从 GeoNames 格式的地名表构建紧凑的二进制索引，通过 mmap 加载，
+支持精确匹配、前缀匹配和三元组（trigram）模糊匹配，中英文地名与别名均可查询
+"""
+
+import bisect
+import csv
+import math
+import mmap
+import os
+import struct
+import threading
+import zlib
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from geo_cache import get_cache_dir, normalize_address
+
+# 索引文件格式（小端）：
+#   头部     magic, 地点数, 键数, 三元组数, 各段偏移
+#   地点段   每条 (纬度, 经度, 人口, 名称偏移, 名称长度)
+#   键段     按 UTF-8 字节序排列，每条 (键偏移, 键长度, 地点编号, 三元组数)
+#   三元组段 按哈希排列，每条 (三元组哈希, 倒排表偏移, 倒排表长度)
+#   倒排表   键编号数组
+#   字符串   地名与键的 UTF-8 文本
+_MAGIC = b"GAZ1"
+_HEADER = struct.Struct("<4sIIIIIIII")
+_PLACE = struct.Struct("<ddIII")
+_KEY = struct.Struct("<IIII")
+_TRIGRAM = struct.Struct("<III")
+_POSTING = struct.Struct("<I")
+
+# GeoNames 导出文件（如 cities15000.txt）的列位置
+_GEONAMES_COLUMNS = {
+    "name": 1,
+    "asciiname": 2,
+    "alternatenames": 3,
+    "latitude": 4,
+    "longitude": 5,
+    "country_code": 8,
+    "population": 14
+}
+
+DEFAULT_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "cities.csv")
+
+
+def trigrams(key: str) -> List[str]:
+    """
+    计算规范化键的三元组集合（首部补两个空格、尾部补一个空格）
+
+    Args:
+        key: 规范化后的地名
+
+    Returns:
+        去重后的三元组列表
+    """
+    padded = f"  {key} "
+    return sorted({padded[i:i + 3] for i in range(len(padded) - 2)})
+
+
+def _trigram_hash(trigram: str) -> int:
+    return zlib.crc32(trigram.encode("utf-8"))
+
+
+def read_places(path: str) -> Iterator[Dict]:
+    """
+    读取地名表
+    支持两种格式：带表头的 CSV（列名同 GeoNames）和 GeoNames 原始 TSV 导出文件
+
+    Args:
+        path: 地名表路径
+
+    Returns:
+        地点字典迭代器（name, names, latitude, longitude, country_code, population）
+    """
+    with open(path, encoding="utf-8", newline="") as f:
+        first_line = f.readline()
+        f.seek(0)
+
+        if first_line.startswith("name"):
+            rows = csv.DictReader(f)
+        else:
+            rows = (
+                {column: row[index] for column, index in _GEONAMES_COLUMNS.items()}
+                for row in csv.reader(f, delimiter="\t", quoting=csv.QUOTE_NONE)
+                if row and not row[0].startswith("#") and len(row) > 14
+            )
+
+        for row in rows:
+            names = [row["name"], row.get("asciiname", "")]
+            names.extend((row.get("alternatenames") or "").split(","))
+            yield {
+                "name": row["name"],
+                "names": [name for name in names if name.strip()],
+                "latitude": float(row["latitude"]),
+                "longitude": float(row["longitude"]),
+                "country_code": row.get("country_code", ""),
+                "population": int(row.get("population") or 0)
+            }
+
+
+def build_index(source_path: str, index_path: str):
+    """
+    从地名表构建二进制索引文件（先写临时文件再原子替换）
+
+    Args:
+        source_path: 地名表路径
+        index_path: 输出的索引文件路径
+    """
+    strings = bytearray()
+    places = bytearray()
+    entries: List[Tuple[bytes, int, int]] = []   # (键, -人口, 地点编号)
+
+    for place_id, place in enumerate(read_places(source_path)):
+        display = place["name"]
+        if place["country_code"]:
+            display = f"{display}, {place['country_code']}"
+        display_bytes = display.encode("utf-8")
+        places += _PLACE.pack(
+            place["latitude"], place["longitude"], place["population"],
+            len(strings), len(display_bytes)
+        )
+        strings += display_bytes
+
+        for key in {normalize_address(name) for name in place["names"]}:
+            if key:
+                entries.append((key.encode("utf-8"), -place["population"], place_id))
+
+    # 同名地点按人口降序，精确匹配时优先返回人口最多的
+    entries.sort()
+
+    keys = bytearray()
+    postings_by_trigram: Dict[int, List[int]] = {}
+    for key_id, (key_bytes, _, place_id) in enumerate(entries):
+        key_trigrams = trigrams(key_bytes.decode("utf-8"))
+        keys += _KEY.pack(len(strings), len(key_bytes), place_id, len(key_trigrams))
+        strings += key_bytes
+        for trigram in key_trigrams:
+            postings_by_trigram.setdefault(_trigram_hash(trigram), []).append(key_id)
+
+    trigram_table = bytearray()
+    postings = bytearray()
+    for trigram_hash in sorted(postings_by_trigram):
+        key_ids = postings_by_trigram[trigram_hash]
+        trigram_table += _TRIGRAM.pack(trigram_hash, len(postings) // _POSTING.size, len(key_ids))
+        postings += struct.pack(f"<{len(key_ids)}I", *key_ids)
+
+    off_places = _HEADER.size
+    off_keys = off_places + len(places)
+    off_trigrams = off_keys + len(keys)
+    off_postings = off_trigrams + len(trigram_table)
+    off_strings = off_postings + len(postings)
+    header = _HEADER.pack(
+        _MAGIC, len(places) // _PLACE.size, len(entries), len(postings_by_trigram),
+        off_places, off_keys, off_trigrams, off_postings, off_strings
+    )
+
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        for section in (header, places, keys, trigram_table, postings, strings):
+            f.write(section)
+    os.replace(tmp_path, index_path)
+
+
+class _KeyView:
+    """把键段包装成可二分查找的序列（按需从 mmap 解码）"""
+
+    def __init__(self, gazetteer: "Gazetteer"):
+        self._gazetteer = gazetteer
+
+    def __len__(self) -> int:
+        return self._gazetteer._n_keys
+
+    def __getitem__(self, key_id: int) -> bytes:
+        return self._gazetteer._key_bytes(key_id)
+
+
+class Gazetteer:
+    """
+    离线地名查询引擎
+    首次查询时才构建/加载索引，之后所有查询都直接读取 mmap，无需网络
+    """
+
+    def __init__(self, source_path: str = DEFAULT_SOURCE, index_path: Optional[str] = None):
+        """
+        初始化地名查询引擎（不会立即加载索引）
+
+        Args:
+            source_path: GeoNames 格式的地名表路径
+            index_path: 索引文件路径，默认存放在缓存目录
+        """
+        self.source_path = source_path
+        if index_path is None:
+            name = os.path.splitext(os.path.basename(source_path))[0]
+            index_path = os.path.join(get_cache_dir(), f"gazetteer-{name}.idx")
+        self.index_path = index_path
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._mm = None
+        self._keys = _KeyView(self)
+
+    @property
+    def available(self) -> bool:
+        """地名表或索引文件是否存在"""
+        return os.path.exists(self.source_path) or os.path.exists(self.index_path)
+
+    def _ensure_loaded(self) -> bool:
+        """按需构建并映射索引，返回索引是否可用"""
+        if self._loaded:
+            return self._mm is not None
+
+        with self._lock:
+            if self._loaded:
+                return self._mm is not None
+            try:
+                if os.path.exists(self.source_path) and (
+                    not os.path.exists(self.index_path)
+                    or os.path.getmtime(self.index_path) < os.path.getmtime(self.source_path)
+                ):
+                    build_index(self.source_path, self.index_path)
+
+                if os.path.exists(self.index_path):
+                    with open(self.index_path, "rb") as f:
+                        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    (magic, self._n_places, self._n_keys, self._n_trigrams,
+                     self._off_places, self._off_keys, self._off_trigrams,
+                     self._off_postings, self._off_strings) = _HEADER.unpack_from(mm, 0)
+                    if magic != _MAGIC:
+                        raise ValueError(f"Invalid gazetteer index: {self.index_path}")
+                    self._mm = mm
+            except (OSError, ValueError, KeyError, struct.error) as e:
+                print(f"离线地名索引不可用: {e}")
+                self._mm = None
+            self._loaded = True
+            return self._mm is not None
+
+    def _key_record(self, key_id: int) -> Tuple[int, int, int, int]:
+        return _KEY.unpack_from(self._mm, self._off_keys + key_id * _KEY.size)
+
+    def _key_bytes(self, key_id: int) -> bytes:
+        offset, length, _, _ = self._key_record(key_id)
+        start = self._off_strings + offset
+        return self._mm[start:start + length]
+
+    def _place(self, place_id: int, **extra) -> Dict:
+        latitude, longitude, population, offset, length = _PLACE.unpack_from(
+            self._mm, self._off_places + place_id * _PLACE.size
+        )
+        start = self._off_strings + offset
+        display_name = self._mm[start:start + length].decode("utf-8")
+        country_code = display_name.rsplit(", ", 1)[1].lower() if ", " in display_name else ""
+        place = {
+            "latitude": latitude,
+            "longitude": longitude,
+            "display_name": display_name,
+            "address": {"country_code": country_code} if country_code else {},
+            "importance": round(min(1.0, math.log10(population + 1) / 8), 2),
+            "population": population,
+            "source": "gazetteer"
+        }
+        place.update(extra)
+        return place
+
+    def places(self) -> Iterator[Dict]:
+        """
+        遍历索引中的全部地点
+
+        Returns:
+            地点字典迭代器
+        """
+        if not self._ensure_loaded():
+            return
+        for place_id in range(self._n_places):
+            yield self._place(place_id)
+
+    def lookup(self, query: str) -> Optional[Dict]:
+        """
+        精确匹配（含别名），同名时返回人口最多的地点
+
+        Args:
+            query: 地名
+
+        Returns:
+            地点字典，未找到返回 None
+        """
+        if not self._ensure_loaded():
+            return None
+        key = normalize_address(query).encode("utf-8")
+        key_id = bisect.bisect_left(self._keys, key)
+        if key_id < self._n_keys and self._keys[key_id] == key:
+            return self._place(self._key_record(key_id)[2], match="exact", score=1.0)
+        return None
+
+    def prefix(self, query: str, limit: int = 5) -> List[Dict]:
+        """
+        前缀匹配，按人口降序返回
+
+        Args:
+            query: 地名前缀
+            limit: 最多返回的结果数
+
+        Returns:
+            地点字典列表
+        """
+        if not self._ensure_loaded():
+            return []
+        prefix = normalize_address(query).encode("utf-8")
+        if not prefix:
+            return []
+
+        place_ids = {}
+        key_id = bisect.bisect_left(self._keys, prefix)
+        while key_id < self._n_keys and self._keys[key_id].startswith(prefix):
+            place_ids.setdefault(self._key_record(key_id)[2], None)
+            key_id += 1
+
+        results = [self._place(place_id, match="prefix", score=1.0) for place_id in place_ids]
+        results.sort(key=lambda place: -place["population"])
+        return results[:limit]
+
+    def _postings(self, trigram_hash: int) -> Tuple[int, ...]:
+        low, high = 0, self._n_trigrams
+        while low < high:
+            mid = (low + high) // 2
+            value, offset, count = _TRIGRAM.unpack_from(
+                self._mm, self._off_trigrams + mid * _TRIGRAM.size
+            )
+            if value < trigram_hash:
+                low = mid + 1
+            elif value > trigram_hash:
+                high = mid
+            else:
+                return struct.unpack_from(
+                    f"<{count}I", self._mm, self._off_postings + offset * _POSTING.size
+                )
+        return ()
+
+    def fuzzy(self, query: str, limit: int = 5, min_similarity: float = 0.3) -> List[Dict]:
+        """
+        三元组模糊匹配，相似度 = 共有三元组 / (查询三元组 + 候选三元组 - 共有三元组)
+
+        Args:
+            query: 地名
+            limit: 最多返回的结果数
+            min_similarity: 最低相似度（0-1）
+
+        Returns:
+            按相似度降序排列的地点字典列表
+        """
+        if not self._ensure_loaded():
+            return []
+        query_trigrams = trigrams(normalize_address(query))
+        shared: Dict[int, int] = {}
+        for trigram in query_trigrams:
+            for key_id in self._postings(_trigram_hash(trigram)):
+                shared[key_id] = shared.get(key_id, 0) + 1
+
+        best: Dict[int, float] = {}
+        for key_id, count in shared.items():
+            _, _, place_id, key_trigram_count = self._key_record(key_id)
+            score = count / (len(query_trigrams) + key_trigram_count - count)
+            if score >= min_similarity and score > best.get(place_id, 0.0):
+                best[place_id] = score
+
+        ranked = sorted(best.items(), key=lambda item: -item[1])[:limit]
+        return [self._place(place_id, match="fuzzy", score=round(score, 3)) for place_id, score in ranked]
+
+    def match(self, query: str, min_similarity: float = 0.6) -> Optional[Dict]:
+        """
+        地理编码用的单结果匹配：先精确匹配，再取相似度足够高的模糊匹配
+
+        Args:
+            query: 地名
+            min_similarity: 模糊匹配的最低相似度
+
+        Returns:
+            地点字典，未找到返回 None
+        """
+        result = self.lookup(query)
+        if result is None:
+            candidates = self.fuzzy(query, limit=1, min_similarity=min_similarity)
+            result = candidates[0] if candidates else None
+        return result
+
+    def close(self):
+        """释放 mmap（之后的查询会重新加载）"""
+        with self._lock:
+            if self._mm is not None:
+                self._mm.close()
+            self._mm = None
+            self._loaded = False
+
+
+_default_gazetteer = None
+_default_gazetteer_lock = threading.Lock()
+
+
+def get_default_gazetteer() -> Gazetteer:
+    """
+    获取进程内共享的默认地名索引（延迟加载）
+    可通过 GAZETTEER_PATH 指定地名表，例如 GeoNames 的 cities15000.txt
+
+    Returns:
+        Gazetteer 实例
+    """
+    global _default_gazetteer
+    with _default_gazetteer_lock:
+        if _default_gazetteer is None:
+            _default_gazetteer = Gazetteer(os.getenv("GAZETTEER_PATH", DEFAULT_SOURCE))
+        return _default_gazetteer
@@ -0,0 +1,250 @@
+"""
+地理编码本地缓存
+基于 SQLite 的持久化缓存，支持 TTL 过期、LRU 淘汰和未命中结果（负缓存）
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Dict, Iterator, Optional, Tuple
+
+
+def get_cache_dir() -> str:
+    """
+    获取本地缓存目录（可通过 AGENT_CACHE_DIR 环境变量覆盖，支持 ~ 开头的路径）
+
+    Returns:
+        缓存目录路径
+    """
+    return os.path.expanduser(os.getenv("AGENT_CACHE_DIR", os.path.join("~", ".cache", "agent_service")))
+
+
+def normalize_address(address: str) -> str:
+    """
+    规范化地址作为缓存键
+    统一全角/半角字符（NFKC）、大小写折叠、合并连续空白
+
+    Args:
+        address: 原始地址
+
+    Returns:
+        规范化后的地址
+    """
+    text = unicodedata.normalize("NFKC", address or "")
+    return " ".join(text.casefold().split())
+
+
+class GeocodeCache:
+    """
+    地理编码结果缓存
+    命中结果存储为 JSON，"未找到地址" 存储为 NULL（负缓存）
+    """
+
+    def __init__(
+        self,
+        path: str = ":memory:",
+        ttl: float = 30 * 24 * 3600,
+        negative_ttl: float = 24 * 3600,
+        max_entries: int = 10000
+    ):
+        """
+        初始化缓存
+
+        Args:
+            path: SQLite 文件路径，":memory:" 表示仅内存
+            ttl: 命中结果有效期（秒）
+            negative_ttl: 未找到结果的有效期（秒）
+            max_entries: 最大条目数，超出后按最近访问时间淘汰
+        """
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = self._connect(path)
+        self._size = self._conn.execute("SELECT COUNT(*) FROM geocode_cache").fetchone()[0]
+
+        # 统计计数
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _connect(self, path: str) -> sqlite3.Connection:
+        """打开数据库并建表，文件不可用时退回内存数据库"""
+        try:
+            if path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        except (OSError, sqlite3.Error) as e:
+            print(f"地理编码缓存不可用，改用内存缓存: {e}")
+            self.path = ":memory:"
+            conn = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+
+        if self.path != ":memory:":
+            # WAL + NORMAL：读写互不阻塞，单次提交无需 fsync
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS geocode_cache ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT,"
+            " expires_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_geocode_cache_access"
+            " ON geocode_cache (last_access)"
+        )
+        return conn
+
+    def get(self, key: str) -> Tuple[bool, Optional[Dict]]:
+        """
+        查询缓存
+
+        Args:
+            key: 规范化后的地址（见 normalize_address）
+
+        Returns:
+            (是否命中, 结果)；负缓存命中时返回 (True, None)
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM geocode_cache WHERE key = ?",
+                (key,)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return (False, None)
+
+            value, expires_at = row
+            if expires_at <= now:
+                self._conn.execute("DELETE FROM geocode_cache WHERE key = ?", (key,))
+                self._size -= 1
+                self.misses += 1
+                return (False, None)
+
+            self._conn.execute(
+                "UPDATE geocode_cache SET last_access = ? WHERE key = ?",
+                (now, key)
+            )
+
+            if value is None:
+                self.negative_hits += 1
+                return (True, None)
+
+            self.hits += 1
+            return (True, json.loads(value))
+
+    def set(self, key: str, value: Optional[Dict]):
+        """
+        写入缓存
+
+        Args:
+            key: 规范化后的地址
+            value: 地理编码结果，None 表示地址不存在
+        """
+        now = time.time()
+        ttl = self.ttl if value is not None else self.negative_ttl
+        payload = json.dumps(value, ensure_ascii=False) if value is not None else None
+
+        with self._lock:
+            exists = self._conn.execute(
+                "SELECT 1 FROM geocode_cache WHERE key = ?", (key,)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode_cache (key, value, expires_at, last_access)"
+                " VALUES (?, ?, ?, ?)",
+                (key, payload, now + ttl, now)
+            )
+            if not exists:
+                self._size += 1
+            if self._size > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        """按最近访问时间淘汰多余条目（调用方需持有锁）"""
+        overflow = self._size - self.max_entries
+        self._conn.execute(
+            "DELETE FROM geocode_cache WHERE key IN ("
+            " SELECT key FROM geocode_cache ORDER BY last_access ASC LIMIT ?)",
+            (overflow,)
+        )
+        self.evictions += overflow
+        self._size = self._conn.execute("SELECT COUNT(*) FROM geocode_cache").fetchone()[0]
+
+    def entries(self) -> Iterator[Dict]:
+        """
+        遍历所有未过期的命中结果（不含负缓存，不计入统计）
+
+        Returns:
+            地理编码结果迭代器
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT value FROM geocode_cache WHERE value IS NOT NULL AND expires_at > ?",
+                (time.time(),)
+            ).fetchall()
+        for (value,) in rows:
+            yield json.loads(value)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._conn.execute("DELETE FROM geocode_cache")
+            self._size = 0
+
+    def stats(self) -> Dict:
+        """
+        返回缓存统计信息
+
+        Returns:
+            包含命中、未命中、淘汰次数和当前条目数的字典
+        """
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "size": self._size
+        }
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache() -> GeocodeCache:
+    """
+    获取进程内共享的默认缓存（首次调用时创建）
+    可通过 GEOCODE_CACHE_PATH、GEOCODE_CACHE_TTL、GEOCODE_CACHE_NEGATIVE_TTL、
+    GEOCODE_CACHE_MAX_ENTRIES 环境变量配置
+
+    Returns:
+        GeocodeCache 实例
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = GeocodeCache(
+                path=os.path.expanduser(os.getenv(
+                    "GEOCODE_CACHE_PATH",
+                    os.path.join(get_cache_dir(), "geocode.sqlite3")
+                )),
+                ttl=float(os.getenv("GEOCODE_CACHE_TTL", 30 * 24 * 3600)),
+                negative_ttl=float(os.getenv("GEOCODE_CACHE_NEGATIVE_TTL", 24 * 3600)),
+                max_entries=int(os.getenv("GEOCODE_CACHE_MAX_ENTRIES", 10000))
+            )
+        return _default_cache
@@ -1,6 +1,93 @@
-import requests
+import asyncio
+import os
+import threading
 import time
-from typing import Optional, Dict
+import httpx
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, Dict, AsyncIterator, Iterable, Iterator, List, Tuple
+from gazetteer import Gazetteer, get_default_gazetteer
+from geo_cache import GeocodeCache, get_default_cache, normalize_address
+from http_transport import AsyncHttpTransport, HttpTransport, get_default_async_transport
+from rate_limiter import TokenBucketRateLimiter, get_shared_limiter
+from single_flight import AsyncSingleFlight, SingleFlight, get_shared_async_flight, get_shared_flight
+from spatial_index import SpatialIndex, distance_km, get_default_spatial_index
+
+
+def get_nominatim_limiter() -> TokenBucketRateLimiter:
+    """
+    获取所有 Nominatim 调用方共享的限流器
+    默认 1 请求/秒（Nominatim 使用政策），可通过 NOMINATIM_RATE_LIMIT、NOMINATIM_BURST 调整
+    """
+    return get_shared_limiter(
+        "nominatim",
+        rate=float(os.getenv("NOMINATIM_RATE_LIMIT", 1.0)),
+        burst=int(os.getenv("NOMINATIM_BURST", 1))
+    )
+
+
+_nominatim_transport = None
+_nominatim_transport_lock = threading.Lock()
+
+# 经限流器重新排队重试的响应状态码
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def get_nominatim_transport() -> HttpTransport:
+    """
+    获取 Nominatim 专用的共享传输层
+    只在传输层重试连接错误，429/5xx 由地理编码器经限流器重试，重试不会超出 1 请求/秒
+    """
+    global _nominatim_transport
+    with _nominatim_transport_lock:
+        if _nominatim_transport is None:
+            _nominatim_transport = HttpTransport(
+                pool_connections=1,
+                pool_maxsize=int(os.getenv("HTTP_POOL_MAXSIZE", 10)),
+                max_retries=int(os.getenv("HTTP_MAX_RETRIES", 2)),
+                retry_statuses=()
+            )
+        return _nominatim_transport
+
+
+def _search_params(address: str) -> Dict:
+    """构造 Nominatim /search 查询参数"""
+    return {
+        "q": address,
+        "format": "json",
+        "limit": 1,  # 只返回最佳匹配结果
+        "addressdetails": 1  # 包含详细地址信息
+    }
+
+
+def _reverse_params(latitude: float, longitude: float) -> Dict:
+    """构造 Nominatim /reverse 查询参数"""
+    return {
+        "lat": latitude,
+        "lon": longitude,
+        "format": "json",
+        "addressdetails": 1
+    }
+
+
+def _retry_after(response, default: float = 1.0, limit: float = 60) -> float:
+    """解析 429 响应的 Retry-After 秒数（缺失或无法解析时使用默认值）"""
+    try:
+        return min(max(float(response.headers.get("Retry-After", default)), 0.0), limit)
+    except ValueError:
+        return default
+
+
+def _parse_location(result: Dict) -> Dict[str, any]:
+    """将 Nominatim 返回的单条结果转换为地点字典"""
+    return {
+        "latitude": float(result["lat"]),
+        "longitude": float(result["lon"]),
+        "display_name": result["display_name"],
+        "address": result.get("address", {}),
+        "importance": result.get("importance", 0)
+    }
+
 
 class NominatimGeocoder:
     """
@@ -8,31 +95,71 @@ class NominatimGeocoder:
     将地址转换为经纬度坐标
     """
     
-    def __init__(self, user_agent: str = "Mozilla/5.0 (compatible; AgentService/1.0; +https://github.com/Tiger-Dong/agent_service)"):
+    def __init__(
+        self,
+        user_agent: str = "Mozilla/5.0 (compatible; AgentService/1.0; +https://github.com/Tiger-Dong/agent_service)",
+        cache: Optional[GeocodeCache] = None,
+        use_cache: bool = True,
+        rate_limiter: Optional[TokenBucketRateLimiter] = None,
+        transport: Optional[HttpTransport] = None,
+        gazetteer: Optional[Gazetteer] = None,
+        use_gazetteer: bool = True,
+        spatial_index: Optional[SpatialIndex] = None,
+        single_flight: Optional[SingleFlight] = None,
+        rate_limit_retries: int = 2
+    ):
         """
         初始化 Nominatim 地理编码器
         Args:
             user_agent: 用户代理标识（Nominatim 要求提供完整的 User-Agent）
+            cache: 地理编码缓存，默认使用进程共享的本地缓存
+            use_cache: 是否启用缓存
+            rate_limiter: 限流器，默认使用进程共享的 Nominatim 限流器
+            transport: HTTP 传输层，默认使用 Nominatim 专用的共享连接池（不在传输层重试 429/5xx）
+            gazetteer: 离线地名索引，默认使用进程共享的索引
+            use_gazetteer: 是否优先使用离线地名索引
+            spatial_index: 反向地理编码用的空间索引，默认使用进程共享的索引
+            single_flight: 请求合并器，默认在进程内共享
+            rate_limit_retries: 收到 429 或 5xx 后经限流器重新排队的最大次数
         """
         self.base_url = "https://nominatim.openstreetmap.org/search"
+        self.reverse_url = "https://nominatim.openstreetmap.org/reverse"
         self.headers = {
             "User-Agent": user_agent,
             "Accept": "application/json",
             "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8"
         }
-        self.last_request_time = 0
-        # Nominatim 要求请求间隔至少 1 秒
-        self.min_request_interval = 1.0
+        self.cache = (cache or get_default_cache()) if use_cache else None
+        # 限流器在进程内共享，每次新建地理编码器也不会绕过 1 秒间隔
+        self.rate_limiter = rate_limiter or get_nominatim_limiter()
+        self.transport = transport or get_nominatim_transport()
+        self.rate_limit_retries = rate_limit_retries
+        self.single_flight = single_flight or get_shared_flight("nominatim")
+        self.gazetteer = (gazetteer or get_default_gazetteer()) if use_gazetteer else None
+        # 离线模糊匹配的最低相似度，低于该值交给 Nominatim
+        self.fuzzy_threshold = float(os.getenv("GAZETTEER_FUZZY_THRESHOLD", 0.6))
+        self.spatial_index = spatial_index or get_default_spatial_index()
+        # 反向地理编码时本地最近地点的最大距离，超出则查询 Nominatim
+        self.reverse_radius_km = float(os.getenv("REVERSE_GEOCODE_RADIUS_KM", 25))
     
     def _rate_limit(self):
-        """确保请求间隔符合 Nominatim 使用政策（最少 1 秒）"""
-        current_time = time.time()
-        time_since_last_request = current_time - self.last_request_time
-        
-        if time_since_last_request < self.min_request_interval:
-            time.sleep(self.min_request_interval - time_since_last_request)
-        
-        self.last_request_time = time.time()
+        """确保请求间隔符合 Nominatim 使用政策（默认最少 1 秒）"""
+        self.rate_limiter.acquire()
+    
+    def _get(self, url: str, params: Dict) -> requests.Response:
+        """
+        限流后发送请求（网络错误直接抛出）
+        收到 429（按 Retry-After 等待后）或 5xx 时经共享限流器重新排队，重试不会绕过限流
+        """
+        for attempt in range(self.rate_limit_retries + 1):
+            self._rate_limit()
+            response = self.transport.get(url, params=params, headers=self.headers, timeout=30)
+            if response.status_code not in _RETRY_STATUSES or attempt == self.rate_limit_retries:
+                break
+            if response.status_code == 429:
+                time.sleep(_retry_after(response))
+        response.raise_for_status()
+        return response
     
     def geocode(self, address: str) -> Optional[Dict[str, any]]:
         """
@@ -42,39 +169,164 @@ class NominatimGeocoder:
         Returns:
             包含经纬度和详细信息的字典，如果查询失败则返回 None
         """
+        local = self._geocode_local(address)
+        if local is not None:
+            return local
+        
+        key = normalize_address(address)
+        if self.cache is not None:
+            hit, cached = self.cache.get(key)
+            if hit:
+                return cached
+        return self._geocode_remote(address, key)
+    
+    def _geocode_local(self, address: str) -> Optional[Dict[str, any]]:
+        """
+        在离线地名索引中查询（无网络、无限流）
+        Args:
+            address: 要查询的地址
+        Returns:
+            匹配的地点，未命中返回 None
+        """
+        if self.gazetteer is None:
+            return None
+        return self.gazetteer.match(address, self.fuzzy_threshold)
+    
+    def _geocode_remote(self, address: str, key: str) -> Optional[Dict[str, any]]:
+        """
+        通过 Nominatim 查询地址并写入缓存
+        Args:
+            address: 原始地址
+            key: 规范化后的缓存键
+        Returns:
+            地理编码结果，查询失败返回 None
+        """
         try:
-            # 遵守速率限制
-            self._rate_limit()
-            
-            params = {
-                "q": address,
-                "format": "json",
-                "limit": 1,  # 只返回最佳匹配结果
-                "addressdetails": 1  # 包含详细地址信息
-            }
-            
-            response = requests.get(
-                self.base_url,
-                params=params,
-                headers=self.headers,
-                timeout=30
-            )
-            response.raise_for_status()
-            
-            results = response.json()
-            
-            if not results:
-                return None
-            
-            result = results[0]
-            
-            return {
-                "latitude": float(result["lat"]),
-                "longitude": float(result["lon"]),
-                "display_name": result["display_name"],
-                "address": result.get("address", {}),
-                "importance": result.get("importance", 0)
-            }
+            # 相同地址的并发查询合并为一次请求
+            return self.single_flight.do(key, self._fetch_location, address, key)
+        except requests.exceptions.RequestException as e:
+            print(f"请求错误: {e}")
+            return None
+        except (KeyError, ValueError, IndexError) as e:
+            print(f"数据解析错误: {e}")
+            return None
+    
+    def _fetch_location(self, address: str, key: str) -> Optional[Dict[str, any]]:
+        """
+        请求 Nominatim 并写入缓存（网络和解析错误直接抛出）
+        Args:
+            address: 原始地址
+            key: 规范化后的缓存键
+        Returns:
+            地理编码结果，地址不存在时返回 None
+        """
+        response = self._get(self.base_url, _search_params(address))
+        return self._store_location(key, response.json())
+    
+    def _store_location(self, key: str, results: List[Dict]) -> Optional[Dict[str, any]]:
+        """
+        解析 /search 结果并写入缓存和空间索引
+        Args:
+            key: 规范化后的缓存键
+            results: Nominatim 返回的结果列表
+        Returns:
+            地理编码结果，地址不存在时返回 None
+        """
+        if not results:
+            # 负缓存：地址确实不存在，避免重复查询
+            if self.cache is not None:
+                self.cache.set(key, None)
+            return None
+        
+        location = _parse_location(results[0])
+        if self.cache is not None:
+            self.cache.set(key, location)
+        self.spatial_index.add(location)
+        return location
+    
+    def geocode_many(
+        self,
+        addresses: Iterable[str],
+        max_workers: int = 4
+    ) -> Iterator[Tuple[str, Optional[Dict[str, any]]]]:
+        """
+        批量地理编码，按完成顺序逐个返回结果
+        输入先规范化去重，离线索引和缓存命中的立即返回，其余通过共享限流器并发查询
+        Args:
+            addresses: 地址列表
+            max_workers: 并发查询的线程数（实际请求速率仍受限流器约束）
+        Returns:
+            (原始地址, 结果) 迭代器；重复的地址各返回一次，但只查询一次
+        """
+        groups: Dict[str, List[str]] = {}
+        for address in addresses:
+            groups.setdefault(normalize_address(address), []).append(address)
+        
+        hits, pending = self._classify(groups)
+        
+        # 先提交未命中的查询，再返回命中的结果：远程查询不必等调用方处理完命中
+        executor = ThreadPoolExecutor(max_workers=min(max_workers, len(pending))) if pending else None
+        futures = {
+            executor.submit(self._geocode_remote, originals[0], key): key
+            for key, originals in pending.items()
+        }
+        try:
+            for address, result in hits:
+                yield (address, result)
+            for future in as_completed(futures):
+                result = future.result()
+                for address in pending[futures[future]]:
+                    yield (address, result)
+        finally:
+            # 调用方提前停止迭代时，取消尚未开始的查询
+            for future in futures:
+                future.cancel()
+            if executor is not None:
+                executor.shutdown(wait=False)
+    
+    def _classify(
+        self,
+        groups: Dict[str, List[str]]
+    ) -> Tuple[List[Tuple[str, Optional[Dict[str, any]]]], Dict[str, List[str]]]:
+        """
+        将去重后的地址分为本地命中和需要远程查询的两组
+        Args:
+            groups: 规范化键 -> 原始地址列表
+        Returns:
+            ([(原始地址, 结果)] 离线索引和缓存命中, {规范化键: 原始地址列表} 未命中)
+        """
+        hits = []
+        pending: Dict[str, List[str]] = {}
+        for key, originals in groups.items():
+            local = self._geocode_local(originals[0])
+            if local is not None:
+                hits.extend((address, local) for address in originals)
+                continue
+            if self.cache is not None:
+                hit, cached = self.cache.get(key)
+                if hit:
+                    hits.extend((address, cached) for address in originals)
+                    continue
+            pending[key] = originals
+        return hits, pending
+    
+    def reverse(self, latitude: float, longitude: float) -> Optional[Dict[str, any]]:
+        """
+        将经纬度转换为地名（反向地理编码）
+        优先在本地空间索引中查找最近的已知地点，范围内没有时才查询 Nominatim
+        Args:
+            latitude: 纬度
+            longitude: 经度
+        Returns:
+            地点字典（含 distance_km 距离），如果查询失败则返回 None
+        """
+        local = self._reverse_local(latitude, longitude)
+        if local is not None:
+            return local
+        
+        try:
+            response = self._get(self.reverse_url, _reverse_params(latitude, longitude))
+            return self._store_reverse(latitude, longitude, response.json())
             
         except requests.exceptions.RequestException as e:
             print(f"请求错误: {e}")
@@ -83,6 +335,40 @@ class NominatimGeocoder:
             print(f"数据解析错误: {e}")
             return None
     
+    def _reverse_local(self, latitude: float, longitude: float) -> Optional[Dict[str, any]]:
+        """
+        在本地空间索引中查找范围内最近的地点
+        Args:
+            latitude: 纬度
+            longitude: 经度
+        Returns:
+            地点字典（含 distance_km 距离），范围内没有时返回 None
+        """
+        nearest = self.spatial_index.nearest(latitude, longitude, self.reverse_radius_km)
+        if nearest is None:
+            return None
+        place, distance = nearest
+        return dict(place, distance_km=round(distance, 2))
+    
+    def _store_reverse(self, latitude: float, longitude: float, result: Dict) -> Optional[Dict[str, any]]:
+        """
+        解析 /reverse 结果并记入空间索引
+        Args:
+            latitude: 查询纬度
+            longitude: 查询经度
+            result: Nominatim 返回的结果
+        Returns:
+            地点字典（含 distance_km 距离），坐标无对应地点时返回 None
+        """
+        if "error" in result:
+            return None
+        
+        location = _parse_location(result)
+        # 记入空间索引，附近坐标之后可在本地解析
+        self.spatial_index.add(location)
+        distance = distance_km(latitude, longitude, location["latitude"], location["longitude"])
+        return dict(location, distance_km=round(distance, 2))
+    
     def get_coordinates(self, address: str) -> Optional[tuple]:
         """
         简化版：只返回经纬度坐标
@@ -97,6 +383,200 @@ class NominatimGeocoder:
         return None
 
 
+class AsyncNominatimGeocoder(NominatimGeocoder):
+    """
+    NominatimGeocoder 的 asyncio 版本
+    返回结构与同步版本一致；限流等待使用 asyncio.sleep，单个事件循环即可并发处理大量查询。
+    与同步版本共享缓存、离线地名索引、空间索引和限流器
+    """
+    
+    def __init__(
+        self,
+        user_agent: str = "Mozilla/5.0 (compatible; AgentService/1.0; +https://github.com/Tiger-Dong/agent_service)",
+        cache: Optional[GeocodeCache] = None,
+        use_cache: bool = True,
+        rate_limiter: Optional[TokenBucketRateLimiter] = None,
+        transport: Optional[AsyncHttpTransport] = None,
+        gazetteer: Optional[Gazetteer] = None,
+        use_gazetteer: bool = True,
+        spatial_index: Optional[SpatialIndex] = None,
+        single_flight: Optional[AsyncSingleFlight] = None,
+        timeout: float = 30
+    ):
+        """
+        初始化异步地理编码器
+        Args:
+            user_agent: 用户代理标识
+            cache: 地理编码缓存，默认使用进程共享的本地缓存
+            use_cache: 是否启用缓存
+            rate_limiter: 限流器，默认与同步版本共享 Nominatim 限流器
+            transport: 异步 HTTP 传输层，默认使用当前事件循环共享的连接池
+            gazetteer: 离线地名索引，默认使用进程共享的索引
+            use_gazetteer: 是否优先使用离线地名索引
+            spatial_index: 反向地理编码用的空间索引，默认使用进程共享的索引
+            single_flight: 异步请求合并器，默认在进程内共享
+            timeout: 每次调用的默认截止时间（秒），包含限流等待
+        """
+        super().__init__(
+            user_agent=user_agent,
+            cache=cache,
+            use_cache=use_cache,
+            rate_limiter=rate_limiter,
+            gazetteer=gazetteer,
+            use_gazetteer=use_gazetteer,
+            spatial_index=spatial_index
+        )
+        # 连接池绑定事件循环，未指定时在调用时按当前事件循环获取
+        self.transport = transport
+        self.single_flight = single_flight or get_shared_async_flight("nominatim")
+        self.timeout = timeout
+    
+    async def _get(self, url: str, params: Dict) -> httpx.Response:
+        """限流后发送请求（网络错误直接抛出），429/5xx 的处理与同步版本一致"""
+        transport = self.transport or get_default_async_transport()
+        for attempt in range(self.rate_limit_retries + 1):
+            await self.rate_limiter.acquire_async()
+            response = await transport.get(url, params=params, headers=self.headers, timeout=30)
+            if response.status_code not in _RETRY_STATUSES or attempt == self.rate_limit_retries:
+                break
+            if response.status_code == 429:
+                await asyncio.sleep(_retry_after(response))
+        response.raise_for_status()
+        return response
+    
+    async def _with_deadline(self, coro, timeout: Optional[float], what: str):
+        """
+        在截止时间内执行协程；网络、解析错误和超时打印后返回 None，取消则继续向上传递
+        """
+        try:
+            return await asyncio.wait_for(coro, self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            print(f"请求超时: {what}")
+            return None
+        except httpx.HTTPError as e:
+            print(f"请求错误: {e}")
+            return None
+        except (KeyError, ValueError, IndexError) as e:
+            print(f"数据解析错误: {e}")
+            return None
+    
+    async def geocode(self, address: str, timeout: Optional[float] = None) -> Optional[Dict[str, any]]:
+        """
+        将地址转换为经纬度
+        Args:
+            address: 要查询的地址（可以是中文或英文）
+            timeout: 截止时间（秒），默认使用 self.timeout
+        Returns:
+            包含经纬度和详细信息的字典，如果查询失败或超时则返回 None
+        """
+        local = self._geocode_local(address)
+        if local is not None:
+            return local
+        
+        key = normalize_address(address)
+        if self.cache is not None:
+            hit, cached = self.cache.get(key)
+            if hit:
+                return cached
+        return await self._with_deadline(
+            self.single_flight.do(key, self._fetch_location_async, address, key),
+            timeout,
+            address
+        )
+    
+    async def _fetch_location_async(self, address: str, key: str) -> Optional[Dict[str, any]]:
+        """
+        请求 Nominatim 并写入缓存（网络和解析错误直接抛出）
+        Args:
+            address: 原始地址
+            key: 规范化后的缓存键
+        Returns:
+            地理编码结果，地址不存在时返回 None
+        """
+        response = await self._get(self.base_url, _search_params(address))
+        return self._store_location(key, response.json())
+    
+    async def geocode_many(
+        self,
+        addresses: Iterable[str],
+        max_concurrency: int = 16,
+        timeout: Optional[float] = None
+    ) -> AsyncIterator[Tuple[str, Optional[Dict[str, any]]]]:
+        """
+        批量地理编码，按完成顺序逐个返回结果
+        输入先规范化去重，离线索引和缓存命中的立即返回，其余并发查询（请求速率仍受限流器约束）
+        Args:
+            addresses: 地址列表
+            max_concurrency: 同时进行的最大查询数
+            timeout: 每个地址的截止时间（秒），默认使用 self.timeout
+        Returns:
+            (原始地址, 结果) 异步迭代器；重复的地址各返回一次，但只查询一次
+        """
+        groups: Dict[str, List[str]] = {}
+        for address in addresses:
+            groups.setdefault(normalize_address(address), []).append(address)
+        
+        hits, pending = self._classify(groups)
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def lookup(key: str) -> Tuple[str, Optional[Dict[str, any]]]:
+            async with semaphore:
+                return key, await self.geocode(pending[key][0], timeout)
+        
+        # 先启动未命中的查询，再返回命中的结果
+        tasks = [asyncio.ensure_future(lookup(key)) for key in pending]
+        try:
+            for address, result in hits:
+                yield (address, result)
+            for next_done in asyncio.as_completed(tasks):
+                key, result = await next_done
+                for address in pending[key]:
+                    yield (address, result)
+        finally:
+            # 调用方提前停止迭代时，取消尚未完成的查询
+            for task in tasks:
+                task.cancel()
+    
+    async def reverse(
+        self,
+        latitude: float,
+        longitude: float,
+        timeout: Optional[float] = None
+    ) -> Optional[Dict[str, any]]:
+        """
+        将经纬度转换为地名（反向地理编码）
+        Args:
+            latitude: 纬度
+            longitude: 经度
+            timeout: 截止时间（秒），默认使用 self.timeout
+        Returns:
+            地点字典（含 distance_km 距离），如果查询失败或超时则返回 None
+        """
+        local = self._reverse_local(latitude, longitude)
+        if local is not None:
+            return local
+        
+        async def fetch():
+            response = await self._get(self.reverse_url, _reverse_params(latitude, longitude))
+            return self._store_reverse(latitude, longitude, response.json())
+        
+        return await self._with_deadline(fetch(), timeout, f"{latitude}, {longitude}")
+    
+    async def get_coordinates(self, address: str, timeout: Optional[float] = None) -> Optional[tuple]:
+        """
+        简化版：只返回经纬度坐标
+        Args:
+            address: 要查询的地址
+            timeout: 截止时间（秒），默认使用 self.timeout
+        Returns:
+            (纬度, 经度) 元组，如果查询失败则返回 None
+        """
+        result = await self.geocode(address, timeout)
+        if result:
+            return (result["latitude"], result["longitude"])
+        return None
+
+
 def main():
     """命令行交互式地理编码工具"""
     print("🌍 OpenStreetMap 地理编码工具")
@@ -0,0 +1,195 @@
+"""
+对话历史管理
+按 token 预算保留系统提示词和最近几轮原文，更早的对话折叠为滚动摘要，
+使每轮发送给模型的提示词长度不随会话变长而增长
+"""
+
+import os
+from typing import Dict, List, Optional
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """
+    粗略估算文本的 token 数（中日韩字符约 1 token/字，其余约 4 字符/token）
+
+    Args:
+        text: 文本
+
+    Returns:
+        估算的 token 数
+    """
+    if not text:
+        return 0
+    cjk = sum(1 for char in text if '\u3000' <= char <= '\u9fff' or '\uff00' <= char <= '\uffef')
+    return cjk + (len(text) - cjk + 3) // 4 + 4    # 每条消息另加角色等格式开销
+
+
+def _clip(text: Optional[str], limit: int) -> str:
+    text = " ".join((text or "").split())
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+class ConversationHistory:
+    """
+    对话历史
+    每条消息的 token 估算在加入时计算并缓存；超出预算时把最早的完整轮次（用户提问及其回答）
+    折叠进摘要，摘要本身也有长度上限，超出时丢弃最早的摘要行。
+    消息只追加不修改，两次压缩之间每轮的提示词都是上一轮的前缀加新消息
+    """
+
+    def __init__(
+        self,
+        system_prompt: str,
+        token_budget: int = 3000,
+        keep_turns: int = 4,
+        summary_tokens: int = 400,
+        low_water: float = 0.6
+    ):
+        """
+        初始化对话历史
+
+        Args:
+            system_prompt: 系统提示词
+            token_budget: 每轮提示词（系统提示词 + 摘要 + 历史）的 token 预算
+            keep_turns: 始终保留原文的最近轮数
+            summary_tokens: 摘要的最大 token 数
+            low_water: 压缩时降到预算的比例；留出余量，使之后若干轮不必再次压缩，
+                       提示词前缀保持不变，模型服务端可以复用 KV 缓存
+        """
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self.summary_tokens = summary_tokens
+        self.low_water = low_water
+        self._system: Dict = {}
+        self._system_tokens = 0
+        self._turns: List[List[Dict]] = []   # 每轮：[用户消息, 助手消息...]
+        self._turn_tokens: List[int] = []
+        self._summary_lines: List[str] = []
+        self._summary_line_tokens: List[int] = []
+        self.set_system(system_prompt)
+
+        # 统计计数
+        self.compactions = 0
+        self.summarized_turns = 0
+
+    def set_system(self, content: str):
+        """
+        设置系统提示词
+
+        Args:
+            content: 系统提示词
+        """
+        if self._system.get("content") != content:
+            self._system = {"role": "system", "content": content}
+            self._system_tokens = estimate_tokens(content)
+
+    def add(self, role: str, content: Optional[str]):
+        """
+        添加一条消息；用户消息开始新的一轮
+
+        Args:
+            role: "user" 或 "assistant"
+            content: 消息内容
+        """
+        message = {"role": role, "content": content}
+        if role == "user" or not self._turns:
+            self._turns.append([])
+            self._turn_tokens.append(0)
+        self._turns[-1].append(message)
+        self._turn_tokens[-1] += estimate_tokens(content)
+        self._compact()
+
+    def _summary_message(self) -> Optional[Dict]:
+        if not self._summary_lines:
+            return None
+        return {
+            "role": "system",
+            "content": "Earlier conversation (summary):\n" + "\n".join(self._summary_lines)
+        }
+
+    def tokens(self) -> int:
+        """
+        返回当前提示词的估算 token 数
+
+        Returns:
+            token 数
+        """
+        summary = sum(self._summary_line_tokens) + 8 if self._summary_lines else 0
+        return self._system_tokens + summary + sum(self._turn_tokens)
+
+    def _compact(self):
+        """超出预算时把最早的轮次折叠进摘要，一次降到 low_water 以下"""
+        if self.tokens() <= self.token_budget:
+            return
+        folded = 0
+        while self.tokens() > self.token_budget * self.low_water and len(self._turns) > self.keep_turns:
+            turn = self._turns.pop(0)
+            self._turn_tokens.pop(0)
+            self._summarize(turn)
+            folded += 1
+        if folded:
+            self.compactions += 1
+            self.summarized_turns += folded
+
+    def _summarize(self, turn: List[Dict]):
+        """抽取一轮对话的要点加入摘要"""
+        question = next((m["content"] for m in turn if m["role"] == "user"), "")
+        answer = next((m["content"] for m in reversed(turn) if m["role"] == "assistant"), "")
+        line = f"- user: {_clip(question, 80)}"
+        if answer:
+            line += f" | assistant: {_clip(answer, 120)}"
+        self._summary_lines.append(line)
+        self._summary_line_tokens.append(estimate_tokens(line))
+        while sum(self._summary_line_tokens) > self.summary_tokens and len(self._summary_lines) > 1:
+            self._summary_lines.pop(0)
+            self._summary_line_tokens.pop(0)
+
+    def messages(self) -> List[Dict]:
+        """
+        返回发送给模型的消息列表（新列表，调用方可自由追加）
+
+        Returns:
+            [系统提示词, 摘要（如有）, 最近轮次的消息...]
+        """
+        result = [self._system]
+        summary = self._summary_message()
+        if summary is not None:
+            result.append(summary)
+        for turn in self._turns:
+            result.extend(turn)
+        return result
+
+    def stats(self) -> Dict:
+        """
+        返回历史统计信息
+
+        Returns:
+            包含保留轮数、摘要行数、折叠次数和当前 token 估算的字典
+        """
+        return {
+            "turns": len(self._turns),
+            "summary_lines": len(self._summary_lines),
+            "compactions": self.compactions,
+            "summarized_turns": self.summarized_turns,
+            "tokens": self.tokens()
+        }
+
+
+def create_history(system_prompt: str) -> ConversationHistory:
+    """
+    按环境变量创建对话历史
+    可通过 HISTORY_TOKEN_BUDGET、HISTORY_KEEP_TURNS、HISTORY_SUMMARY_TOKENS、HISTORY_LOW_WATER 配置
+
+    Args:
+        system_prompt: 系统提示词
+
+    Returns:
+        ConversationHistory 实例
+    """
+    return ConversationHistory(
+        system_prompt,
+        token_budget=int(os.getenv("HISTORY_TOKEN_BUDGET", 3000)),
+        keep_turns=int(os.getenv("HISTORY_KEEP_TURNS", 4)),
+        summary_tokens=int(os.getenv("HISTORY_SUMMARY_TOKENS", 400)),
+        low_water=float(os.getenv("HISTORY_LOW_WATER", 0.6))
+    )
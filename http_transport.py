@@ -0,0 +1,211 @@
+"""
+共享 HTTP 传输层
+基于 requests.Session 的按主机连接池，复用 keep-alive 连接，避免每次请求重新握手；
+异步版本基于 httpx.AsyncClient
+"""
+
+import asyncio
+import os
+import threading
+import weakref
+from typing import Dict, Optional, Tuple
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class HttpTransport:
+    """
+    带连接池和重试策略的 HTTP 传输
+    同一主机的请求复用已建立的 TCP/TLS 连接
+    """
+
+    def __init__(
+        self,
+        pool_connections: int = 10,
+        pool_maxsize: int = 10,
+        max_retries: int = 2,
+        backoff_factor: float = 0.5,
+        retry_statuses: Tuple[int, ...] = (500, 502, 503, 504)
+    ):
+        """
+        初始化传输层
+
+        Args:
+            pool_connections: 缓存的主机连接池数量
+            pool_maxsize: 每个主机连接池的最大连接数
+            max_retries: 连接错误和 retry_statuses 响应的最大重试次数
+            backoff_factor: 重试退避系数（秒）
+            retry_statuses: 在传输层重试的响应状态码。429 从不在传输层重试；
+                受限流的服务应传入空元组，由调用方经限流器重新排队，避免重试绕过限流
+        """
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=retry_statuses,
+            # 否则 urllib3 仍会重试带 Retry-After 的 429
+            respect_retry_after_header=False,
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False
+        )
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+
+    def get(
+        self,
+        url: str,
+        params: Optional[Dict] = None,
+        headers: Optional[Dict] = None,
+        timeout: float = 30
+    ) -> requests.Response:
+        """
+        发送 GET 请求（接口与 requests.get 一致）
+
+        Args:
+            url: 请求地址
+            params: 查询参数
+            headers: 额外的请求头
+            timeout: 超时时间（秒）
+
+        Returns:
+            requests.Response 对象
+        """
+        return self.session.get(url, params=params, headers=headers, timeout=timeout)
+
+    def stats(self) -> Dict:
+        """
+        返回连接池统计信息（仅统计仍在缓存中的主机连接池）
+
+        Returns:
+            包含请求数、新建连接（握手）数和复用次数的字典
+        """
+        pools = self.adapter.poolmanager.pools
+        requests_count = 0
+        handshakes = 0
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            requests_count += pool.num_requests
+            handshakes += pool.num_connections
+        return {
+            "hosts": len(pools),
+            "requests": requests_count,
+            "handshakes": handshakes,
+            "reused": max(0, requests_count - handshakes)
+        }
+
+    def close(self):
+        """关闭所有连接"""
+        self.session.close()
+
+
+_default_transport = None
+_default_transport_lock = threading.Lock()
+
+
+def get_default_transport() -> HttpTransport:
+    """
+    获取进程内共享的默认传输层（首次调用时创建）
+    可通过 HTTP_POOL_CONNECTIONS、HTTP_POOL_MAXSIZE、HTTP_MAX_RETRIES 环境变量配置
+
+    Returns:
+        HttpTransport 实例
+    """
+    global _default_transport
+    with _default_transport_lock:
+        if _default_transport is None:
+            _default_transport = HttpTransport(
+                pool_connections=int(os.getenv("HTTP_POOL_CONNECTIONS", 10)),
+                pool_maxsize=int(os.getenv("HTTP_POOL_MAXSIZE", 10)),
+                max_retries=int(os.getenv("HTTP_MAX_RETRIES", 2))
+            )
+        return _default_transport
+
+
+class AsyncHttpTransport:
+    """
+    异步 HTTP 传输（httpx.AsyncClient 连接池）
+    绑定创建它的事件循环，同一事件循环内的所有协程共享连接
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        max_retries: int = 2
+    ):
+        """
+        初始化异步传输层
+
+        Args:
+            max_connections: 最大并发连接数
+            max_keepalive_connections: 保持空闲的 keep-alive 连接数
+            max_retries: 连接失败时的重试次数
+        """
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections
+            ),
+            transport=httpx.AsyncHTTPTransport(retries=max_retries),
+            headers={"Accept-Encoding": "gzip, deflate"}
+        )
+        self.requests = 0
+
+    async def get(
+        self,
+        url: str,
+        params: Optional[Dict] = None,
+        headers: Optional[Dict] = None,
+        timeout: float = 30
+    ) -> httpx.Response:
+        """
+        发送 GET 请求
+
+        Args:
+            url: 请求地址
+            params: 查询参数
+            headers: 额外的请求头
+            timeout: 超时时间（秒）
+
+        Returns:
+            httpx.Response 对象
+        """
+        self.requests += 1
+        return await self.client.get(url, params=params, headers=headers, timeout=timeout)
+
+    async def aclose(self):
+        """关闭所有连接"""
+        await self.client.aclose()
+
+
+_async_transports: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncHttpTransport]" = weakref.WeakKeyDictionary()
+
+
+def get_default_async_transport() -> AsyncHttpTransport:
+    """
+    获取当前事件循环共享的默认异步传输层（每个事件循环一个）
+    可通过 HTTP_ASYNC_MAX_CONNECTIONS、HTTP_MAX_RETRIES 环境变量配置
+
+    Returns:
+        AsyncHttpTransport 实例
+    """
+    loop = asyncio.get_running_loop()
+    transport = _async_transports.get(loop)
+    if transport is None:
+        transport = AsyncHttpTransport(
+            max_connections=int(os.getenv("HTTP_ASYNC_MAX_CONNECTIONS", 100)),
+            max_retries=int(os.getenv("HTTP_MAX_RETRIES", 2))
+        )
+        _async_transports[loop] = transport
+    return transport
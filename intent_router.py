@@ -0,0 +1,157 @@
+"""
+本地意图路由
+用预编译的中英文正则识别控制指令（切换语言、开关 thinking、退出、返回菜单），
+命中时直接在本地执行对应工具，无需调用模型；无法确定的输入交给模型处理
+同一次路由中顺带识别输入语言，调用方无需再单独检测
+"""
+
+import logging
+import re
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 忽略首尾空白和常见标点，例如 "退出！"、"Exit."
+_STRIP = " \t\r\n.!?。！？~～,，;；"
+
+# (正则, 工具名, 参数)；正则须匹配整句，只含指令本身的输入才会命中
+_PATTERNS = [
+    (r"(请)?(帮我)?(切换|换|改)(到|成|为)?(英文|英语)(模式|界面)?(吧)?", "switch_language", {"language": "en"}),
+    (r"(请)?(帮我)?(切换|换|改)(到|成|为)?(中文|汉语|普通话)(模式|界面)?(吧)?", "switch_language", {"language": "cn"}),
+    (r"(please )?(switch|change) (the language )?to english( please)?|english (mode|please)", "switch_language", {"language": "en"}),
+    (r"(please )?(switch|change) (the language )?to chinese( please)?|chinese (mode|please)", "switch_language", {"language": "cn"}),
+    (r"(请)?(开启|打开|显示)\s*(thinking|思考(过程)?)(显示)?", "toggle_thinking", {"enabled": True}),
+    (r"(请)?(关闭|关掉|隐藏)\s*(thinking|思考(过程)?)(显示)?", "toggle_thinking", {"enabled": False}),
+    (r"(please )?(enable|turn on|show) (the )?thinking( display)?", "toggle_thinking", {"enabled": True}),
+    (r"(please )?(disable|turn off|hide) (the )?thinking( display)?", "toggle_thinking", {"enabled": False}),
+    (r"退出(程序)?|再见|拜拜|exit|quit|bye|goodbye", "navigate", {"action": "exit"}),
+    (r"返回(主)?菜单|回到(主)?菜单|(return|go back|back)( to)?( the)?( main)? menu|menu", "navigate", {"action": "menu"}),
+]
+
+# 含中文字符即视为中文输入
+_CJK = re.compile("[\u4e00-\u9fff]")
+
+_COMPILED = [
+    (re.compile(pattern, re.IGNORECASE), tool_name, arguments)
+    for pattern, tool_name, arguments in _PATTERNS
+]
+
+
+def detect_language(text: str) -> str:
+    """
+    检测用户输入的语言
+
+    Args:
+        text: 用户输入文本
+
+    Returns:
+        'cn' 或 'en'
+    """
+    return "cn" if _CJK.search(text) else "en"
+
+
+class IntentRouter:
+    """
+    控制指令路由器
+    记录命中率，并按模型调用的平均耗时估算节省的时间
+    """
+
+    def __init__(self, default_llm_latency: float = 3.0):
+        """
+        初始化路由器
+
+        Args:
+            default_llm_latency: 尚未测得模型耗时时使用的估计值（秒）
+        """
+        self._lock = threading.Lock()
+        self.llm_latency = default_llm_latency
+        self._llm_samples = 0
+
+        # 统计计数
+        self.lookups = 0
+        self.hits = 0
+        self.saved_seconds = 0.0
+
+    def route(self, text: str) -> Tuple[str, Optional[Tuple[str, Dict]]]:
+        """
+        识别输入语言和控制指令
+
+        Args:
+            text: 用户输入
+
+        Returns:
+            (语言 'cn'/'en', (工具名, 参数))，不是明确的控制指令时第二项为 None
+        """
+        start = time.perf_counter()
+        normalized = " ".join(text.strip(_STRIP).split())
+        language = detect_language(normalized)
+        match = None
+        for pattern, tool_name, arguments in _COMPILED:
+            if pattern.fullmatch(normalized):
+                match = (tool_name, dict(arguments))
+                break
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self.lookups += 1
+            if match is None:
+                return language, None
+            self.hits += 1
+            saved = max(0.0, self.llm_latency - elapsed)
+            self.saved_seconds += saved
+            hit_rate = self.hits / self.lookups
+        logger.info(
+            "intent router hit: %s %s in %.1f us, saved ~%.2fs (hit rate %.0f%%, total saved %.1fs)",
+            match[0], match[1], elapsed * 1e6, saved, hit_rate * 100, self.saved_seconds
+        )
+        return language, match
+
+    def record_llm_latency(self, seconds: float):
+        """
+        记录一次模型调用耗时（指数移动平均），用于估算节省的时间
+
+        Args:
+            seconds: 本轮模型调用耗时（秒）
+        """
+        with self._lock:
+            if self._llm_samples == 0:
+                self.llm_latency = seconds
+            else:
+                self.llm_latency = 0.8 * self.llm_latency + 0.2 * seconds
+            self._llm_samples += 1
+
+    def stats(self) -> Dict:
+        """
+        返回路由统计信息
+
+        Returns:
+            包含查询次数、命中次数、命中率和估算节省时间的字典
+        """
+        with self._lock:
+            return {
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "llm_latency": self.llm_latency,
+                "saved_seconds": self.saved_seconds
+            }
+
+
+_default_router = None
+_default_router_lock = threading.Lock()
+
+
+def get_default_router() -> IntentRouter:
+    """
+    获取进程内共享的默认路由器
+
+    Returns:
+        IntentRouter 实例
+    """
+    global _default_router
+    with _default_router_lock:
+        if _default_router is None:
+            _default_router = IntentRouter()
+        return _default_router
@@ -0,0 +1,257 @@
+"""
+模型回答缓存
+以规范化后的对话状态（模型、消息、工具定义、temperature）的哈希为键，完全相同的请求
+直接返回上次的回答，跳过推理。内存 LRU，可选 SQLite 持久化；每条记录的有效期由调用方
+按本轮用到的工具数据的新鲜度决定
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+
+def _normalize_text(text: Optional[str]) -> str:
+    text = unicodedata.normalize("NFKC", text or "")
+    return " ".join(text.split())
+
+
+def _canonical_json(text: Optional[str]) -> str:
+    """JSON 文本按键排序重新序列化，非 JSON 时按普通文本规范化"""
+    try:
+        return json.dumps(json.loads(text), ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    except (TypeError, ValueError):
+        return _normalize_text(text)
+
+
+def normalize_messages(messages: List[Dict]) -> List[Dict]:
+    """
+    规范化消息列表：统一全角/半角字符和空白，工具调用参数按键排序，
+    去掉每次请求都不同的工具调用 ID
+
+    Args:
+        messages: chat.completions 格式的消息列表
+
+    Returns:
+        只含影响回答内容的字段的新列表
+    """
+    normalized = []
+    for message in messages:
+        item = {"role": message["role"]}
+        if message["role"] == "tool":
+            item["content"] = _canonical_json(message.get("content"))
+        else:
+            item["content"] = _normalize_text(message.get("content"))
+        if message.get("tool_calls"):
+            item["tool_calls"] = [
+                [call["function"]["name"], _canonical_json(call["function"]["arguments"])]
+                for call in message["tool_calls"]
+            ]
+        normalized.append(item)
+    return normalized
+
+
+def make_cache_key(model: str, messages: List[Dict], tools: Optional[List[Dict]], temperature: float) -> str:
+    """
+    计算缓存键
+
+    Args:
+        model: 模型名称
+        messages: 消息列表
+        tools: 工具定义（可选）
+        temperature: 采样温度
+
+    Returns:
+        SHA-256 十六进制字符串
+    """
+    state = [model, normalize_messages(messages), tools or [], temperature]
+    payload = json.dumps(state, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    模型回答缓存
+    内存中按 LRU 保留最近的条目；指定 path 时同时写入 SQLite，
+    内存未命中时查询磁盘，进程重启后仍可命中
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 600, path: Optional[str] = None):
+        """
+        初始化缓存
+
+        Args:
+            max_entries: 最大条目数（内存和磁盘各自按最近访问淘汰）
+            ttl: 默认有效期（秒），也是单条记录有效期的上限
+            path: SQLite 文件路径，None 表示仅内存
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self._entries: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = self._connect(path) if path else None
+
+        # 统计计数
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def _connect(self, path: str) -> Optional[sqlite3.Connection]:
+        """打开数据库并建表，文件不可用时只使用内存缓存"""
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_access ON llm_cache (last_access)")
+            return conn
+        except (OSError, sqlite3.Error) as e:
+            print(f"模型回答磁盘缓存不可用，仅使用内存缓存: {e}")
+            self.path = None
+            return None
+
+    def get(self, key: str) -> Optional[Dict]:
+        """
+        查询缓存
+
+        Args:
+            key: 缓存键（见 make_cache_key）
+
+        Returns:
+            缓存的回答数据，未命中或已过期时返回 None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT value, expires_at FROM llm_cache WHERE key = ? AND expires_at > ?",
+                    (key, now)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+                    value = json.loads(row[0])
+                    self._remember(key, row[1], value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: Dict, ttl: Optional[float] = None):
+        """
+        写入缓存
+
+        Args:
+            key: 缓存键
+            value: 可 JSON 序列化的回答数据
+            ttl: 有效期（秒），不超过默认有效期；None 使用默认有效期
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        now = time.time()
+        with self._lock:
+            self._remember(key, now + ttl, value)
+            self.stores += 1
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), now + ttl, now)
+                )
+                self._conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN ("
+                    " SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+
+    def _remember(self, key: str, expires_at: float, value: Dict):
+        """写入内存 LRU（调用方需持有锁）"""
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM llm_cache")
+
+    def stats(self) -> Dict:
+        """
+        返回缓存统计信息
+
+        Returns:
+            包含命中（其中磁盘命中）、未命中、写入、淘汰次数和内存条目数的字典
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "size": len(self._entries)
+            }
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_llm_cache() -> Optional[LLMResponseCache]:
+    """
+    获取进程内共享的默认回答缓存（LLM_CACHE=1 时开启）
+    可通过 LLM_CACHE_TTL、LLM_CACHE_MAX_ENTRIES、LLM_CACHE_PATH（设置后持久化到该 SQLite 文件）配置
+
+    Returns:
+        LLMResponseCache 实例，未开启时返回 None
+    """
+    global _default_cache
+    if os.getenv("LLM_CACHE", "0") != "1":
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            path = os.getenv("LLM_CACHE_PATH")
+            _default_cache = LLMResponseCache(
+                max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", 256)),
+                ttl=float(os.getenv("LLM_CACHE_TTL", 600)),
+                path=os.path.expanduser(path) if path else None
+            )
+        return _default_cache
@@ -0,0 +1,181 @@
+"""
+模型请求调度
+限制同时发往模型服务的请求数，超出时按优先级排队（交互式对话先于批量任务）；
+排队超过期限或队列已满时立即失败，而不是让请求堆积在模型服务端互相拖慢
+"""
+
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+# 优先级：数值越小越先执行
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+
+class SchedulerTimeout(TimeoutError):
+    """排队超过期限或队列已满（继承 TimeoutError，调用方按超时处理）"""
+
+
+class _Waiter:
+    __slots__ = ("event", "granted", "cancelled")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+        self.cancelled = False
+
+
+class LLMScheduler:
+    """
+    并发上限 + 优先级队列
+    空闲时直接执行；否则进入按 (优先级, 到达顺序) 排序的队列，
+    有请求完成时把执行名额交给队首
+    """
+
+    def __init__(self, max_concurrency: int = 2, max_queue: int = 64, deadline: float = 30):
+        """
+        初始化调度器
+
+        Args:
+            max_concurrency: 同时执行的模型请求数上限（与 Ollama 的 OLLAMA_NUM_PARALLEL 相当为宜）
+            max_queue: 最大排队数，超出时新请求立即失败
+            deadline: 默认排队期限（秒）
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.deadline = deadline
+        self._lock = threading.Lock()
+        self._queue = []    # [(优先级, 序号, _Waiter)]
+        self._queued = 0    # 未取消的排队数
+        self._sequence = itertools.count()
+        self._running = 0
+        self._waits = deque(maxlen=1000)
+
+        # 统计计数
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.max_queue_depth = 0
+
+    def acquire(self, priority: int = PRIORITY_INTERACTIVE, deadline: Optional[float] = None) -> float:
+        """
+        获取执行名额（阻塞直到获得名额或超过排队期限）
+
+        Args:
+            priority: 优先级，数值越小越先执行
+            deadline: 排队期限（秒），None 使用默认值
+
+        Returns:
+            排队等待时间（秒）
+
+        Raises:
+            SchedulerTimeout: 队列已满或排队超过期限
+        """
+        deadline = self.deadline if deadline is None else deadline
+        started = time.monotonic()
+        with self._lock:
+            if self._running < self.max_concurrency and self._queued == 0:
+                self._running += 1
+                self._waits.append(0.0)
+                return 0.0
+            if self._queued >= self.max_queue:
+                self.rejected += 1
+                raise SchedulerTimeout(f"LLM queue full ({self._queued} waiting)")
+            waiter = _Waiter()
+            heapq.heappush(self._queue, (priority, next(self._sequence), waiter))
+            self._queued += 1
+            self.max_queue_depth = max(self.max_queue_depth, self._queued)
+
+        waiter.event.wait(deadline)
+        with self._lock:
+            waited = time.monotonic() - started
+            if not waiter.granted:
+                waiter.cancelled = True
+                self._queued -= 1
+                self.timed_out += 1
+                raise SchedulerTimeout(f"LLM queue wait exceeded {deadline:g}s")
+            self._waits.append(waited)
+            return waited
+
+    def release(self):
+        """归还执行名额，交给队首的请求"""
+        with self._lock:
+            self.completed += 1
+            while self._queue:
+                _, _, waiter = heapq.heappop(self._queue)
+                if waiter.cancelled:
+                    continue
+                self._queued -= 1
+                waiter.granted = True
+                waiter.event.set()
+                return
+            self._running -= 1
+
+    @contextmanager
+    def slot(self, priority: int = PRIORITY_INTERACTIVE, deadline: Optional[float] = None) -> Iterator[float]:
+        """
+        在执行名额内运行一段代码
+
+        Args:
+            priority: 优先级
+            deadline: 排队期限（秒）
+
+        Yields:
+            排队等待时间（秒）
+        """
+        waited = self.acquire(priority, deadline)
+        try:
+            yield waited
+        finally:
+            self.release()
+
+    def stats(self) -> Dict:
+        """
+        返回调度统计信息
+
+        Returns:
+            包含执行中和排队中的请求数、完成/拒绝/超时次数和最近排队时间（平均、p95、最大）的字典
+        """
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                "running": self._running,
+                "queue_depth": self._queued,
+                "max_queue_depth": self.max_queue_depth,
+                "max_concurrency": self.max_concurrency,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "wait_avg": sum(waits) / len(waits) if waits else 0.0,
+                "wait_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+                "wait_max": waits[-1] if waits else 0.0
+            }
+
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+
+def get_default_scheduler() -> LLMScheduler:
+    """
+    获取进程内共享的默认调度器
+    可通过 LLM_MAX_CONCURRENCY、LLM_MAX_QUEUE、LLM_QUEUE_DEADLINE 环境变量配置
+
+    Returns:
+        LLMScheduler 实例
+    """
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = LLMScheduler(
+                max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", 2)),
+                max_queue=int(os.getenv("LLM_MAX_QUEUE", 64)),
+                deadline=float(os.getenv("LLM_QUEUE_DEADLINE", 30))
+            )
+        return _default_scheduler
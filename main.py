@@ -1,32 +1,64 @@
+import json
+import logging
 import os
-import readline  # 支持方向键、历史记录等输入增强功能
-from openai import OpenAI
-from dotenv import load_dotenv
-from geocoding import NominatimGeocoder
-from weather import OpenMeteoWeather
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from types import SimpleNamespace
+from typing import TYPE_CHECKING
+from history import create_history
+from intent_router import get_default_router
+from llm_cache import get_default_llm_cache, make_cache_key
+from llm_scheduler import get_default_scheduler
+from session import Session, default_settings
 from textD import TEXTS
+from warmup import create_warmer
 
-# 加载环境变量
-load_dotenv()
+# openai、requests、httpx 以及地理编码/天气模块在首次使用时才导入，启动时只加载轻量模块，
+# 欢迎信息可以立即显示（用 bench_startup.py 测量）；dotenv 和 readline 只在入口函数中加载
+if TYPE_CHECKING:
+    from weather import OpenMeteoWeather
 
-# 配置 readline 以支持更好的输入体验
-# 启用 Tab 补全和历史记录功能
-readline.parse_and_bind('tab: complete')
-readline.parse_and_bind('set editing-mode emacs')  # Emacs 编辑模式（支持 Ctrl+A/E 等快捷键）
+logger = logging.getLogger("agent")
 
-# 配置 OpenAI Client 连接到本地 Ollama
-client = OpenAI(
-    base_url=os.getenv("OLLAMA_BASE_URL", "http://localhost:11434/v1"),
-    api_key=os.getenv("OLLAMA_API_KEY", "ollama")  # Ollama 不需要真实 API key，但 OpenAI 库要求提供
-)
+# OpenAI Client 连接到本地 Ollama（首次调用模型时创建，见 get_client）
+client = None
+_client_lock = threading.Lock()
 
-MODEL_NAME = os.getenv("MODEL_NAME", "qwen3:8b")
 
-# 全局设置
-SETTINGS = {
-    "language": "cn",  # 可选: "cn", "en"
-    "show_thinking": False  # 是否显示 AI thinking 过程
-}
+def _read_config():
+    """从环境变量读取模块配置（导入时读取一次，load_config 加载 .env 后重新读取）"""
+    global OLLAMA_BASE_URL, MODEL_NAME, TOOL_MAX_WORKERS, TOOL_TIMEOUT, COMPACT_TOOL_RESULTS, WEATHER_PREFETCH
+    OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434/v1")
+    MODEL_NAME = os.getenv("MODEL_NAME", "qwen3:8b")
+
+    # 同一轮中多个工具调用并发执行的线程数和单个工具的超时时间（秒）
+    TOOL_MAX_WORKERS = int(os.getenv("TOOL_MAX_WORKERS", 4))
+    TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", 60))
+
+    # 工具结果格式：compact（默认：仅当前语言、短键名、数值保留一位小数）或 full（中英双语完整字段）
+    COMPACT_TOOL_RESULTS = os.getenv("TOOL_RESULT_FORMAT", "compact") != "full"
+
+    # 地理编码成功后是否在后台预取该地天气（模型下一步通常会调用 get_weather）
+    WEATHER_PREFETCH = os.getenv("WEATHER_PREFETCH", "1") != "0"
+
+
+_read_config()
+
+
+def load_config():
+    """
+    加载 .env 中的环境变量并重新读取模块配置
+    命令行和 server 的入口函数在创建客户端、预热器之前调用；仅导入本模块时不读取 .env
+    """
+    from dotenv import load_dotenv
+    load_dotenv()
+    _read_config()
+    SETTINGS.update(default_settings())
+
+
+# 命令行会话的设置（language / show_thinking / stream）；其他会话各自持有 Session
+SETTINGS = default_settings()
 
 # 系统提示词 - 精简版
 SYSTEM_PROMPT = """你是一个智能助手，支持中英文双语交互。
@@ -34,21 +66,22 @@ SYSTEM_PROMPT = """你是一个智能助手，支持中英文双语交互。
 **核心功能：**
 1. 自然对话：回答各类问题
 2. 地理查询：使用 geocode_address 工具查询地址坐标
-3. 天气查询：使用 get_weather 工具获取天气信息和穿衣建议
-4. 语言切换：使用 switch_language 工具切换界面语言（cn/en）
-5. Thinking 开关：使用 toggle_thinking 工具控制思考过程显示
-6. 导航控制：使用 navigate 工具退出或返回
+3. 地点反查：使用 reverse_geocode 工具根据坐标查询地名
+4. 天气查询：使用 weather_for_address 工具按地名一次获取坐标、天气和穿衣建议；已知坐标时使用 get_weather
+5. 语言切换：使用 switch_language 工具切换界面语言（cn/en）
+6. Thinking 开关：使用 toggle_thinking 工具控制思考过程显示
+7. 导航控制：使用 navigate 工具退出或返回
 
 **语言一致性规则（重要）：**
 - 用户用中文提问 → 必须用纯中文回答
 - User asks in English → Must reply in pure English ONLY
-- 根据 current_language 参数匹配输出语言（cn=中文，en=English）
+- 根据用户消息末尾的 [current_language: cn/en] 标记匹配输出语言（cn=中文，en=English）
 - 严禁中英文混杂（如："天气 / Weather"）
 
-**工具串联使用（关键）：**
+**天气查询（关键）：**
 当用户询问某地天气或穿衣建议时：
-1. 先调用 geocode_address 获取坐标和完整地名
-2. 再调用 get_weather 查询天气数据
+1. 直接调用 weather_for_address（一次返回完整地名、坐标和天气数据），无需先调用 geocode_address
+2. 比较多个城市时，在同一轮中为每个城市各调用一次 weather_for_address
 3. 以清晰、结构化的格式展示结果（包含地点、坐标、天气、温度、建议等）
 
 **天气展示要求：**
@@ -75,6 +108,28 @@ GEOCODING_TOOL = {
     }
 }
 
+REVERSE_GEOCODING_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "reverse_geocode",
+        "description": "将经纬度坐标转换为地名（反向地理编码）。返回最近的已知地点名称、地址和距离（公里）。",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "latitude": {
+                    "type": "number",
+                    "description": "纬度坐标，例如：39.9042"
+                },
+                "longitude": {
+                    "type": "number",
+                    "description": "经度坐标，例如：116.4074"
+                }
+            },
+            "required": ["latitude", "longitude"]
+        }
+    }
+}
+
 WEATHER_TOOL = {
     "type": "function",
     "function": {
@@ -102,6 +157,29 @@ WEATHER_TOOL = {
     }
 }
 
+WEATHER_FOR_ADDRESS_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "weather_for_address",
+        "description": "根据地名直接获取天气信息（内部完成地理编码），返回完整地名、坐标、当前天气、未来预报和穿衣建议。询问某地天气时优先使用。",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "address": {
+                    "type": "string",
+                    "description": "地名或地址，可以是中文或英文，例如：'上海'、'Dallas, TX'"
+                },
+                "forecast_days": {
+                    "type": "integer",
+                    "description": "预报天数（1-7天），默认为 3 天",
+                    "default": 3
+                }
+            },
+            "required": ["address"]
+        }
+    }
+}
+
 LANGUAGE_TOOL = {
     "type": "function",
     "function": {
@@ -158,60 +236,256 @@ NAVIGATE_TOOL = {
     }
 }
 
-TOOLS = [GEOCODING_TOOL, WEATHER_TOOL, LANGUAGE_TOOL, THINKING_TOOL, NAVIGATE_TOOL]
+TOOLS = [GEOCODING_TOOL, REVERSE_GEOCODING_TOOL, WEATHER_TOOL, WEATHER_FOR_ADDRESS_TOOL, LANGUAGE_TOOL, THINKING_TOOL, NAVIGATE_TOOL]
+
+# 修改全局设置的控制类工具：按原顺序在当前线程执行，不进入线程池
+CONTROL_TOOLS = {"switch_language", "toggle_thinking", "navigate"}
 
-def detect_language(text: str) -> str:
+_tool_executor = None
+_tool_executor_lock = threading.Lock()
+
+def get_client():
     """
-    检测用户输入的语言
-    Args:
-        text: 用户输入文本
+    获取 OpenAI Client（首次调用时导入 openai 并创建）
+
     Returns:
-        'cn' 或 'en'
+        OpenAI 实例
     """
-    # 统计中文字符数量
-    chinese_chars = sum(1 for char in text if '\u4e00' <= char <= '\u9fff')
-    # 统计英文字母数量
-    english_chars = sum(1 for char in text if char.isalpha() and char.isascii())
-    
-    # 如果有中文字符，判断为中文
-    if chinese_chars > 0:
-        return 'cn'
-    
-    # 如果只有英文或其他字符，判断为英文
-    return 'en'
+    global client
+    with _client_lock:
+        if client is None:
+            from openai import OpenAI
+            client = OpenAI(
+                base_url=OLLAMA_BASE_URL,
+                api_key=os.getenv("OLLAMA_API_KEY", "ollama")  # Ollama 不需要真实 API key，但 OpenAI 库要求提供
+            )
+        return client
+
+
+# 回答依赖实时天气数据的工具；缓存这类回答时，有效期不超过天气数据的下一个模型更新时刻
+WEATHER_TOOLS = {"get_weather", "weather_for_address"}
+
+# 命令行模式使用的默认会话；未显式传入 session 的调用都作用于它
+DEFAULT_SESSION = Session(settings=SETTINGS, client_factory=lambda: get_client(), session_id="cli")
+
 
-def t(key: str, **kwargs) -> str:
+def get_tool_executor() -> ThreadPoolExecutor:
     """
-    获取当前语言的文本
+    获取工具调用共享的线程池（首次调用时创建，大小由 TOOL_MAX_WORKERS 配置）
+    Returns:
+        ThreadPoolExecutor 实例
+    """
+    global _tool_executor
+    with _tool_executor_lock:
+        if _tool_executor is None:
+            _tool_executor = ThreadPoolExecutor(max_workers=TOOL_MAX_WORKERS, thread_name_prefix="tool")
+        return _tool_executor
+
+def t(key: str, session: Session = None, **kwargs) -> str:
+    """
+    获取会话当前语言的文本
     Args:
         key: 文本键
+        session: 会话上下文（默认为命令行会话）
         **kwargs: 格式化参数
     Returns:
         格式化后的文本
     """
-    lang = SETTINGS['language']
+    lang = (session or DEFAULT_SESSION).language
     text = TEXTS.get(key, {}).get(lang, key)
     if kwargs:
         return text.format(**kwargs)
     return text
 
-def execute_tool(tool_name: str, arguments: dict) -> str:
+def with_language_tag(user_input: str, session: Session = None) -> str:
+    """
+    在用户消息末尾附加当前语言标记
+    每轮变化的状态放在提示词末尾，系统提示词和工具定义组成的前缀逐字节不变，
+    模型服务端可以跨轮复用 KV 缓存
+    Args:
+        user_input: 用户输入
+        session: 会话上下文（默认为命令行会话）
+    Returns:
+        附加语言标记后的消息内容
+    """
+    return f"{user_input}\n[current_language: {(session or DEFAULT_SESSION).language}]"
+
+def parse_coordinates(arguments: dict) -> tuple:
+    """
+    校验并解析工具参数中的经纬度
+    Args:
+        arguments: 工具参数（包含 latitude、longitude）
+    Returns:
+        (纬度, 经度, 错误信息) - 校验通过时错误信息为 None
+    """
+    latitude = arguments.get("latitude")
+    longitude = arguments.get("longitude")
+    
+    if latitude is None or longitude is None:
+        return (None, None, "Missing required parameters: latitude and longitude")
+    
+    try:
+        latitude = float(latitude)
+        longitude = float(longitude)
+    except (ValueError, TypeError):
+        return (None, None, f"Invalid coordinate values: latitude={latitude}, longitude={longitude}")
+    
+    # 范围检查
+    if not (-90 <= latitude <= 90):
+        return (None, None, f"Latitude must be between -90 and 90, got {latitude}")
+    
+    if not (-180 <= longitude <= 180):
+        return (None, None, f"Longitude must be between -180 and 180, got {longitude}")
+    
+    return (latitude, longitude, None)
+
+def _round(value):
+    """数值保留一位小数，整数去掉 .0（使工具结果更短且输出稳定）"""
+    if value is None:
+        return None
+    value = round(value, 1)
+    return int(value) if value == int(value) else value
+
+def build_compact_weather_payload(weather_api: "OpenMeteoWeather", latitude: float, longitude: float, forecast_days: int, result: dict, lang: str) -> dict:
+    """
+    将天气查询结果整理为紧凑的工具返回数据
+    只包含当前语言的文本，去掉重复字段，使用短键名；相同输入总是得到相同输出
+    Args:
+        weather_api: 天气查询器（用于天气描述、温度描述和穿衣建议）
+        latitude: 纬度
+        longitude: 经度
+        forecast_days: 预报天数
+        result: get_weather 返回的天气数据
+        lang: 语言代码（cn/en）
+    Returns:
+        工具结果字典（温度 °C、风速 km/h、降水 mm、湿度 %）
+    """
+    current = result["current"]
+    return {
+        "ok": True,
+        "lat": round(latitude, 4),
+        "lon": round(longitude, 4),
+        "now": {
+            "sky": weather_api._get_weather_description(current["weather_code"], lang),
+            "temp": _round(current["temperature"]),
+            "feels": _round(current["feels_like"]),
+            "hum": _round(current["humidity"]),
+            "wind": _round(current["wind_speed"]),
+            "precip": _round(current["precipitation"]),
+            "feel_desc": weather_api.get_temperature_description(current["temperature"], lang)
+        },
+        "advice": weather_api.get_clothing_advice(current["temperature"], current["weather_code"], lang),
+        "days": [
+            {
+                "date": day["date"],
+                "sky": weather_api._get_weather_description(day["weather_code"], lang),
+                "lo": _round(day["temp_min"]),
+                "hi": _round(day["temp_max"]),
+                "precip": _round(day["precipitation"])
+            }
+            for day in result["forecast"][:forecast_days]
+        ]
+    }
+
+def dump_tool_result(payload: dict) -> str:
+    """
+    序列化工具结果；紧凑格式下去掉多余空白
+    Args:
+        payload: 工具结果字典
+    Returns:
+        JSON 字符串
+    """
+    if COMPACT_TOOL_RESULTS:
+        return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    return json.dumps(payload, ensure_ascii=False)
+
+def build_weather_payload(weather_api: "OpenMeteoWeather", latitude: float, longitude: float, forecast_days: int, result: dict, session: Session = None) -> dict:
+    """
+    将天气查询结果整理为工具返回数据（格式由 TOOL_RESULT_FORMAT 决定）
+    Args:
+        weather_api: 天气查询器（用于温度描述和穿衣建议）
+        latitude: 纬度
+        longitude: 经度
+        forecast_days: 预报天数
+        result: get_weather 返回的天气数据
+        session: 会话上下文（决定紧凑格式的语言，默认为命令行会话）
+    Returns:
+        工具结果字典
+    """
+    if COMPACT_TOOL_RESULTS:
+        return build_compact_weather_payload(
+            weather_api, latitude, longitude, forecast_days, result, (session or DEFAULT_SESSION).language
+        )
+    
+    current = result["current"]
+    forecast = result["forecast"][:forecast_days]
+    
+    # 获取当天的温度区间（从预报数据中获取）
+    today_forecast = forecast[0] if forecast else None
+    temp_range = None
+    if today_forecast:
+        temp_range = {
+            "min": today_forecast["temp_min"],
+            "max": today_forecast["temp_max"]
+        }
+    
+    # 获取温度描述
+    temp_description = weather_api.get_temperature_description(current["temperature"])
+    
+    # 获取穿衣建议和出行装备建议
+    clothing_advice = weather_api.get_clothing_advice(
+        current["temperature"],
+        current["weather_code"]
+    )
+    
+    return {
+        "success": True,
+        "location": {
+            "latitude": latitude,
+            "longitude": longitude
+        },
+        "weather": {
+            "description": current["weather_description"],
+            "condition": current["weather_description"].split('/')[0].strip()
+        },
+        "temperature": {
+            "current": current["temperature"],
+            "description": temp_description,
+            "feels_like": current["feels_like"],
+            "range": temp_range
+        },
+        "details": {
+            "humidity": current["humidity"],
+            "wind_speed": current["wind_speed"],
+            "precipitation": current["precipitation"]
+        },
+        "travel_advice": {
+            "clothing": clothing_advice
+        },
+        "forecast": forecast
+    }
+
+def execute_tool(tool_name: str, arguments: dict, session: Session = None) -> str:
     """
     执行工具调用
     Args:
         tool_name: 工具名称
         arguments: 工具参数
+        session: 会话上下文（控制类工具修改的是该会话的设置，默认为命令行会话）
     Returns:
         工具执行结果（JSON 字符串）
     """
-    import json
+    from weather_prefetch import get_default_prefetcher
+    
+    session = session or DEFAULT_SESSION
     
     if tool_name == "geocode_address":
         address = arguments.get("address", "")
-        geocoder = NominatimGeocoder()
-        result = geocoder.geocode(address)
+        result = session.geocoder.geocode(address)
         
         if result:
+            if WEATHER_PREFETCH:
+                get_default_prefetcher().prefetch(result['latitude'], result['longitude'])
             return json.dumps({
                 "success": True,
                 "address": address,
@@ -227,101 +501,92 @@ def execute_tool(tool_name: str, arguments: dict) -> str:
                 "error": "Address not found"
             }, ensure_ascii=False)
     
-    elif tool_name == "get_weather":
-        latitude = arguments.get("latitude")
-        longitude = arguments.get("longitude")
-        forecast_days = arguments.get("forecast_days", 3)
+    elif tool_name == "reverse_geocode":
+        latitude, longitude, error = parse_coordinates(arguments)
+        if error:
+            return json.dumps({"success": False, "error": error}, ensure_ascii=False)
         
-        # 参数验证
-        if latitude is None or longitude is None:
+        result = session.geocoder.reverse(latitude, longitude)
+        
+        if result:
             return json.dumps({
-                "success": False,
-                "error": "Missing required parameters: latitude and longitude"
+                "success": True,
+                "latitude": latitude,
+                "longitude": longitude,
+                "display_name": result['display_name'],
+                "address": result.get('address', {}),
+                "distance_km": result['distance_km']
             }, ensure_ascii=False)
-        
-        try:
-            latitude = float(latitude)
-            longitude = float(longitude)
-        except (ValueError, TypeError):
+        else:
             return json.dumps({
                 "success": False,
-                "error": f"Invalid coordinate values: latitude={latitude}, longitude={longitude}"
+                "latitude": latitude,
+                "longitude": longitude,
+                "error": "No place found near these coordinates"
             }, ensure_ascii=False)
+    
+    elif tool_name == "get_weather":
+        forecast_days = arguments.get("forecast_days", 3)
         
-        # 范围检查
-        if not (-90 <= latitude <= 90):
+        # 参数验证
+        latitude, longitude, error = parse_coordinates(arguments)
+        if error:
+            return json.dumps({"success": False, "error": error}, ensure_ascii=False)
+        
+        weather_api = session.weather
+        # 优先使用地理编码后开始的预取结果
+        result = None
+        if WEATHER_PREFETCH:
+            result = get_default_prefetcher().take(latitude, longitude, forecast_days, timeout=TOOL_TIMEOUT)
+        if result is None:
+            result = weather_api.get_weather(latitude, longitude, forecast_days)
+        
+        if result:
+            return dump_tool_result(
+                build_weather_payload(weather_api, latitude, longitude, forecast_days, result, session)
+            )
+        else:
             return json.dumps({
                 "success": False,
-                "error": f"Latitude must be between -90 and 90, got {latitude}"
+                "error": "Weather query failed"
             }, ensure_ascii=False)
+    
+    elif tool_name == "weather_for_address":
+        address = arguments.get("address", "")
+        forecast_days = arguments.get("forecast_days", 3)
         
-        if not (-180 <= longitude <= 180):
+        location = session.geocoder.geocode(address)
+        if not location:
             return json.dumps({
                 "success": False,
-                "error": f"Longitude must be between -180 and 180, got {longitude}"
+                "address": address,
+                "error": "Address not found"
             }, ensure_ascii=False)
         
-        weather_api = OpenMeteoWeather()
+        latitude, longitude = location['latitude'], location['longitude']
+        weather_api = session.weather
         result = weather_api.get_weather(latitude, longitude, forecast_days)
-        
-        if result:
-            current = result["current"]
-            forecast = result["forecast"][:forecast_days]
-            
-            # 获取当天的温度区间（从预报数据中获取）
-            today_forecast = forecast[0] if forecast else None
-            temp_range = None
-            if today_forecast:
-                temp_range = {
-                    "min": today_forecast["temp_min"],
-                    "max": today_forecast["temp_max"]
-                }
-            
-            # 获取温度描述
-            temp_description = weather_api.get_temperature_description(current["temperature"])
-            
-            # 获取穿衣建议和出行装备建议
-            clothing_advice = weather_api.get_clothing_advice(
-                current["temperature"],
-                current["weather_code"]
-            )
-            
-            return json.dumps({
-                "success": True,
-                "location": {
-                    "latitude": latitude,
-                    "longitude": longitude
-                },
-                "weather": {
-                    "description": current["weather_description"],
-                    "condition": current["weather_description"].split('/')[0].strip()
-                },
-                "temperature": {
-                    "current": current["temperature"],
-                    "description": temp_description,
-                    "feels_like": current["feels_like"],
-                    "range": temp_range
-                },
-                "details": {
-                    "humidity": current["humidity"],
-                    "wind_speed": current["wind_speed"],
-                    "precipitation": current["precipitation"]
-                },
-                "travel_advice": {
-                    "clothing": clothing_advice
-                },
-                "forecast": forecast
-            }, ensure_ascii=False)
-        else:
+        if not result:
             return json.dumps({
                 "success": False,
+                "address": address,
+                "display_name": location['display_name'],
+                "location": {"latitude": latitude, "longitude": longitude},
                 "error": "Weather query failed"
             }, ensure_ascii=False)
+        
+        payload = build_weather_payload(weather_api, latitude, longitude, forecast_days, result, session)
+        if COMPACT_TOOL_RESULTS:
+            payload["place"] = location['display_name']
+        else:
+            payload["address"] = address
+            payload["display_name"] = location['display_name']
+        return dump_tool_result(payload)
     
     elif tool_name == "switch_language":
         lang = arguments.get("language", "cn")
-        old_lang = SETTINGS['language']
-        SETTINGS['language'] = lang
+        old_lang = session.language
+        session.language = lang
         
         lang_name = "中文" if lang == "cn" else "English"
         return json.dumps({
@@ -333,9 +598,9 @@ def execute_tool(tool_name: str, arguments: dict) -> str:
     
     elif tool_name == "toggle_thinking":
         enabled = arguments.get("enabled", False)
-        SETTINGS['show_thinking'] = enabled
+        session.show_thinking = enabled
         
-        status = t("status_on") if enabled else t("status_off")
+        status = t("status_on", session=session) if enabled else t("status_off", session=session)
         return json.dumps({
             "success": True,
             "thinking_enabled": enabled,
@@ -352,7 +617,225 @@ def execute_tool(tool_name: str, arguments: dict) -> str:
     
     return json.dumps({"error": f"Unknown tool: {tool_name}"}, ensure_ascii=False)
 
-def ask_qwen(prompt: str, messages: list = None, use_tools: bool = False, use_system_prompt: bool = False) -> tuple:
+def print_tool_call(function_name: str, function_args: dict, session: Session = None):
+    """
+    显示工具调用信息
+    Args:
+        function_name: 工具名称
+        function_args: 工具参数
+        session: 会话上下文（决定显示语言）
+    """
+    print("\n" + t("tool_calling", session=session, tool=function_name))
+    
+    # 根据不同工具显示不同的参数信息
+    if function_name in ("geocode_address", "weather_for_address"):
+        print(t("tool_query_address", session=session, address=function_args.get('address', '')))
+    elif function_name == "reverse_geocode":
+        print(t("tool_query_coordinates", session=session, latitude=function_args.get('latitude'), longitude=function_args.get('longitude')))
+    elif function_name == "switch_language":
+        lang_name = t("lang_name_cn", session=session) if function_args.get('language') == 'cn' else t("lang_name_en", session=session)
+        print(t("tool_switch_lang", session=session, lang=lang_name))
+    elif function_name == "toggle_thinking":
+        status = "开启" if function_args.get('enabled') else "关闭"
+        print(t("tool_thinking_status", session=session, status=status))
+    elif function_name == "navigate":
+        action_text = t("action_exit", session=session) if function_args.get('action') == 'exit' else t("action_menu", session=session)
+        print(t("tool_navigation", session=session, action=action_text))
+
+def start_tool_call(function_name: str, function_args: dict, session: Session = None):
+    """
+    在共享线程池中开始执行网络类工具
+    Args:
+        function_name: 工具名称
+        function_args: 工具参数
+        session: 会话上下文
+    Returns:
+        Future 对象；控制类工具返回 None（由 run_tool_calls 按顺序在当前线程执行）
+    """
+    if function_name in CONTROL_TOOLS:
+        return None
+    return get_tool_executor().submit(execute_tool, function_name, function_args, session)
+
+def parse_tool_arguments(arguments: str):
+    """
+    解析模型给出的工具参数
+    Args:
+        arguments: JSON 字符串
+    Returns:
+        参数字典；JSON 无效（例如输出被截断）或不是对象时返回 None
+    """
+    try:
+        parsed = json.loads(arguments)
+    except json.JSONDecodeError:
+        return None
+    return parsed if isinstance(parsed, dict) else None
+
+def run_tool_calls(tool_calls: list, messages: list, started: dict = None, session: Session = None) -> list:
+    """
+    执行模型一轮返回的全部工具调用
+    网络类工具在共享线程池中并发执行，整轮耗时取决于最慢的工具；
+    控制类工具按顺序在当前线程执行。结果按原顺序追加到消息历史；
+    参数无效的调用只返回该调用的错误结果，其余调用照常执行，模型可据此重试
+    Args:
+        tool_calls: 模型返回的工具调用列表
+        messages: 消息历史（原地追加）
+        started: 流式输出时已提前开始的工具 {tool_call_id: Future}
+        session: 会话上下文
+    Returns:
+        与 tool_calls 一一对应的工具结果（JSON 字符串）列表
+    """
+    started = started or {}
+    calls = [
+        (tool_call, tool_call.function.name, parse_tool_arguments(tool_call.function.arguments))
+        for tool_call in tool_calls
+    ]
+    results = [None] * len(calls)
+    for index, (_, function_name, function_args) in enumerate(calls):
+        if function_args is None:
+            results[index] = json.dumps({
+                "success": False,
+                "error": "invalid arguments"
+            }, ensure_ascii=False)
+    
+    # 所有工具同时开始计时，超时的工具返回错误结果（线程池中的任务无法强制中断）
+    deadline = time.monotonic() + TOOL_TIMEOUT
+    futures = {}
+    for index, (tool_call, function_name, function_args) in enumerate(calls):
+        if function_args is None:
+            continue
+        if tool_call.id in started:
+            futures[index] = started[tool_call.id]
+            continue
+        print_tool_call(function_name, function_args, session)
+        future = start_tool_call(function_name, function_args, session)
+        if future is not None:
+            futures[index] = future
+    
+    for index, (_, function_name, function_args) in enumerate(calls):
+        if index not in futures and results[index] is None:
+            results[index] = execute_tool(function_name, function_args, session)
+    for index, future in futures.items():
+        try:
+            results[index] = future.result(timeout=max(0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            future.cancel()
+            results[index] = json.dumps({
+                "success": False,
+                "error": f"Tool {calls[index][1]} timed out after {TOOL_TIMEOUT:g}s"
+            }, ensure_ascii=False)
+    
+    # 将工具调用和结果添加到消息历史：与模型输出一致的单条助手消息，随后按原顺序追加结果
+    messages.append({
+        "role": "assistant",
+        "content": None,
+        "tool_calls": [{
+            "id": tool_call.id,
+            "type": "function",
+            "function": {
+                "name": function_name,
+                "arguments": tool_call.function.arguments
+            }
+        } for tool_call, function_name, _ in calls]
+    })
+    for (tool_call, _, _), result in zip(calls, results):
+        messages.append({
+            "role": "tool",
+            "tool_call_id": tool_call.id,
+            "content": result
+        })
+    return results
+
+def response_cache_ttl(tool_names: set):
+    """
+    按本轮用到的工具数据的新鲜度计算回答的缓存有效期
+    Args:
+        tool_names: 本轮调用过的工具名称
+    Returns:
+        有效期（秒）；None 表示使用缓存的默认有效期；0 表示不缓存（控制类工具有副作用，重放回答会跳过它们）
+    """
+    if tool_names & CONTROL_TOOLS:
+        return 0
+    if tool_names & WEATHER_TOOLS:
+        from weather_cache import get_default_weather_cache
+        now = time.time()
+        return get_default_weather_cache().next_update(now) - now
+    return None
+
+def complete_chat(params: dict, on_token=None, session: Session = None) -> tuple:
+    """
+    调用一次模型
+    流式输出时逐段回调回答文本，并从增量中拼接工具调用：
+    某个工具调用的参数完整（下一个调用开始或流结束）后立即开始执行网络类工具
+    Args:
+        params: chat.completions.create 参数（不含 stream）
+        on_token: 流式输出回调；为 None 时不使用流式输出
+        session: 会话上下文（提供模型客户端，默认为命令行会话）
+    Returns:
+        (回答文本, 工具调用列表, 已开始执行的工具 {tool_call_id: Future})
+    """
+    session = session or DEFAULT_SESSION
+    # 经调度器限制并发、按会话优先级排队；流式输出期间一直占用名额
+    with get_default_scheduler().slot(session.priority):
+        return _complete_chat(params, on_token, session)
+
+def _complete_chat(params: dict, on_token, session: Session) -> tuple:
+    if on_token is None:
+        response = session.client.chat.completions.create(**params, stream=False)
+        message = response.choices[0].message
+        return (message.content, getattr(message, "tool_calls", None) or [], {})
+    
+    started_at = time.monotonic()
+    first_token_at = None
+    content = ""
+    pending = {}    # index -> {"id", "name", "arguments"}
+    tool_calls = []
+    started = {}
+    
+    def finish(index):
+        call = pending.pop(index)
+        call_id = call["id"] or f"call_{index}"
+        arguments = call["arguments"] or "{}"
+        tool_calls.append(SimpleNamespace(
+            id=call_id,
+            type="function",
+            function=SimpleNamespace(name=call["name"], arguments=arguments)
+        ))
+        function_args = parse_tool_arguments(arguments)
+        if function_args is None:
+            return  # 参数无效时留给 run_tool_calls 报错
+        print_tool_call(call["name"], function_args, session)
+        future = start_tool_call(call["name"], function_args, session)
+        if future is not None:
+            started[call_id] = future
+    
+    response = session.client.chat.completions.create(**params, stream=True)
+    for chunk in response:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            if first_token_at is None:
+                first_token_at = time.monotonic()
+            content += delta.content
+            on_token(delta.content)
+        for item in delta.tool_calls or []:
+            # 新的调用开始，说明之前的调用参数已完整
+            for index in [i for i in pending if i < item.index]:
+                finish(index)
+            call = pending.setdefault(item.index, {"id": None, "name": "", "arguments": ""})
+            if item.id:
+                call["id"] = item.id
+            if item.function is not None:
+                call["name"] += item.function.name or ""
+                call["arguments"] += item.function.arguments or ""
+    for index in sorted(pending):
+        finish(index)
+    
+    if first_token_at is not None:
+        logger.info("time to first token %.2fs, stream total %.2fs", first_token_at - started_at, time.monotonic() - started_at)
+    return (content or None, tool_calls, started)
+
+def ask_qwen(prompt: str, messages: list = None, use_tools: bool = False, use_system_prompt: bool = False, on_token=None, session: Session = None) -> tuple:
     """
     使用 OpenAI Client 方式调用本地 Ollama 模型
     Args:
@@ -360,11 +843,12 @@ def ask_qwen(prompt: str, messages: list = None, use_tools: bool = False, use_sy
         messages: 对话历史（可选）
         use_tools: 是否启用工具调用
         use_system_prompt: 是否使用系统提示词（model-based 模式）
+        on_token: 流式输出回调，每收到一段回答文本调用一次；为 None 时不使用流式输出
+        session: 会话上下文（语言、thinking 设置和模型客户端，默认为命令行会话）
     Returns:
         (回答, 导航命令) - 导航命令可能是 None, "exit", "menu"
     """
-    import json
-    
+    session = session or DEFAULT_SESSION
     try:
         # 构建消息列表
         if messages is None:
@@ -386,153 +870,92 @@ def ask_qwen(prompt: str, messages: list = None, use_tools: bool = False, use_sy
         if use_tools:
             common_params["tools"] = TOOLS
         
+        # 对话状态完全相同时直接返回缓存的回答，跳过推理（LLM_CACHE=1 开启）
+        cache = get_default_llm_cache() if not session.show_thinking else None
+        cache_key = None
+        if cache is not None:
+            cache_key = make_cache_key(MODEL_NAME, messages, common_params.get("tools"), common_params["temperature"])
+            cached = cache.get(cache_key)
+            if cached is not None:
+                if on_token is not None:
+                    on_token(cached["answer"])
+                return (cached["answer"], None)
+        
         # 如果开启了 thinking 显示，使用流式输出
-        if SETTINGS['show_thinking'] and not use_tools:
-            print(t("ai_thinking"), end="", flush=True)
-            response = client.chat.completions.create(**common_params, stream=True)
-            
+        if session.show_thinking and not use_tools:
+            print(t("ai_thinking", session=session), end="", flush=True)
             full_response = ""
-            for chunk in response:
-                if chunk.choices[0].delta.content:
-                    content = chunk.choices[0].delta.content
-                    print(content, end="", flush=True)
-                    full_response += content
+            with get_default_scheduler().slot(session.priority):
+                response = session.client.chat.completions.create(**common_params, stream=True)
+                for chunk in response:
+                    if chunk.choices[0].delta.content:
+                        content = chunk.choices[0].delta.content
+                        print(content, end="", flush=True)
+                        full_response += content
             print()  # 换行
             return full_response
         else:
-            # 非流式输出
-            response = client.chat.completions.create(**common_params, stream=False)
-            message = response.choices[0].message
+            # on_token 不为空时流式输出，工具调用参数完整后立即开始执行
+            content, tool_calls, started = complete_chat(common_params, on_token, session)
+            used_tools = set()
+            nav_action = None
             
             # 检查是否有工具调用
-            if use_tools and hasattr(message, 'tool_calls') and message.tool_calls:
-                tool_results = []
-                for tool_call in message.tool_calls:
-                    function_name = tool_call.function.name
-                    function_args = json.loads(tool_call.function.arguments)
-                    
-                    # 显示工具调用信息
-                    print("\n" + t("tool_calling", tool=function_name))
-                    
-                    # 根据不同工具显示不同的参数信息
-                    if function_name == "geocode_address":
-                        print(t("tool_query_address", address=function_args.get('address', '')))
-                    elif function_name == "switch_language":
-                        lang_name = t("lang_name_cn") if function_args.get('language') == 'cn' else t("lang_name_en")
-                        print(t("tool_switch_lang", lang=lang_name))
-                    elif function_name == "toggle_thinking":
-                        status = "开启" if function_args.get('enabled') else "关闭"
-                        print(t("tool_thinking_status", status=status))
-                    elif function_name == "navigate":
-                        action_text = t("action_exit") if function_args.get('action') == 'exit' else t("action_menu")
-                        print(t("tool_navigation", action=action_text))
-                    
-                    # 执行工具
-                    result = execute_tool(function_name, function_args)
-                    tool_results.append(result)
-                    
-                    # 将工具调用和结果添加到消息历史
-                    messages.append({
-                        "role": "assistant",
-                        "content": None,
-                        "tool_calls": [{
-                            "id": tool_call.id,
-                            "type": "function",
-                            "function": {
-                                "name": function_name,
-                                "arguments": tool_call.function.arguments
-                            }
-                        }]
-                    })
-                    messages.append({
-                        "role": "tool",
-                        "tool_call_id": tool_call.id,
-                        "content": result
-                    })
+            if use_tools and tool_calls:
+                used_tools.update(call.function.name for call in tool_calls)
+                tool_results = run_tool_calls(tool_calls, messages, started, session)
                 
                 # 检查是否有导航命令
-                nav_action = None
                 for result in tool_results:
                     result_data = json.loads(result)
                     if result_data.get("action") in ("exit", "menu"):
                         nav_action = result_data.get("action")
                 
                 # 使用工具结果再次调用模型生成最终回答
-                final_response = client.chat.completions.create(
-                    model=MODEL_NAME,
-                    messages=messages,
-                    temperature=0.7,
-                    timeout=120,
-                    tools=TOOLS  # 保持工具定义，避免模型输出原始格式
-                )
-                
-                final_message = final_response.choices[0].message
+                # 保持工具定义，避免模型输出原始格式
+                content, tool_calls, started = complete_chat(common_params, on_token, session)
                 
                 # 检查模型是否再次尝试调用工具（处理工具调用循环）
-                if hasattr(final_message, 'tool_calls') and final_message.tool_calls:
+                if tool_calls:
                     # 模型想要继续调用工具，递归处理（最多2轮）
-                    for tool_call in final_message.tool_calls:
-                        function_name = tool_call.function.name
-                        function_args = json.loads(tool_call.function.arguments)
-                        
-                        print("\n" + t("tool_calling", tool=function_name))
-                        result = execute_tool(function_name, function_args)
-                        
-                        messages.append({
-                            "role": "assistant",
-                            "content": None,
-                            "tool_calls": [{
-                                "id": tool_call.id,
-                                "type": "function",
-                                "function": {
-                                    "name": function_name,
-                                    "arguments": tool_call.function.arguments
-                                }
-                            }]
-                        })
-                        messages.append({
-                            "role": "tool",
-                            "tool_call_id": tool_call.id,
-                            "content": result
-                        })
+                    used_tools.update(call.function.name for call in tool_calls)
+                    run_tool_calls(tool_calls, messages, started, session)
                     
                     # 第三次调用生成最终回答
-                    final_response = client.chat.completions.create(
-                        model=MODEL_NAME,
-                        messages=messages,
-                        temperature=0.7,
-                        timeout=120
-                    )
-                    final_message = final_response.choices[0].message
+                    final_params = {key: value for key, value in common_params.items() if key != "tools"}
+                    content, _, _ = complete_chat(final_params, on_token, session)
                 
                 # 检查响应内容是否有效
-                if not final_message.content:
-                    return (t("error_no_response"), nav_action)
-                
-                return (final_message.content, nav_action)
+                if not content:
+                    return (t("error_no_response", session=session), nav_action)
+            
+            if cache_key is not None and content:
+                ttl = response_cache_ttl(used_tools)
+                if ttl != 0:
+                    cache.set(cache_key, {"answer": content}, ttl)
             
-            return (message.content, None)
+            return (content, nav_action)
     except TimeoutError as e:
-        error_msg = t("error_timeout")
+        error_msg = t("error_timeout", session=session)
         print(f"\n❌ {error_msg}")
         return (error_msg, None)
     except ConnectionError as e:
-        error_msg = t("error_connection")
+        error_msg = t("error_connection", session=session)
         print(f"\n❌ {error_msg}")
         return (error_msg, None)
     except json.JSONDecodeError as e:
-        error_msg = t("error_json", error=str(e))
+        error_msg = t("error_json", session=session, error=str(e))
         print(f"\n❌ {error_msg}")
         return (error_msg, None)
     except KeyError as e:
-        error_msg = t("error_keyerror", error=str(e))
+        error_msg = t("error_keyerror", session=session, error=str(e))
         print(f"\n❌ {error_msg}")
         return (error_msg, None)
     except Exception as e:
         import traceback
-        error_msg = t("error_unknown", error=str(e))
+        error_msg = t("error_unknown", session=session, error=str(e))
         print(f"\n{error_msg}")
-        print(t("error_details", trace=traceback.format_exc()))
+        print(t("error_details", session=session, trace=traceback.format_exc()))
         return (error_msg, None)
 
 
@@ -550,8 +973,32 @@ def print_mode_header(title: str, subtitle: str = ""):
     print(t("return_menu_tip"))
 
 
-def ai_chat_mode():
-    """AI 对话模式（Model-Based 智能理解）"""
+def report_warmup(warmer) -> None:
+    """
+    打印模型预热结果；预热仍在进行时先提示并等待，首个真实请求不与冷加载竞争
+
+    Args:
+        warmer: ModelWarmer 实例
+    """
+    result = warmer.result(timeout=0)
+    if result is None:
+        print(t("warmup_waiting"))
+        result = warmer.result()
+    if result["status"] == "loaded":
+        print(t("warmup_loaded", seconds=result["seconds"], load=result["load_seconds"]))
+    elif result["status"] == "already_loaded":
+        print(t("warmup_already_loaded", seconds=result["seconds"]))
+    else:
+        print(t("warmup_failed", error=result["error"]))
+
+
+def ai_chat_mode(warmer=None):
+    """
+    AI 对话模式（Model-Based 智能理解）
+
+    Args:
+        warmer: 后台预热模型的 ModelWarmer 实例（可选）
+    """
     lang = SETTINGS['language']
     if lang == "cn":
         subtitle = t("ai_mode_subtitle") + t("ai_chat_tips_cn")
@@ -563,8 +1010,11 @@ def ai_chat_mode():
         subtitle
     )
     
-    # 初始化消息历史（包含系统提示词 - 双语版本）
-    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    # 命令行会话；初始化消息历史（包含系统提示词 - 双语版本；超出 token 预算时早期对话折叠为摘要）
+    session = DEFAULT_SESSION
+    session.history = history = create_history(SYSTEM_PROMPT)
+    router = get_default_router()
+    warmup_reported = False
     
     while True:
         user_input = input(t("user_prompt")).strip()
@@ -572,24 +1022,57 @@ def ai_chat_mode():
         if not user_input:
             continue
         
-        # 检测用户输入语言并自动切换
-        detected_lang = detect_language(user_input)
-        if detected_lang != SETTINGS['language']:
-            SETTINGS['language'] = detected_lang
+        # 路由同时识别输入语言，据此自动切换
+        detected_lang, routed = router.route(user_input)
+        if detected_lang != session.language:
+            session.language = detected_lang
             print(f"\n🌐 {t('lang_auto_switch')}: {'中文' if detected_lang == 'cn' else 'English'}\n")
         
-        # 添加用户消息到历史
-        messages.append({"role": "user", "content": user_input})
+        # 明确的控制指令在本地执行，无需调用模型
+        if routed is not None:
+            tool_name, arguments = routed
+            print_tool_call(tool_name, arguments)
+            result = json.loads(execute_tool(tool_name, arguments, session))
+            if result.get("action") == "exit":
+                print(t("goodbye"))
+                return "exit"
+            elif result.get("action") == "menu":
+                print(t("returning_menu"))
+                return "menu"
+            print(t("assistant_prompt", answer=result["message"]))
+            continue
         
-        # 在系统提示词中注入当前语言设置
-        current_system_prompt = SYSTEM_PROMPT.replace(
-            "**🎯 语言一致性规则",
-            f"**[Current System Language: {'Chinese' if SETTINGS['language'] == 'cn' else 'English'}]**\n\n**🎯 语言一致性规则"
-        )
-        messages[0] = {"role": "system", "content": current_system_prompt}
+        # 第一次调用模型前报告预热结果
+        if warmer is not None and not warmup_reported:
+            report_warmup(warmer)
+            warmup_reported = True
+        
+        # 添加用户消息到历史（当前语言标记附在消息末尾，系统提示词保持不变）
+        history.add("user", with_language_tag(user_input, session))
         
         # 使用 model-based 模式（带系统提示词和工具调用）
-        answer, nav_action = ask_qwen(user_input, messages=messages.copy(), use_tools=True, use_system_prompt=False)
+        # 流式输出：收到第一段回答时打印提示，之后逐段输出
+        streamed = []
+        
+        def print_token(token):
+            if not streamed:
+                print(t("assistant_prompt", answer="").rstrip("\n"), end="", flush=True)
+            streamed.append(token)
+            print(token, end="", flush=True)
+        
+        started = time.monotonic()
+        answer, nav_action = ask_qwen(
+            user_input,
+            messages=history.messages(),
+            use_tools=True,
+            use_system_prompt=False,
+            on_token=print_token if session.stream or session.show_thinking else None,
+            session=session
+        )
+        router.record_llm_latency(time.monotonic() - started)
+        if warmer is not None:
+            warmer.touch()
+        logger.info("turn prompt ~%d tokens, %.2fs, history %s", history.tokens(), time.monotonic() - started, history.stats())
         
         # 检查导航命令
         if nav_action == "exit":
@@ -600,19 +1083,36 @@ def ai_chat_mode():
             return "menu"
         
         # 添加助手回答到历史
-        messages.append({"role": "assistant", "content": answer})
+        history.add("assistant", answer)
         
-        # 显示回答
-        if not SETTINGS['show_thinking']:
-            print(t("assistant_prompt", answer=answer))
+        # 显示回答（流式输出时已逐段打印）
+        if streamed:
+            print("\n")
         else:
-            print()  # 添加空行
+            print(t("assistant_prompt", answer=answer))
 
 
 def main():
     """主程序入口 - Model-Based 模式"""
+    load_config()
+
+    # 配置 readline 以支持更好的输入体验（导入即为 input() 启用方向键、历史记录等）
+    # 启用 Tab 补全和历史记录功能
+    import readline
+    readline.parse_and_bind('tab: complete')
+    readline.parse_and_bind('set editing-mode emacs')  # Emacs 编辑模式（支持 Ctrl+A/E 等快捷键）
+
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "WARNING").upper(),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
     lang = SETTINGS['language']
     
+    # 在打印欢迎信息的同时后台加载模型，空闲时定期保活
+    warmer = create_warmer(OLLAMA_BASE_URL, MODEL_NAME)
+    if warmer is not None:
+        warmer.start()
+    
     print("\n" + "=" * 60)
     if lang == "cn":
         print(t("welcome_title"))
@@ -627,7 +1127,10 @@ def main():
     print("=" * 60 + "\n")
     
     # 使用 AI 对话模式（model-based）
-    result = ai_chat_mode()
+    result = ai_chat_mode(warmer)
+    if warmer is not None:
+        warmer.stop()
+        logger.info("model warm-up stats: %s", warmer.stats())
     
     if result != "exit":
         print(t("thank_you"))
@@ -0,0 +1,135 @@
+"""
+进程级令牌桶限流器
+线程和 asyncio 协程均可使用，按到达顺序（FIFO）分配请求时间槽
+"""
+
+import asyncio
+import threading
+import time
+from typing import Dict
+
+
+class TokenBucketRateLimiter:
+    """
+    令牌桶限流器（GCRA 虚拟调度实现）
+    每次 acquire 在锁内预约下一个可用时间槽，再在锁外等待，
+    因此等待者按预约顺序依次放行，不会出现插队
+    """
+
+    def __init__(self, rate: float = 1.0, burst: int = 1):
+        """
+        初始化限流器
+
+        Args:
+            rate: 每秒允许的请求数
+            burst: 允许的突发请求数（桶容量）
+        """
+        if rate <= 0 or burst < 1:
+            raise ValueError(f"Invalid rate limit: rate={rate}, burst={burst}")
+        self.rate = rate
+        self.burst = burst
+        self._interval = 1.0 / rate
+        # 理论到达时间：下一个请求在无突发情况下的放行时刻
+        self._tat = 0.0
+        self._lock = threading.Lock()
+
+        # 统计计数
+        self._waiting = 0
+        self.acquired = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _reserve(self) -> float:
+        """预约一个时间槽，返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            tat = max(self._tat, now)
+            allow_at = tat - (self.burst - 1) * self._interval
+            wait = max(0.0, allow_at - now)
+            self._tat = tat + self._interval
+
+            self.acquired += 1
+            if wait > 0:
+                self.throttled += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+                self._waiting += 1
+            return wait
+
+    def _release_waiter(self):
+        with self._lock:
+            self._waiting -= 1
+
+    def acquire(self) -> float:
+        """
+        阻塞直到获得令牌（线程中使用）
+
+        Returns:
+            实际等待的秒数
+        """
+        wait = self._reserve()
+        if wait > 0:
+            try:
+                time.sleep(wait)
+            finally:
+                self._release_waiter()
+        return wait
+
+    async def acquire_async(self) -> float:
+        """
+        等待直到获得令牌（协程中使用，不阻塞事件循环）
+
+        Returns:
+            实际等待的秒数
+        """
+        wait = self._reserve()
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._release_waiter()
+        return wait
+
+    def stats(self) -> Dict:
+        """
+        返回限流统计信息
+
+        Returns:
+            包含队列深度、放行次数、被限流次数和等待时间的字典
+        """
+        with self._lock:
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "queue_depth": self._waiting,
+                "acquired": self.acquired,
+                "throttled": self.throttled,
+                "total_wait": self.total_wait,
+                "avg_wait": self.total_wait / self.acquired if self.acquired else 0.0,
+                "max_wait": self.max_wait
+            }
+
+
+_shared_limiters: Dict[str, TokenBucketRateLimiter] = {}
+_shared_limiters_lock = threading.Lock()
+
+
+def get_shared_limiter(name: str, rate: float = 1.0, burst: int = 1) -> TokenBucketRateLimiter:
+    """
+    获取进程内按名称共享的限流器（首次调用时按给定参数创建）
+
+    Args:
+        name: 限流器名称，例如上游服务名
+        rate: 每秒允许的请求数
+        burst: 允许的突发请求数
+
+    Returns:
+        TokenBucketRateLimiter 实例
+    """
+    with _shared_limiters_lock:
+        limiter = _shared_limiters.get(name)
+        if limiter is None:
+            limiter = TokenBucketRateLimiter(rate, burst)
+            _shared_limiters[name] = limiter
+        return limiter
@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+"""
+多会话 HTTP 服务
+基于 asyncio streams 的轻量 HTTP 服务，一个进程同时服务多个会话：
+每个会话有独立的对话历史和语言/thinking 设置，回答以 NDJSON 分块流式返回，
+空闲超时的会话自动回收。模型调用、工具执行、连接池和缓存与命令行模式共用
+
+接口:
+    POST   /sessions                 创建会话，请求体可选 {"language": "cn", "priority": "batch"}，返回 {"session_id": ...}
+    POST   /sessions/<id>/messages   发送消息 {"message": "..."}，流式返回
+                                     {"type": "token", "text": ...} ... {"type": "done", "answer": ..., "action": ..., "language": ...}
+    DELETE /sessions/<id>            结束会话
+    GET    /health                   服务和会话统计
+
+用法: python server.py [--host 127.0.0.1] [--port 8080]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+import main as agent
+from history import create_history
+from intent_router import get_default_router
+from llm_scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, get_default_scheduler
+from session import Session
+from warmup import create_warmer
+from weather import get_default_refresher
+
+logger = logging.getLogger(__name__)
+
+_REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 503: "Service Unavailable"}
+
+
+class AgentSession(Session):
+    """服务中的会话：会话上下文加上活动时间等管理信息"""
+
+    def __init__(self, session_id: str, language: str = "cn", priority: int = PRIORITY_INTERACTIVE):
+        """
+        初始化会话
+
+        Args:
+            session_id: 会话 ID
+            language: 初始语言（"cn" 或 "en"）
+            priority: 模型请求的调度优先级
+        """
+        super().__init__(
+            history=create_history(agent.SYSTEM_PROMPT),
+            client_factory=agent.get_client,
+            session_id=session_id,
+            priority=priority
+        )
+        self.language = language
+        self.created_at = time.monotonic()
+        self.last_active = self.created_at
+        self.turns = 0
+        self.busy = False
+
+
+class SessionStore:
+    """
+    会话表
+    超过 ttl 未活动且没有进行中的对话轮次的会话被回收
+    """
+
+    def __init__(self, ttl: float = 1800, max_sessions: int = 1000):
+        """
+        初始化会话表
+
+        Args:
+            ttl: 会话空闲超时（秒）
+            max_sessions: 最大会话数
+        """
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions: Dict[str, AgentSession] = {}
+
+        # 统计计数
+        self.created = 0
+        self.evicted = 0
+
+    def create(self, language: str = "cn", priority: int = PRIORITY_INTERACTIVE) -> Optional[AgentSession]:
+        """
+        创建会话
+
+        Args:
+            language: 初始语言
+            priority: 模型请求的调度优先级
+
+        Returns:
+            AgentSession 实例，会话数已满时返回 None
+        """
+        if len(self._sessions) >= self.max_sessions:
+            self.evict_idle()
+            if len(self._sessions) >= self.max_sessions:
+                return None
+        session = AgentSession(uuid.uuid4().hex, language, priority)
+        self._sessions[session.id] = session
+        self.created += 1
+        return session
+
+    def get(self, session_id: str) -> Optional[AgentSession]:
+        """
+        获取会话并刷新活动时间
+
+        Args:
+            session_id: 会话 ID
+
+        Returns:
+            AgentSession 实例，不存在时返回 None
+        """
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session.last_active = time.monotonic()
+        return session
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def remove(self, session_id: str) -> bool:
+        """
+        结束会话
+
+        Args:
+            session_id: 会话 ID
+
+        Returns:
+            会话是否存在
+        """
+        return self._sessions.pop(session_id, None) is not None
+
+    def evict_idle(self) -> int:
+        """
+        回收空闲超时的会话
+
+        Returns:
+            回收的会话数
+        """
+        now = time.monotonic()
+        idle = [
+            session_id for session_id, session in self._sessions.items()
+            if not session.busy and now - session.last_active > self.ttl
+        ]
+        for session_id in idle:
+            del self._sessions[session_id]
+        self.evicted += len(idle)
+        return len(idle)
+
+    def stats(self) -> Dict:
+        """
+        返回会话统计信息
+
+        Returns:
+            包含当前会话数、进行中的轮次数、创建和回收次数的字典
+        """
+        return {
+            "active": len(self._sessions),
+            "busy": sum(1 for session in self._sessions.values() if session.busy),
+            "created": self.created,
+            "evicted": self.evicted
+        }
+
+
+def run_turn(session: AgentSession, message: str, on_token=None) -> Dict:
+    """
+    在工作线程中执行会话的一轮对话（与命令行模式的处理流程一致）
+    会话上下文沿调用链传递，不同会话的轮次可以在多个线程中同时执行
+
+    Args:
+        session: 会话
+        message: 用户输入
+        on_token: 流式输出回调
+
+    Returns:
+        {"answer": 回答, "action": 导航命令或 None, "language": 本轮结束后的语言}
+    """
+    router = get_default_router()
+    session.language, routed = router.route(message)
+    if routed is not None:
+        tool_name, arguments = routed
+        result = json.loads(agent.execute_tool(tool_name, arguments, session))
+        answer, action = result.get("message", ""), result.get("action")
+    else:
+        session.history.add("user", agent.with_language_tag(message, session))
+        started = time.monotonic()
+        answer, action = agent.ask_qwen(
+            message,
+            messages=session.history.messages(),
+            use_tools=True,
+            on_token=on_token,
+            session=session
+        )
+        router.record_llm_latency(time.monotonic() - started)
+        if action is None:
+            session.history.add("assistant", answer)
+    return {"answer": answer, "action": action, "language": session.language}
+
+
+class AgentServer:
+    """
+    asyncio HTTP 服务
+    每个请求一个连接（Connection: close）；对话轮次在线程池中执行，
+    回答文本通过队列从工作线程转交事件循环，逐段写回客户端
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8080,
+        store: Optional[SessionStore] = None,
+        max_workers: int = 8,
+        sweep_interval: float = 60,
+        max_body: int = 64 * 1024
+    ):
+        """
+        初始化服务
+
+        Args:
+            host: 监听地址
+            port: 监听端口（0 表示随机端口）
+            store: 会话表
+            max_workers: 执行对话轮次的线程数
+            sweep_interval: 空闲会话回收周期（秒）
+            max_body: 请求体最大字节数
+        """
+        self.host = host
+        self.port = port
+        self.store = store or SessionStore()
+        self.sweep_interval = sweep_interval
+        self.max_body = max_body
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent-session")
+        self._server = None
+        self._sweeper = None
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+        # 统计计数
+        self.requests = 0
+        self.turns = 0
+
+    async def start(self):
+        """开始监听并启动空闲会话回收任务"""
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._sweeper = asyncio.ensure_future(self._sweep())
+        logger.info("agent server listening on http://%s:%d", self.host, self.port)
+
+    async def stop(self):
+        """停止服务"""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self._executor.shutdown(wait=False)
+
+    async def serve_forever(self):
+        """启动并一直运行"""
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            evicted = self.store.evict_idle()
+            for session_id in [key for key in self._locks if key not in self.store]:
+                del self._locks[session_id]
+            if evicted:
+                logger.info("evicted %d idle sessions, %s", evicted, self.store.stats())
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """处理一个 HTTP 请求"""
+        self.requests += 1
+        try:
+            request = await self._read_request(reader)
+            if request is None:
+                return
+            method, path, body = request
+            await self._dispatch(method, path, body, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass    # 客户端中途断开；进行中的轮次继续完成并写入历史后才释放会话
+        except Exception as e:
+            logger.exception("request failed: %s", e)
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        request_line = (await reader.readline()).decode("latin-1").split()
+        if len(request_line) < 2:
+            return None
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        if length > self.max_body:
+            return request_line[0], None, None
+        body = await reader.readexactly(length) if length else b""
+        return request_line[0].upper(), request_line[1].split("?")[0].rstrip("/"), body
+
+    async def _dispatch(self, method: str, path: Optional[str], body: Optional[bytes], writer: asyncio.StreamWriter):
+        if path is None:
+            return await self._send_json(writer, 413, {"error": "request body too large"})
+        try:
+            payload = json.loads(body) if body else {}
+        except json.JSONDecodeError as e:
+            return await self._send_json(writer, 400, {"error": f"invalid JSON: {e}"})
+
+        parts = [part for part in path.split("/") if part]
+        if parts == ["health"] and method == "GET":
+            return await self._send_json(writer, 200, self.stats())
+        if parts == ["sessions"] and method == "POST":
+            language = payload.get("language", "cn")
+            priority = PRIORITY_BATCH if payload.get("priority") == "batch" else PRIORITY_INTERACTIVE
+            session = self.store.create(language if language in ("cn", "en") else "cn", priority)
+            if session is None:
+                return await self._send_json(writer, 503, {"error": "too many sessions"})
+            return await self._send_json(writer, 201, {"session_id": session.id, "language": session.language})
+        if len(parts) in (2, 3) and parts[0] == "sessions":
+            session = self.store.get(parts[1])
+            if session is None:
+                return await self._send_json(writer, 404, {"error": "session not found"})
+            if len(parts) == 2 and method == "DELETE":
+                self.store.remove(session.id)
+                self._locks.pop(session.id, None)
+                return await self._send_json(writer, 200, {"ok": True})
+            if len(parts) == 3 and parts[2] == "messages" and method == "POST":
+                message = str(payload.get("message", "")).strip()
+                if not message:
+                    return await self._send_json(writer, 400, {"error": "message is required"})
+                return await self._chat(session, message, writer)
+            return await self._send_json(writer, 405, {"error": "method not allowed"})
+        return await self._send_json(writer, 404, {"error": "not found"})
+
+    async def _chat(self, session: AgentSession, message: str, writer: asyncio.StreamWriter):
+        """执行一轮对话并以 NDJSON 分块流式返回"""
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: application/x-ndjson; charset=utf-8\r\n"
+            b"Transfer-Encoding: chunked\r\n"
+            b"Connection: close\r\n\r\n"
+        )
+        # 轮次在独立任务中执行：客户端断开或请求被取消时，任务仍等工作线程结束才释放会话
+        turn = asyncio.ensure_future(self._run_turn(session, message, writer))
+        event, connected = await asyncio.shield(turn)
+
+        if event.get("action") == "exit":
+            self.store.remove(session.id)
+            self._locks.pop(session.id, None)
+        if not connected:
+            return
+        await self._send_chunk(writer, event)
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _run_turn(self, session: AgentSession, message: str, writer: asyncio.StreamWriter):
+        """
+        持有会话锁执行一轮对话，回答文本逐段写给客户端
+
+        Returns:
+            (结束事件, 客户端是否仍连接)
+        """
+        loop = asyncio.get_event_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        connected = True
+
+        # 同一会话的轮次依次执行；锁和 busy 标记保持到工作线程结束
+        lock = self._locks.setdefault(session.id, asyncio.Lock())
+        async with lock:
+            session.busy = True
+            try:
+                future = loop.run_in_executor(
+                    self._executor, run_turn, session, message,
+                    lambda token: loop.call_soon_threadsafe(queue.put_nowait, token)
+                )
+                future.add_done_callback(lambda _: queue.put_nowait(None))
+                while True:
+                    token = await queue.get()
+                    if token is None:
+                        break
+                    if not connected:
+                        continue
+                    try:
+                        await self._send_chunk(writer, {"type": "token", "text": token})
+                    except ConnectionError:
+                        connected = False    # 客户端中途断开：不再写出，继续等本轮完成并写入历史
+                try:
+                    result = await future
+                    event = dict(result, type="done")
+                except Exception as e:
+                    logger.exception("turn failed: %s", e)
+                    event = {"type": "error", "error": str(e)}
+            finally:
+                session.busy = False
+                session.last_active = time.monotonic()
+                session.turns += 1
+                self.turns += 1
+        return event, connected
+
+    @staticmethod
+    async def _send_chunk(writer: asyncio.StreamWriter, event: Dict):
+        data = (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+        writer.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        await writer.drain()
+
+    @staticmethod
+    async def _send_json(writer: asyncio.StreamWriter, status: int, payload: Dict):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + data
+        )
+        await writer.drain()
+
+    def stats(self) -> Dict:
+        """
+        返回服务统计信息
+
+        Returns:
+            包含请求数、对话轮次数、会话统计和模型请求调度统计（排队数、排队时间）的字典
+        """
+        return {
+            "ok": True,
+            "requests": self.requests,
+            "turns": self.turns,
+            "sessions": self.store.stats(),
+            "llm": get_default_scheduler().stats()
+        }
+
+
+def create_server(host: str, port: int) -> AgentServer:
+    """
+    按环境变量创建服务
+    可通过 SERVER_WORKERS、SERVER_SESSION_TTL、SERVER_MAX_SESSIONS 配置
+
+    Args:
+        host: 监听地址
+        port: 监听端口
+
+    Returns:
+        AgentServer 实例
+    """
+    store = SessionStore(
+        ttl=float(os.getenv("SERVER_SESSION_TTL", 1800)),
+        max_sessions=int(os.getenv("SERVER_MAX_SESSIONS", 1000))
+    )
+    return AgentServer(host, port, store=store, max_workers=int(os.getenv("SERVER_WORKERS", 8)))
+
+
+def main():
+    # 先加载 .env，命令行参数默认值和模型配置才能读到其中的变量
+    agent.load_config()
+    parser = argparse.ArgumentParser(description="多会话 HTTP 服务")
+    parser.add_argument("--host", default=os.getenv("SERVER_HOST", "127.0.0.1"), help="监听地址")
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVER_PORT", 8080)), help="监听端口")
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+
+    warmer = create_warmer(agent.OLLAMA_BASE_URL, agent.MODEL_NAME)
+    if warmer is not None:
+        warmer.start()
+    # 长期运行的服务从启动起就主动刷新热门城市的天气
+    get_default_refresher().start()
+    server = create_server(args.host, args.port)
+    print(f"🌐 Agent server: http://{args.host}:{args.port}（模型 {agent.MODEL_NAME}）")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
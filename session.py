@@ -0,0 +1,119 @@
+"""
+会话上下文
+一次对话的全部可变状态（语言、thinking 开关、流式输出开关、对话历史）以及模型客户端、
+地理编码和天气查询器的句柄。沿调用链显式传递，不同会话可以在多个工作线程中并行执行，
+一个会话切换语言不会影响其他会话
+"""
+
+import os
+import threading
+import uuid
+from typing import TYPE_CHECKING, Callable, Dict, Optional
+
+if TYPE_CHECKING:
+    from geocoding import NominatimGeocoder
+    from history import ConversationHistory
+    from weather import OpenMeteoWeather
+
+
+def default_settings() -> Dict:
+    """
+    返回新会话的默认设置（每次返回新字典）
+
+    Returns:
+        包含 language、show_thinking、stream 的字典
+    """
+    return {
+        "language": "cn",  # 可选: "cn", "en"
+        "show_thinking": False,  # 是否显示 AI thinking 过程
+        "stream": os.getenv("STREAM", "1") != "0"  # 是否流式输出回答（含工具调用轮次）
+    }
+
+
+class Session:
+    """
+    会话上下文
+    设置保存在 settings 字典中；地理编码和天气查询器在首次使用时创建，
+    它们背后的缓存、连接池和限流器仍在进程内共享
+    """
+
+    def __init__(
+        self,
+        settings: Optional[Dict] = None,
+        history: Optional["ConversationHistory"] = None,
+        client=None,
+        client_factory: Optional[Callable] = None,
+        session_id: Optional[str] = None,
+        priority: int = 0,
+        geocoder: Optional["NominatimGeocoder"] = None,
+        weather: Optional["OpenMeteoWeather"] = None
+    ):
+        """
+        初始化会话
+
+        Args:
+            settings: 会话设置，默认使用 default_settings()
+            history: 对话历史（可选）
+            client: OpenAI 兼容的模型客户端
+            client_factory: 未指定 client 时每次取用客户端调用的函数（例如共享客户端的获取函数）
+            session_id: 会话 ID，默认随机生成
+            priority: 模型请求的调度优先级（见 llm_scheduler，0 为交互式对话，数值越大越靠后）
+            geocoder: 地理编码器，默认首次使用时创建
+            weather: 天气查询器，默认首次使用时创建
+        """
+        self.id = session_id or uuid.uuid4().hex
+        self.settings = settings if settings is not None else default_settings()
+        self.history = history
+        self.priority = priority
+        self._client = client
+        self._client_factory = client_factory
+        self._geocoder = geocoder
+        self._weather = weather
+        self._lock = threading.Lock()
+
+    @property
+    def language(self) -> str:
+        return self.settings["language"]
+
+    @language.setter
+    def language(self, value: str):
+        self.settings["language"] = value
+
+    @property
+    def show_thinking(self) -> bool:
+        return self.settings["show_thinking"]
+
+    @show_thinking.setter
+    def show_thinking(self, value: bool):
+        self.settings["show_thinking"] = value
+
+    @property
+    def stream(self) -> bool:
+        return self.settings["stream"]
+
+    @property
+    def client(self):
+        """模型客户端"""
+        if self._client is not None:
+            return self._client
+        if self._client_factory is None:
+            raise RuntimeError("Session has no model client")
+        return self._client_factory()
+
+    @property
+    def geocoder(self) -> "NominatimGeocoder":
+        """地理编码器（首次使用时导入并创建）"""
+        with self._lock:
+            if self._geocoder is None:
+                from geocoding import NominatimGeocoder
+                self._geocoder = NominatimGeocoder()
+            return self._geocoder
+
+    @property
+    def weather(self) -> "OpenMeteoWeather":
+        """天气查询器（首次使用时导入并创建）"""
+        with self._lock:
+            if self._weather is None:
+                from weather import OpenMeteoWeather
+                self._weather = OpenMeteoWeather()
+            return self._weather
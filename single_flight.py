@@ -0,0 +1,216 @@
+"""
+请求合并（single-flight）
+相同键的并发调用只执行一次，其余调用方等待并共享同一个结果或异常
+"""
+
+import asyncio
+import threading
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    按键合并进行中的调用
+    调用完成后立即移除，之后的调用会重新执行（结果缓存由调用方负责）
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+        # 统计计数
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        执行调用；若相同键的调用正在进行，则等待其结果
+
+        Args:
+            key: 合并键
+            fn: 实际执行的函数
+            *args: 函数位置参数
+            **kwargs: 函数关键字参数
+
+        Returns:
+            函数返回值（执行中抛出的异常会传递给所有等待者）
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def stats(self) -> Dict:
+        """
+        返回合并统计信息
+
+        Returns:
+            包含实际执行次数、被合并次数和进行中调用数的字典
+        """
+        with self._lock:
+            return {
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls)
+            }
+
+
+class _AsyncCall:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Future"):
+        self.task = task
+        self.waiters = 0
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight 的 asyncio 版本
+    实际调用在独立任务中执行：某个等待者被取消不会影响其他等待者；
+    所有等待者都被取消（或超时）时取消实际调用，不再占用限流名额和连接
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 不同事件循环的任务不能互相等待，因此每个事件循环一张表，事件循环回收后自动移除
+        self._calls: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict]" = weakref.WeakKeyDictionary()
+
+        # 统计计数
+        self.executed = 0
+        self.coalesced = 0
+        self.abandoned = 0
+
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """
+        执行协程调用；若相同键的调用正在进行，则等待其结果
+
+        Args:
+            key: 合并键
+            fn: 返回协程的函数
+            *args: 函数位置参数
+            **kwargs: 函数关键字参数
+
+        Returns:
+            协程返回值（执行中抛出的异常会传递给所有等待者）
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            calls = self._calls.setdefault(loop, {})
+            call = calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+            else:
+                call = _AsyncCall(asyncio.ensure_future(fn(*args, **kwargs)))
+                calls[key] = call
+                self.executed += 1
+                call.task.add_done_callback(lambda _: self._forget(calls, key, call))
+            call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            with self._lock:
+                call.waiters -= 1
+                abandoned = call.waiters == 0 and not call.task.done()
+                if abandoned:
+                    # 之后的调用重新执行，而不是等待正在取消的任务
+                    self.abandoned += 1
+                    if calls.get(key) is call:
+                        del calls[key]
+            if abandoned:
+                call.task.cancel()
+
+    def _forget(self, calls: Dict[Hashable, _AsyncCall], key: Hashable, call: _AsyncCall):
+        with self._lock:
+            if calls.get(key) is call:
+                del calls[key]
+
+    def stats(self) -> Dict:
+        """
+        返回合并统计信息
+
+        Returns:
+            包含实际执行次数、被合并次数、因无人等待而取消的次数和进行中调用数的字典
+        """
+        with self._lock:
+            return {
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+                "abandoned": self.abandoned,
+                "in_flight": sum(len(calls) for calls in self._calls.values())
+            }
+
+
+_shared_flights: Dict[str, SingleFlight] = {}
+_shared_flights_lock = threading.Lock()
+
+
+def get_shared_flight(name: str) -> SingleFlight:
+    """
+    获取进程内按名称共享的 SingleFlight 实例
+
+    Args:
+        name: 名称，例如上游服务名
+
+    Returns:
+        SingleFlight 实例
+    """
+    with _shared_flights_lock:
+        flight = _shared_flights.get(name)
+        if flight is None:
+            flight = SingleFlight()
+            _shared_flights[name] = flight
+        return flight
+
+
+_shared_async_flights: Dict[str, AsyncSingleFlight] = {}
+
+
+def get_shared_async_flight(name: str) -> AsyncSingleFlight:
+    """
+    获取进程内按名称共享的 AsyncSingleFlight 实例
+
+    Args:
+        name: 名称，例如上游服务名
+
+    Returns:
+        AsyncSingleFlight 实例
+    """
+    with _shared_flights_lock:
+        flight = _shared_async_flights.get(name)
+        if flight is None:
+            flight = AsyncSingleFlight()
+            _shared_async_flights[name] = flight
+        return flight
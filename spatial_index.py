@@ -0,0 +1,216 @@
+"""
+内存空间索引
+基于 k-d 树的最近地点查询，坐标转换为单位球面三维向量，按弦长比较距离
+"""
+
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from gazetteer import get_default_gazetteer
+from geo_cache import get_default_cache
+
+EARTH_RADIUS_KM = 6371.0088
+
+_Point = Tuple[float, float, float]
+
+
+def _to_vector(latitude: float, longitude: float) -> _Point:
+    lat = math.radians(latitude)
+    lon = math.radians(longitude)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+
+def distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    计算两点间的球面距离
+
+    Args:
+        lat1: 起点纬度
+        lon1: 起点经度
+        lat2: 终点纬度
+        lon2: 终点经度
+
+    Returns:
+        距离（公里）
+    """
+    a = _to_vector(lat1, lon1)
+    b = _to_vector(lat2, lon2)
+    return _chord_to_km(sum((x - y) ** 2 for x, y in zip(a, b)))
+
+
+def _chord_to_km(chord_squared: float) -> float:
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(chord_squared) / 2))
+
+
+def _km_to_chord_squared(distance_km: float) -> float:
+    angle = min(math.pi, distance_km / EARTH_RADIUS_KM)
+    return (2 * math.sin(angle / 2)) ** 2
+
+
+class _Node:
+    __slots__ = ("point", "place", "axis", "left", "right")
+
+    def __init__(self, point: _Point, place: Dict, axis: int, left, right):
+        self.point = point
+        self.place = place
+        self.axis = axis
+        self.left = left
+        self.right = right
+
+
+def _build(items: List[Tuple[_Point, Dict]], depth: int = 0) -> Optional[_Node]:
+    if not items:
+        return None
+    axis = depth % 3
+    items.sort(key=lambda item: item[0][axis])
+    median = len(items) // 2
+    return _Node(
+        items[median][0], items[median][1], axis,
+        _build(items[:median], depth + 1),
+        _build(items[median + 1:], depth + 1)
+    )
+
+
+class SpatialIndex:
+    """
+    最近地点索引
+    新增地点先放入待合并列表，积累到一定数量后重建 k-d 树
+    """
+
+    def __init__(
+        self,
+        places: Iterable[Dict] = (),
+        loader: Optional[Callable[[], Iterable[Dict]]] = None,
+        rebuild_threshold: int = 64
+    ):
+        """
+        初始化空间索引
+
+        Args:
+            places: 初始地点（需包含 latitude、longitude）
+            loader: 首次查询时调用的地点加载函数，用于延迟构建
+            rebuild_threshold: 待合并地点超过该数量时重建 k-d 树
+        """
+        self._lock = threading.Lock()
+        self._loader = loader
+        self._items: List[Tuple[_Point, Dict]] = []
+        self._pending: List[Tuple[_Point, Dict]] = []
+        self._root: Optional[_Node] = None
+        self.rebuild_threshold = rebuild_threshold
+        self.extend(places)
+
+    def __len__(self) -> int:
+        return len(self._items) + len(self._pending)
+
+    def add(self, place: Dict):
+        """
+        添加地点
+
+        Args:
+            place: 地点字典（需包含 latitude、longitude）
+        """
+        self.extend([place])
+
+    def extend(self, places: Iterable[Dict]):
+        """
+        批量添加地点
+
+        Args:
+            places: 地点字典列表
+        """
+        items = [(_to_vector(p["latitude"], p["longitude"]), p) for p in places]
+        if not items:
+            return
+        with self._lock:
+            self._pending.extend(items)
+            if len(self._pending) > self.rebuild_threshold:
+                self._rebuild()
+
+    def _rebuild(self):
+        """合并待添加地点并重建 k-d 树（调用方需持有锁）"""
+        self._items.extend(self._pending)
+        self._pending = []
+        self._root = _build(list(self._items))
+
+    def _ensure_loaded(self):
+        if self._loader is None:
+            return
+        with self._lock:
+            loader, self._loader = self._loader, None
+            if loader is not None:
+                self._pending.extend(
+                    (_to_vector(p["latitude"], p["longitude"]), p) for p in loader()
+                )
+                self._rebuild()
+
+    def nearest(
+        self,
+        latitude: float,
+        longitude: float,
+        max_distance_km: Optional[float] = None
+    ) -> Optional[Tuple[Dict, float]]:
+        """
+        查询最近的地点
+
+        Args:
+            latitude: 纬度
+            longitude: 经度
+            max_distance_km: 最大距离（公里），超出范围视为未找到
+
+        Returns:
+            (地点, 距离公里数)，未找到返回 None
+        """
+        self._ensure_loaded()
+        target = _to_vector(latitude, longitude)
+        best_distance = _km_to_chord_squared(max_distance_km) if max_distance_km is not None else math.inf
+        best_place = None
+
+        # 先线性扫描待合并地点，再在 k-d 树中剪枝搜索
+        root, pending = self._root, self._pending
+        for point, place in pending:
+            distance = sum((a - b) ** 2 for a, b in zip(point, target))
+            if distance <= best_distance:
+                best_distance, best_place = distance, place
+
+        stack = [root] if root is not None else []
+        while stack:
+            node = stack.pop()
+            point = node.point
+            distance = (point[0] - target[0]) ** 2 + (point[1] - target[1]) ** 2 + (point[2] - target[2]) ** 2
+            if distance <= best_distance:
+                best_distance, best_place = distance, node.place
+
+            diff = target[node.axis] - point[node.axis]
+            near, far = (node.left, node.right) if diff < 0 else (node.right, node.left)
+            if far is not None and diff * diff <= best_distance:
+                stack.append(far)
+            if near is not None:
+                stack.append(near)
+
+        if best_place is None:
+            return None
+        return (best_place, _chord_to_km(best_distance))
+
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+def get_default_spatial_index() -> SpatialIndex:
+    """
+    获取进程内共享的默认空间索引
+    首次查询时由离线地名索引和地理编码缓存中的已知地点构建
+
+    Returns:
+        SpatialIndex 实例
+    """
+    global _default_index
+    with _default_index_lock:
+        if _default_index is None:
+            def load_known_places():
+                yield from get_default_gazetteer().places()
+                yield from get_default_cache().entries()
+
+            _default_index = SpatialIndex(loader=load_known_places)
+        return _default_index
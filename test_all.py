@@ -4,10 +4,98 @@
 整合所有测试：地理编码、天气查询、集成功能、格式展示
 """
 
+import asyncio
+import json
+import os
+import random
 import sys
+import threading
+import tempfile
+import time
 import traceback
-from geocoding import NominatimGeocoder
-from weather import OpenMeteoWeather
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from geocoding import AsyncNominatimGeocoder, NominatimGeocoder, get_nominatim_transport
+from gazetteer import Gazetteer
+from geo_cache import GeocodeCache, get_cache_dir, normalize_address
+from history import ConversationHistory, estimate_tokens
+from intent_router import IntentRouter
+from llm_cache import LLMResponseCache, make_cache_key
+from llm_scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, LLMScheduler, SchedulerTimeout
+from http_transport import AsyncHttpTransport, HttpTransport
+from rate_limiter import TokenBucketRateLimiter
+from session import Session
+from single_flight import AsyncSingleFlight, SingleFlight
+from spatial_index import SpatialIndex, distance_km
+from warmup import ModelWarmer, native_api_url
+from weather import AsyncOpenMeteoWeather, OpenMeteoWeather, get_default_refresher
+from weather_cache import WeatherCache, WeatherRefresher
+from weather_prefetch import WeatherPrefetcher
+
+
+def start_stub_server(respond):
+    """
+    启动本地 HTTP 桩服务（支持 keep-alive），用于离线测试
+    Args:
+        respond: 回调函数 (path, query, headers) -> 可 JSON 序列化的响应体，
+                 或 (状态码, 响应体, 响应头) 元组
+    Returns:
+        (server, base_url)，用完后调用 server.shutdown()
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        
+        def do_GET(self):
+            url = urlparse(self.path)
+            result = respond(url.path, parse_qs(url.query), self.headers)
+            status, result, extra = result if isinstance(result, tuple) else (200, result, {})
+            body = json.dumps(result).encode()
+            self.send_response(status)
+            for name, value in extra.items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self.do_GET()
+        
+        def log_message(self, *args):
+            pass
+    
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def open_meteo_payload(latitude, longitude, forecast_days):
+    """生成 Open-Meteo 格式的单点天气数据（离线测试用）"""
+    days = range(int(forecast_days))
+    return {
+        "latitude": float(latitude),
+        "longitude": float(longitude),
+        "timezone": "Asia/Shanghai",
+        "current": {
+            "time": "2026-01-01T12:00",
+            "temperature_2m": 5.0,
+            "relative_humidity_2m": 40,
+            "apparent_temperature": 2.0,
+            "precipitation": 0.0,
+            "weather_code": 0,
+            "wind_speed_10m": 10.0
+        },
+        "daily": {
+            "time": [f"2026-01-{d + 1:02d}" for d in days],
+            "weather_code": [0 for _ in days],
+            "temperature_2m_max": [8.0 + d for d in days],
+            "temperature_2m_min": [-2.0 + d for d in days],
+            "precipitation_sum": [0.0 for _ in days],
+            "wind_speed_10m_max": [15.0 for _ in days]
+        }
+    }
 
 
 def test_geocoding():
@@ -244,12 +332,1553 @@ def test_multiple_cities():
     return True
 
 
+def test_geocode_cache():
+    """测试6：地理编码缓存（离线）"""
+    print("\n" + "=" * 60)
+    print("6️⃣  测试地理编码缓存（离线）")
+    print("=" * 60)
+    
+    # 地址规范化：全角/半角、大小写、空白
+    assert normalize_address("  Ｎｅｗ　York ") == "new york"
+    assert normalize_address("北京\t天安门") == normalize_address("北京 天安门")
+    print("   ✅ 地址规范化")
+    
+    # 命中、负缓存、未命中
+    cache = GeocodeCache(":memory:", max_entries=2)
+    location = {"latitude": 39.9, "longitude": 116.4, "display_name": "北京", "address": {}, "importance": 0.8}
+    cache.set("北京", location)
+    cache.set("nowhere", None)
+    assert cache.get("北京") == (True, location)
+    assert cache.get("nowhere") == (True, None)
+    assert cache.get("上海") == (False, None)
+    
+    # LRU 淘汰：最近未访问的 "nowhere" 先被淘汰
+    cache.get("北京")
+    cache.set("上海", location)
+    assert cache.get("nowhere") == (False, None)
+    assert cache.get("北京")[0]
+    stats = cache.stats()
+    assert stats["evictions"] == 1 and stats["size"] == 2
+    print(f"   ✅ 命中/负缓存/LRU: {stats}")
+    
+    # TTL 过期
+    short = GeocodeCache(":memory:", ttl=0.05)
+    short.set("北京", location)
+    time.sleep(0.1)
+    assert short.get("北京") == (False, None)
+    print("   ✅ TTL 过期")
+    
+    # 进程重启后仍然有效（重新打开同一文件），且地理编码器直接命中缓存
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "geocode.sqlite3")
+        GeocodeCache(path).set(normalize_address("Beijing"), location)
+        geocoder = NominatimGeocoder(cache=GeocodeCache(path), use_gazetteer=False)
+        assert geocoder.geocode("  BEIJING ") == location
+        assert geocoder.cache.stats()["hits"] == 1
+    print("   ✅ 持久化并被 NominatimGeocoder 命中")
+    
+    # 环境变量中 ~ 开头的路径展开为用户目录
+    original = os.environ.get("AGENT_CACHE_DIR")
+    os.environ["AGENT_CACHE_DIR"] = "~/agent_cache"
+    try:
+        assert get_cache_dir() == os.path.join(os.path.expanduser("~"), "agent_cache")
+    finally:
+        if original is None:
+            del os.environ["AGENT_CACHE_DIR"]
+        else:
+            os.environ["AGENT_CACHE_DIR"] = original
+    print("   ✅ 缓存目录展开 ~")
+    
+    return True
+
+
+def test_rate_limiter():
+    """测试7：令牌桶限流器（离线）"""
+    print("\n" + "=" * 60)
+    print("7️⃣  测试令牌桶限流器（离线）")
+    print("=" * 60)
+    
+    # 突发容量内立即放行，之后按速率排队
+    limiter = TokenBucketRateLimiter(rate=20, burst=2)
+    start = time.monotonic()
+    waits = [limiter.acquire() for _ in range(4)]
+    assert waits[0] == 0 and waits[1] == 0
+    assert 0.03 < waits[2] <= 0.05 and 0.03 < waits[3] <= 0.05
+    assert time.monotonic() - start >= 0.09
+    print(f"   ✅ 突发与排队: {[round(w, 3) for w in waits]}")
+    
+    # 多线程共享：5 个请求至少需要 4 个间隔
+    limiter = TokenBucketRateLimiter(rate=50, burst=1)
+    start = time.monotonic()
+    threads = [threading.Thread(target=limiter.acquire) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert time.monotonic() - start >= 0.075
+    stats = limiter.stats()
+    assert stats["acquired"] == 5 and stats["throttled"] == 4 and stats["queue_depth"] == 0
+    print(f"   ✅ 多线程: {stats['throttled']} 次限流, 最长等待 {stats['max_wait']:.3f}s")
+    
+    # asyncio：等待不阻塞事件循环
+    async def run():
+        limiter = TokenBucketRateLimiter(rate=50, burst=1)
+        start = time.monotonic()
+        await asyncio.gather(*(limiter.acquire_async() for _ in range(3)))
+        return time.monotonic() - start
+    
+    assert asyncio.run(run()) >= 0.035
+    print("   ✅ asyncio")
+    
+    return True
+
+
+def test_http_transport():
+    """测试8：连接池复用（离线）"""
+    print("\n" + "=" * 60)
+    print("8️⃣  测试 HTTP 连接池复用（离线）")
+    print("=" * 60)
+    
+    server, base_url = start_stub_server(
+        lambda path, query, headers: {"encoding": headers.get("Accept-Encoding", "")}
+    )
+    try:
+        transport = HttpTransport(max_retries=0)
+        for _ in range(3):
+            response = transport.get(f"{base_url}/ping", timeout=5)
+            response.raise_for_status()
+        assert "gzip" in response.json()["encoding"]
+        stats = transport.stats()
+        assert stats["requests"] == 3 and stats["handshakes"] == 1 and stats["reused"] == 2
+        print(f"   ✅ 3 次请求仅 1 次握手: {stats}")
+    finally:
+        server.shutdown()
+    
+    # 429 不在传输层重试，由地理编码器经限流器重新排队
+    attempts = []
+    
+    def throttled(path, query, headers):
+        attempts.append(path)
+        if len(attempts) == 1:
+            return (429, {"error": "rate limited"}, {"Retry-After": "0"})
+        return [{"lat": "1.5", "lon": "2.5", "display_name": query["q"][0]}]
+    
+    server, base_url = start_stub_server(throttled)
+    try:
+        transport = HttpTransport(max_retries=2, backoff_factor=0)
+        assert transport.get(f"{base_url}/search", params={"q": "x"}, timeout=5).status_code == 429
+        assert len(attempts) == 1
+        
+        limiter = TokenBucketRateLimiter(rate=1000, burst=10)
+        geocoder = NominatimGeocoder(
+            cache=GeocodeCache(":memory:"),
+            rate_limiter=limiter,
+            transport=transport,
+            use_gazetteer=False
+        )
+        geocoder.base_url = f"{base_url}/search"
+        assert geocoder.geocode("Somewhere")["latitude"] == 1.5
+        assert len(attempts) == 2 and limiter.acquired == 1
+        attempts.clear()
+        assert geocoder.geocode("Elsewhere")["latitude"] == 1.5
+        assert len(attempts) == 2 and limiter.acquired == 3
+        print("   ✅ 429 响应经限流器重新排队后重试")
+    finally:
+        server.shutdown()
+    
+    # Nominatim 的 5xx 同样只经限流器重试：每次上游请求都对应一次限流器放行
+    hits = []
+    
+    def unavailable(path, query, headers):
+        hits.append(path)
+        if len(hits) <= 2:
+            return (503, {"error": "unavailable"}, {})
+        return [{"lat": "1.5", "lon": "2.5", "display_name": query["q"][0]}]
+    
+    server, base_url = start_stub_server(unavailable)
+    try:
+        assert not get_nominatim_transport().adapter.max_retries.status_forcelist
+        limiter = TokenBucketRateLimiter(rate=1000, burst=10)
+        geocoder = NominatimGeocoder(
+            cache=GeocodeCache(":memory:"),
+            rate_limiter=limiter,
+            transport=HttpTransport(max_retries=2, backoff_factor=0, retry_statuses=()),
+            use_gazetteer=False
+        )
+        geocoder.base_url = f"{base_url}/search"
+        assert geocoder.geocode("Flaky")["latitude"] == 1.5
+        assert len(hits) == 3 and limiter.acquired == 3, (hits, limiter.acquired)
+        print(f"   ✅ 503 经限流器重试：{len(hits)} 次上游请求，{limiter.acquired} 次限流放行")
+    finally:
+        server.shutdown()
+    
+    return True
+
+
+def test_geocode_many():
+    """测试9：批量地理编码（离线）"""
+    print("\n" + "=" * 60)
+    print("9️⃣  测试批量地理编码（离线）")
+    print("=" * 60)
+    
+    queried = []
+    
+    def respond(path, query, headers):
+        address = query["q"][0]
+        queried.append(address)
+        if address == "Nowhere":
+            return []
+        return [{"lat": "1.5", "lon": "2.5", "display_name": address}]
+    
+    server, base_url = start_stub_server(respond)
+    try:
+        cache = GeocodeCache(":memory:")
+        cache.set("北京", {"latitude": 39.9, "longitude": 116.4, "display_name": "北京", "address": {}, "importance": 0.8})
+        geocoder = NominatimGeocoder(
+            cache=cache,
+            rate_limiter=TokenBucketRateLimiter(rate=1000, burst=10),
+            transport=HttpTransport(max_retries=0),
+            use_gazetteer=False
+        )
+        geocoder.base_url = f"{base_url}/search"
+        
+        addresses = ["北京", "上海", " 上海 ", "Nowhere", "Tokyo"]
+        results = list(geocoder.geocode_many(addresses))
+        
+        # 缓存命中最先返回；重复地址只查询一次但每个输入都有结果
+        assert results[0][0] == "北京"
+        assert sorted(address for address, _ in results) == sorted(addresses)
+        assert sorted(queried) == ["Nowhere", "Tokyo", "上海"]
+        found = dict(results)
+        assert found["Nowhere"] is None and found[" 上海 "]["latitude"] == 1.5
+        print(f"   ✅ {len(addresses)} 个地址，{len(queried)} 次网络查询")
+        
+        # 未命中的查询在返回命中结果之前已经开始，不等调用方处理完命中
+        queried.clear()
+        results = geocoder.geocode_many(["北京", "Osaka"])
+        assert next(results)[0] == "北京"
+        deadline = time.monotonic() + 2
+        while not queried and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert queried == ["Osaka"], queried
+        assert next(results)[0] == "Osaka"
+        print("   ✅ 远程查询与返回命中结果同时进行")
+    finally:
+        server.shutdown()
+    
+    return True
+
+
+def test_gazetteer():
+    """测试10：离线地名索引（离线）"""
+    print("\n" + "=" * 60)
+    print("🔟 测试离线地名索引（离线）")
+    print("=" * 60)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "cities.csv")
+        with open(source, "w", encoding="utf-8") as f:
+            f.write("name,asciiname,alternatenames,latitude,longitude,country_code,population\n")
+            f.write('Beijing,Beijing,"北京,北京市,Peking",39.9075,116.39723,CN,18960744\n')
+            f.write('San Francisco,San Francisco,旧金山,37.77493,-122.41942,US,873965\n')
+            f.write('San Diego,San Diego,圣地亚哥,32.71571,-117.16472,US,1386932\n')
+        
+        gazetteer = Gazetteer(source, index_path=os.path.join(tmp, "cities.idx"))
+        assert not os.path.exists(gazetteer.index_path)   # 延迟加载
+        
+        # 精确匹配：中文、别名、全角/大小写
+        assert gazetteer.lookup("北京")["display_name"] == "Beijing, CN"
+        assert gazetteer.lookup("ＰＥＫＩＮＧ")["latitude"] == 39.9075
+        assert gazetteer.lookup("北京天安门") is None
+        print("   ✅ 精确匹配（中英文与别名）")
+        
+        # 前缀匹配按人口排序，模糊匹配容忍拼写错误
+        assert [p["display_name"] for p in gazetteer.prefix("san")] == ["San Diego, US", "San Francisco, US"]
+        assert gazetteer.match("San Fransisco")["display_name"] == "San Francisco, US"
+        assert gazetteer.match("北京天安门") is None
+        print("   ✅ 前缀与模糊匹配")
+        
+        # 地理编码器优先使用离线索引，不访问网络
+        geocoder = NominatimGeocoder(cache=GeocodeCache(":memory:"), gazetteer=gazetteer)
+        assert geocoder.geocode("旧金山")["source"] == "gazetteer"
+        assert geocoder.cache.stats()["misses"] == 0
+        print("   ✅ NominatimGeocoder 离线命中")
+        gazetteer.close()
+    
+    return True
+
+
+def test_reverse_geocode():
+    """测试11：反向地理编码（离线）"""
+    print("\n" + "=" * 60)
+    print("1️⃣1️⃣ 测试反向地理编码（离线）")
+    print("=" * 60)
+    
+    # k-d 树结果与暴力搜索一致（含待合并地点）
+    rng = random.Random(42)
+    places = [{"latitude": rng.uniform(-90, 90), "longitude": rng.uniform(-180, 180), "id": i} for i in range(500)]
+    index = SpatialIndex(places[:450], rebuild_threshold=64)
+    index.extend(places[450:])
+    for _ in range(200):
+        lat, lon = rng.uniform(-90, 90), rng.uniform(-180, 180)
+        expected = min(places, key=lambda p: distance_km(lat, lon, p["latitude"], p["longitude"]))
+        assert index.nearest(lat, lon)[0]["id"] == expected["id"]
+    assert index.nearest(0.0, 0.0, max_distance_km=0.001) is None
+    print("   ✅ 最近邻查询与暴力搜索一致")
+    
+    # 本地命中直接返回；范围外查询 Nominatim 并记入索引
+    server, base_url = start_stub_server(
+        lambda path, query, headers: {"lat": query["lat"][0], "lon": query["lon"][0], "display_name": "Null Island"}
+    )
+    try:
+        geocoder = NominatimGeocoder(
+            cache=GeocodeCache(":memory:"),
+            rate_limiter=TokenBucketRateLimiter(rate=1000, burst=10),
+            transport=HttpTransport(max_retries=0),
+            spatial_index=SpatialIndex([{"latitude": 39.9075, "longitude": 116.39723, "display_name": "Beijing, CN"}])
+        )
+        geocoder.reverse_url = f"{base_url}/reverse"
+        result = geocoder.reverse(39.95, 116.40)
+        assert result["display_name"] == "Beijing, CN" and 4 < result["distance_km"] < 6
+        assert geocoder.reverse(0.0, 0.0)["display_name"] == "Null Island"
+        assert len(geocoder.spatial_index) == 2
+        print("   ✅ 本地命中与网络回退")
+    finally:
+        server.shutdown()
+    
+    # 工具调用（使用固定地点的索引，不读写本机缓存目录）
+    import main as agent
+    session = Session(geocoder=NominatimGeocoder(
+        cache=GeocodeCache(":memory:"),
+        rate_limiter=TokenBucketRateLimiter(rate=1000, burst=10),
+        transport=HttpTransport(max_retries=0),
+        use_gazetteer=False,
+        spatial_index=SpatialIndex([{"latitude": 31.22222, "longitude": 121.45806, "display_name": "Shanghai, CN"}])
+    ))
+    result = json.loads(agent.execute_tool("reverse_geocode", {"latitude": 31.23, "longitude": 121.47}, session))
+    assert result["success"] and result["display_name"] == "Shanghai, CN"
+    result = json.loads(agent.execute_tool("reverse_geocode", {"latitude": 91, "longitude": 0}, session))
+    assert not result["success"]
+    print("   ✅ reverse_geocode 工具")
+    
+    return True
+
+
+def test_weather_cache():
+    """测试12：天气缓存（离线）"""
+    print("\n" + "=" * 60)
+    print("1️⃣2️⃣ 测试天气缓存（离线）")
+    print("=" * 60)
+    
+    cache = WeatherCache(grid_deg=0.1, update_interval=3600, max_entries=2)
+    
+    # 网格对齐与模型更新时刻
+    assert cache.key_for(39.9042, 116.4074) == cache.key_for(39.93, 116.38) == (39.9, 116.4)
+    assert cache.next_update(7200.5) == 10800 and cache.next_update(7199) == 7200
+    print("   ✅ 网格对齐与更新时刻")
+    
+    requests_seen = []
+    
+    def respond(path, query, headers):
+        requests_seen.append(query)
+        return open_meteo_payload(query["latitude"][0], query["longitude"][0], query["forecast_days"][0])
+    
+    server, base_url = start_stub_server(respond)
+    try:
+        weather = OpenMeteoWeather(transport=HttpTransport(max_retries=0), cache=cache)
+        weather.base_url = f"{base_url}/v1/forecast"
+        
+        # 存储最多天数，更少天数直接截取；几百米外的坐标命中同一网格
+        assert len(weather.get_weather(39.9042, 116.4074, forecast_days=7)["forecast"]) == 7
+        assert len(weather.get_weather(39.92, 116.41, forecast_days=3)["forecast"]) == 3
+        assert requests_seen[0]["latitude"] == ["39.9"] and len(requests_seen) == 1
+        
+        # 请求更多天数时重新获取
+        weather.get_weather(39.9, 116.4, forecast_days=10)
+        assert len(requests_seen) == 2
+        
+        # 容量上限：淘汰最久未使用的网格
+        weather.get_weather(31.23, 121.47, forecast_days=1)
+        weather.get_weather(22.54, 114.06, forecast_days=1)
+        stats = cache.stats()
+        assert stats["size"] == 2 and stats["evictions"] == 1 and stats["hits"] == 1
+        print(f"   ✅ 截取、重新获取与淘汰: {stats}")
+        
+        # 到达模型更新时刻后过期
+        cache.update_interval = 0.05
+        cache.clear()
+        weather.get_weather(31.23, 121.47, forecast_days=1)
+        time.sleep(0.1)
+        weather.get_weather(31.23, 121.47, forecast_days=1)
+        assert cache.stats()["expirations"] == 1
+        print("   ✅ 模型更新后过期")
+    finally:
+        server.shutdown()
+    
+    return True
+
+
+def test_weather_many():
+    """测试13：多地点天气批量查询（离线）"""
+    print("\n" + "=" * 60)
+    print("1️⃣3️⃣ 测试多地点天气批量查询（离线）")
+    print("=" * 60)
+    
+    requests_seen = []
+    truncate = [False]
+    
+    def respond(path, query, headers):
+        latitudes = query["latitude"][0].split(",")
+        longitudes = query["longitude"][0].split(",")
+        requests_seen.append(len(latitudes))
+        payloads = [
+            open_meteo_payload(lat, lon, query["forecast_days"][0])
+            for lat, lon in zip(latitudes, longitudes)
+        ]
+        if truncate[0] and len(payloads) > 1:
+            payloads = payloads[:-1]    # 模拟上游少返回一个地点
+        return payloads if len(payloads) > 1 else payloads[0]
+    
+    server, base_url = start_stub_server(respond)
+    try:
+        cache = WeatherCache()
+        weather = OpenMeteoWeather(transport=HttpTransport(max_retries=0), cache=cache)
+        weather.base_url = f"{base_url}/v1/forecast"
+        weather.get_weather(39.9, 116.4, forecast_days=3)   # 预先缓存北京
+        
+        points = [(39.91, 116.41), (31.23, 121.47), (22.54, 114.06), (31.2301, 121.4701), (35.68, 139.69)]
+        results = weather.get_weather_many(points, forecast_days=3, chunk_size=2)
+        
+        # 北京命中缓存；同网格的上海坐标合并；其余 3 个网格分 2 组请求
+        assert requests_seen == [1, 2, 1]
+        assert all(result and len(result["forecast"]) == 3 for result in results)
+        assert results[1]["latitude"] == 31.2 and results[4]["latitude"] == 35.7
+        print(f"   ✅ {len(points)} 个地点，{len(requests_seen) - 1} 次批量请求")
+        
+        # 返回的地点数与请求不符：该组逐个查询，不会静默丢失地点
+        truncate[0] = True
+        requests_seen.clear()
+        results = weather.get_weather_many([(10.0, 10.0), (20.0, 20.0), (30.0, 30.0)], forecast_days=3)
+        assert requests_seen == [3, 1, 1, 1], requests_seen
+        assert [result["latitude"] for result in results] == [10.0, 20.0, 30.0]
+        
+        async def run_async():
+            async_weather = AsyncOpenMeteoWeather(
+                transport=AsyncHttpTransport(max_retries=0),
+                cache=WeatherCache(),
+                single_flight=AsyncSingleFlight()
+            )
+            async_weather.base_url = f"{base_url}/v1/forecast"
+            return await async_weather.get_weather_many([(40.0, 40.0), (50.0, 50.0)], forecast_days=3)
+        
+        requests_seen.clear()
+        results = asyncio.run(run_async())
+        assert requests_seen == [2, 1, 1] and [result["latitude"] for result in results] == [40.0, 50.0]
+        print("   ✅ 批量响应地点数不符时逐个查询（同步和异步）")
+    finally:
+        server.shutdown()
+    
+    return True
+
+
+def test_single_flight():
+    """测试14：并发请求合并（离线）"""
+    print("\n" + "=" * 60)
+    print("1️⃣4️⃣ 测试并发请求合并（离线）")
+    print("=" * 60)
+    
+    # 异常传递给所有等待者
+    flight = SingleFlight()
+    errors = []
+    
+    def failing():
+        time.sleep(0.1)
+        raise ValueError("upstream failed")
+    
+    def call():
+        try:
+            flight.do("key", failing)
+        except ValueError as e:
+            errors.append(str(e))
+    
+    threads = [threading.Thread(target=call) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == ["upstream failed"] * 4
+    assert flight.stats() == {"executed": 1, "coalesced": 3, "in_flight": 0}
+    print("   ✅ 异常传递给全部等待者")
+    
+    # 并发的相同地址（不同写法）只请求一次
+    queried = []
+    
+    def respond(path, query, headers):
+        queried.append(query["q"][0])
+        time.sleep(0.2)
+        return [{"lat": "1.5", "lon": "2.5", "display_name": "Somewhere"}]
+    
+    server, base_url = start_stub_server(respond)
+    try:
+        geocoder = NominatimGeocoder(
+            cache=GeocodeCache(":memory:"),
+            rate_limiter=TokenBucketRateLimiter(rate=1000, burst=10),
+            transport=HttpTransport(max_retries=0),
+            use_gazetteer=False,
+            single_flight=SingleFlight()
+        )
+        geocoder.base_url = f"{base_url}/search"
+        results = []
+        threads = [
+            threading.Thread(target=lambda a=address: results.append(geocoder.geocode(a)))
+            for address in ["Somewhere", "somewhere", " SOMEWHERE ", "Somewhere"]
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(queried) == 1 and len(results) == 4
+        assert all(result["display_name"] == "Somewhere" for result in results)
+        print(f"   ✅ 4 个并发查询合并为 1 次请求: {geocoder.single_flight.stats()}")
+    finally:
+        server.shutdown()
+    
+    # 异步版本：取消部分等待者不影响实际调用，取消最后一个等待者时实际调用也被取消
+    async def scenario():
+        flight = AsyncSingleFlight()
+        states = []
+        
+        async def upstream(name):
+            try:
+                await asyncio.sleep(0.2)
+                states.append((name, "done"))
+                return name
+            except asyncio.CancelledError:
+                states.append((name, "cancelled"))
+                raise
+        
+        first = asyncio.ensure_future(flight.do("a", upstream, "a"))
+        second = asyncio.ensure_future(flight.do("a", upstream, "a"))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        assert await second == "a" and states == [("a", "done")]
+        
+        only = asyncio.ensure_future(flight.do("b", upstream, "b"))
+        await asyncio.sleep(0.05)
+        only.cancel()
+        await asyncio.sleep(0.01)
+        assert states[-1] == ("b", "cancelled"), states
+        assert await asyncio.wait_for(flight.do("c", upstream, "c"), 1) == "c"
+        try:
+            await asyncio.wait_for(flight.do("d", upstream, "d"), 0.05)
+            assert False, "应超时"
+        except asyncio.TimeoutError:
+            pass
+        await asyncio.sleep(0.01)
+        assert states[-1] == ("d", "cancelled"), states
+        stats = flight.stats()
+        assert stats["abandoned"] == 2 and stats["in_flight"] == 0, stats
+        return stats
+    
+    stats = asyncio.run(scenario())
+    print(f"   ✅ 最后一个等待者取消或超时时取消实际调用: {stats}")
+    
+    return True
+
+
+def test_stale_while_revalidate():
+    """测试15：过期数据后台刷新（离线）"""
+    print("\n" + "=" * 60)
+    print("1️⃣5️⃣ 测试 stale-while-revalidate（离线）")
+    print("=" * 60)
+    
+    fetches, fetched_days = [], []
+    
+    def respond(path, query, headers):
+        fetches.append(query["latitude"][0])
+        fetched_days.append(int(query["forecast_days"][0]))
+        time.sleep(0.1)
+        return open_meteo_payload(query["latitude"][0], query["longitude"][0], query["forecast_days"][0])
+    
+    server, base_url = start_stub_server(respond)
+    try:
+        cache = WeatherCache(update_interval=0.2, stale_ttl=60)
+        weather = OpenMeteoWeather(transport=HttpTransport(max_retries=0), cache=cache, single_flight=SingleFlight())
+        weather.base_url = f"{base_url}/v1/forecast"
+        weather.refresher = WeatherRefresher(cache, fetch=weather._revalidate, max_concurrency=1)
+        
+        weather.get_weather(39.9, 116.4, forecast_days=3)
+        weather.get_weather(31.2, 121.5, forecast_days=3)
+        time.sleep(0.25)
+        
+        # 过期后立即返回旧数据，后台刷新
+        start = time.monotonic()
+        assert weather.get_weather(39.9, 116.4, forecast_days=3) is not None
+        assert time.monotonic() - start < 0.05
+        time.sleep(0.2)
+        assert fetches.count("39.9") == 2 and weather.refresher.stats()["refreshed"] == 1
+        assert cache.stats()["stale_served"] == 1
+        print(f"   ✅ 返回旧数据并后台刷新: {cache.stats()}")
+        
+        # 热门网格到达更新时刻后主动刷新（上海只访问一次，不在热门列表中）
+        cache.update_interval = 3600
+        cache.clear()
+        fetches.clear()
+        weather.refresher.top_n = 1
+        weather.get_weather(31.2, 121.5, forecast_days=3)
+        for _ in range(3):
+            weather.get_weather(39.9, 116.4, forecast_days=3)
+        for entry in cache._entries.values():
+            entry["expires_at"] = time.time()   # 模拟到达模型更新时刻
+        assert weather.refresher.refresh_hot() == 1
+        time.sleep(0.2)
+        assert fetches == ["31.2", "39.9", "39.9"]
+        print(f"   ✅ 主动刷新热门网格: {weather.refresher.stats()}")
+        
+        # 访问频率按更新周期衰减：一小时前的热门网格在检查周期（30 秒）反复运行后仍被刷新
+        cache.clear()
+        fetches.clear()
+        weather.get_weather(31.2, 121.5, forecast_days=3)
+        for _ in range(10):
+            weather.get_weather(39.9, 116.4, forecast_days=3)
+        for _ in range(120):
+            cache._decayed_at -= 30     # 模拟距上次检查经过 30 秒
+            assert weather.refresher.refresh_hot() == 0
+        for entry in cache._entries.values():
+            entry["expires_at"] = time.time()
+        assert weather.refresher.refresh_hot() == 1
+        time.sleep(0.2)
+        assert fetches == ["31.2", "39.9", "39.9"], fetches
+        print("   ✅ 一小时前的热门网格在更新时刻仍被主动刷新")
+        
+        # 过期的 7 天条目被 3 天请求命中：后台按 7 天刷新，之后 7 天查询仍命中
+        cache.clear()
+        fetched_days.clear()
+        weather.get_weather(39.9, 116.4, forecast_days=7)
+        for entry in cache._entries.values():
+            entry["expires_at"] = time.time()
+        assert len(weather.get_weather(39.9, 116.4, forecast_days=3)["forecast"]) == 3
+        time.sleep(0.2)
+        key = cache.key_for(39.9, 116.4)
+        assert fetched_days == [7, 7], fetched_days
+        assert cache.get(key, 7) is not None
+        # 未过期的条目不会被天数更少的数据覆盖
+        cache.put(key, cache.get(key, 3), 3)
+        assert cache.get(key, 7) is not None
+        print("   ✅ 后台刷新和写入保留网格已获取的最多预报天数")
+        
+        # 主动刷新线程在第一次安排刷新时才启动；默认刷新器复用同一个查询器
+        lazy = WeatherRefresher(cache, fetch=weather._revalidate, autostart=True)
+        assert lazy._thread is None
+        assert lazy.schedule(key, 3) and lazy._thread is not None and lazy._thread.is_alive()
+        default = OpenMeteoWeather().refresher
+        assert default is get_default_refresher() and default.fetch.__self__.refresher is default
+        assert default._thread is None or default.scheduled > 0
+        print("   ✅ 主动刷新线程按需启动")
+    finally:
+        server.shutdown()
+    
+    return True
+
+
+def test_async_clients():
+    """测试16：异步地理编码和天气客户端（离线）"""
+    print("\n" + "=" * 60)
+    print("1️⃣6️⃣ 测试异步客户端（离线）")
+    print("=" * 60)
+    
+    queried = []
+    
+    def respond(path, query, headers):
+        if path == "/v1/forecast":
+            latitudes = query["latitude"][0].split(",")
+            longitudes = query["longitude"][0].split(",")
+            payloads = [
+                open_meteo_payload(lat, lon, query["forecast_days"][0])
+                for lat, lon in zip(latitudes, longitudes)
+            ]
+            return payloads if len(payloads) > 1 else payloads[0]
+        address = query["q"][0]
+        queried.append(address)
+        time.sleep(1.0 if address == "slow" else 0.1)
+        return [{"lat": "1.5", "lon": str(len(queried)), "display_name": address}]
+    
+    async def run(base_url):
+        geocoder = AsyncNominatimGeocoder(
+            cache=GeocodeCache(":memory:"),
+            rate_limiter=TokenBucketRateLimiter(rate=1000, burst=100),
+            transport=AsyncHttpTransport(max_retries=0),
+            use_gazetteer=False,
+            single_flight=AsyncSingleFlight()
+        )
+        geocoder.base_url = f"{base_url}/search"
+        
+        # 并发查询在同一个事件循环中完成，相同地址只请求一次
+        addresses = [f"place {i}" for i in range(40)] + ["Place 0", "PLACE 1"]
+        start = time.monotonic()
+        results = await asyncio.gather(*(geocoder.geocode(address) for address in addresses))
+        elapsed = time.monotonic() - start
+        assert all(results) and len(queried) == 40
+        assert elapsed < 2, elapsed
+        print(f"   ✅ {len(addresses)} 个并发查询，{len(queried)} 次请求，耗时 {elapsed:.2f} 秒")
+        
+        # 批量查询按完成顺序返回，缓存命中的先返回
+        pairs = [pair async for pair in geocoder.geocode_many(["place 3", "new place", "place 3"])]
+        assert [address for address, _ in pairs] == ["place 3", "place 3", "new place"]
+        
+        # 调用方处理命中结果期间，未命中的查询已在进行
+        pairs = geocoder.geocode_many(["place 3", "other place"])
+        assert (await pairs.__anext__())[0] == "place 3"
+        await asyncio.sleep(0.05)
+        assert queried[-1] == "other place"
+        assert (await pairs.__anext__())[0] == "other place"
+        
+        # 截止时间：超时返回 None；取消则向调用方传递
+        assert await geocoder.geocode("slow", timeout=0.2) is None
+        task = asyncio.ensure_future(geocoder.geocode("another slow"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+            assert False, "应抛出 CancelledError"
+        except asyncio.CancelledError:
+            pass
+        print("   ✅ 截止时间和取消生效")
+        
+        weather = AsyncOpenMeteoWeather(
+            transport=AsyncHttpTransport(max_retries=0),
+            cache=WeatherCache(),
+            single_flight=AsyncSingleFlight()
+        )
+        weather.base_url = f"{base_url}/v1/forecast"
+        result = await weather.get_weather(39.91, 116.41, forecast_days=3)
+        assert result["latitude"] == 39.9 and len(result["forecast"]) == 3
+        many = await weather.get_weather_many([(39.9, 116.4), (31.23, 121.47), (22.54, 114.06)], 3, chunk_size=1)
+        assert [item["latitude"] for item in many] == [39.9, 31.2, 22.5]
+        print("   ✅ 异步天气查询结果与同步版本一致")
+        
+        await geocoder.transport.aclose()
+        await weather.transport.aclose()
+    
+    server, base_url = start_stub_server(respond)
+    try:
+        asyncio.run(run(base_url))
+    finally:
+        server.shutdown()
+    
+    return True
+
+
+def test_parallel_tool_calls():
+    """测试17：同一轮工具调用并发执行（离线）"""
+    print("\n" + "=" * 60)
+    print("1️⃣7️⃣ 测试并发工具调用（离线）")
+    print("=" * 60)
+    
+    import main as agent
+    
+    delays = {"北京": 0.3, "上海": 0.3, "东京": 0.3, "火星": 1.5}
+    
+    def fake_execute_tool(tool_name, arguments, session=None):
+        if tool_name in agent.CONTROL_TOOLS:
+            return original(tool_name, arguments)
+        time.sleep(delays[arguments["address"]])
+        return json.dumps({"success": True, "address": arguments["address"]}, ensure_ascii=False)
+    
+    def tool_call(index, name, arguments):
+        return SimpleNamespace(
+            id=f"call_{index}",
+            function=SimpleNamespace(name=name, arguments=json.dumps(arguments, ensure_ascii=False))
+        )
+    
+    original, original_timeout = agent.execute_tool, agent.TOOL_TIMEOUT
+    agent.execute_tool = fake_execute_tool
+    try:
+        calls = [
+            tool_call(0, "geocode_address", {"address": "北京"}),
+            tool_call(1, "geocode_address", {"address": "上海"}),
+            tool_call(2, "navigate", {"action": "menu"}),
+            tool_call(3, "geocode_address", {"address": "东京"})
+        ]
+        messages = []
+        start = time.monotonic()
+        results = agent.run_tool_calls(calls, messages)
+        elapsed = time.monotonic() - start
+        
+        # 3 个 0.3 秒的工具并发执行，结果按原顺序追加
+        assert elapsed < 0.6, elapsed
+        assert [json.loads(r).get("address") for r in results] == ["北京", "上海", None, "东京"]
+        assert [m["tool_call_id"] for m in messages if m["role"] == "tool"] == ["call_0", "call_1", "call_2", "call_3"]
+        print(f"   ✅ 4 个工具调用耗时 {elapsed:.2f} 秒，结果顺序不变")
+        
+        # 超时的工具返回错误，不拖慢整轮
+        agent.TOOL_TIMEOUT = 0.5
+        start = time.monotonic()
+        results = agent.run_tool_calls([tool_call(4, "geocode_address", {"address": "火星"})], [])
+        assert time.monotonic() - start < 1
+        assert json.loads(results[0])["success"] is False
+        print("   ✅ 超时工具返回错误结果")
+        
+        # 参数无效（例如流式输出被截断）的调用单独返回错误，其余调用照常执行
+        agent.TOOL_TIMEOUT = original_timeout
+        truncated = SimpleNamespace(id="call_5", function=SimpleNamespace(name="geocode_address", arguments='{"address": "上'))
+        messages = []
+        results = agent.run_tool_calls([tool_call(6, "geocode_address", {"address": "北京"}), truncated], messages)
+        assert json.loads(results[0])["address"] == "北京"
+        assert json.loads(results[1]) == {"success": False, "error": "invalid arguments"}
+        assert [m["tool_call_id"] for m in messages if m["role"] == "tool"] == ["call_6", "call_5"]
+        print("   ✅ 参数无效的工具调用返回错误结果，不影响同一轮其他调用")
+    finally:
+        agent.execute_tool, agent.TOOL_TIMEOUT = original, original_timeout
+    
+    return True
+
+
+def test_weather_prefetch():
+    """测试18：地理编码后预取天气（离线）"""
+    print("\n" + "=" * 60)
+    print("1️⃣8️⃣ 测试天气预取（离线）")
+    print("=" * 60)
+    
+    fetched = []
+    
+    def fetch(latitude, longitude, forecast_days):
+        fetched.append((latitude, longitude, forecast_days))
+        time.sleep(0.2)
+        return {"latitude": latitude, "longitude": longitude, "forecast": [{"day": i} for i in range(forecast_days)]}
+    
+    prefetcher = WeatherPrefetcher(fetch, key_for=WeatherCache().key_for, ttl=60)
+    
+    # 预取进行中：等待同一个任务完成，不重复请求
+    assert prefetcher.prefetch(39.9042, 116.4074)
+    assert not prefetcher.prefetch(39.9, 116.4)
+    result = prefetcher.take(39.91, 116.41, forecast_days=3)
+    assert len(result["forecast"]) == 3 and len(fetched) == 1
+    assert prefetcher.take(39.91, 116.41, forecast_days=3) is None   # 每次预取只使用一次
+    
+    # 预取已完成：延迟与模型推理完全重叠
+    prefetcher.prefetch(31.23, 121.47)
+    time.sleep(0.3)
+    start = time.monotonic()
+    assert prefetcher.take(31.23, 121.47, forecast_days=7) is not None
+    assert time.monotonic() - start < 0.05
+    
+    # 超过预取天数或超过 ttl 未被使用
+    prefetcher.prefetch(22.54, 114.06)
+    assert prefetcher.take(22.54, 114.06, forecast_days=10) is None
+    prefetcher.ttl = 0
+    time.sleep(0.01)
+    stats = prefetcher.stats()
+    assert stats == {"started": 3, "hits": 2, "overlapped": 1, "wasted": 1, "failed": 0, "pending": 0}, stats
+    print(f"   ✅ 预取统计: {stats}")
+    
+    return True
+
+
+def test_weather_for_address():
+    """测试19：地名直接查询天气的组合工具（离线）"""
+    print("\n" + "=" * 60)
+    print("1️⃣9️⃣ 测试 weather_for_address 组合工具（离线）")
+    print("=" * 60)
+    
+    import main as agent
+    from weather_cache import get_default_weather_cache
+    
+    # 北京在离线地名索引中，天气预先写入默认缓存，全程无网络请求
+    location = Gazetteer().match("北京")
+    cache = get_default_weather_cache()
+    key = cache.key_for(location["latitude"], location["longitude"])
+    cache.put(key, OpenMeteoWeather(cache=cache)._format_weather_data(open_meteo_payload(key[0], key[1], 7)), 7)
+    
+    result = json.loads(agent.execute_tool("weather_for_address", {"address": "北京", "forecast_days": 2}))
+    assert result["ok"] and result["place"] == location["display_name"]
+    assert (result["lat"], result["lon"]) == (round(location["latitude"], 4), round(location["longitude"], 4))
+    assert len(result["days"]) == 2 and result["advice"]
+    print(f"   ✅ 一次调用返回 {result['place']} 的天气")
+    
+    assert "weather_for_address" in [tool["function"]["name"] for tool in agent.TOOLS]
+    cache.clear()
+    
+    return True
+
+
+def test_intent_router():
+    """测试20：控制指令本地路由（离线）"""
+    print("\n" + "=" * 60)
+    print("2️⃣0️⃣ 测试控制指令本地路由（离线）")
+    print("=" * 60)
+    
+    router = IntentRouter(default_llm_latency=2.0)
+    cases = {
+        "切换到英文": ("switch_language", {"language": "en"}),
+        "Switch to Chinese!": ("switch_language", {"language": "cn"}),
+        "关闭 thinking": ("toggle_thinking", {"enabled": False}),
+        "enable thinking": ("toggle_thinking", {"enabled": True}),
+        "退出。": ("navigate", {"action": "exit"}),
+        " QUIT ": ("navigate", {"action": "exit"}),
+        "返回菜单": ("navigate", {"action": "menu"}),
+        # 含糊或夹带其他内容的输入交给模型
+        "切换语言": None,
+        "退出前帮我查一下北京天气": None,
+        "how do I exit vim": None,
+        "英文怎么说切换": None,
+    }
+    for text, expected in cases.items():
+        language, routed = router.route(text)
+        assert routed == expected, text
+        assert language == ("cn" if any("\u4e00" <= char <= "\u9fff" for char in text) else "en"), text
+    stats = router.stats()
+    assert stats["hits"] == 7 and stats["lookups"] == len(cases)
+    assert 13.9 < stats["saved_seconds"] <= 14.0
+    print(f"   ✅ 命中率 {stats['hit_rate']:.0%}，估算节省 {stats['saved_seconds']:.1f} 秒")
+    
+    # 语言在路由的同一次调用中识别，未命中的输入也会返回
+    assert router.route("What's the weather in 北京?") == ("cn", None)
+    assert router.route("weather in Paris") == ("en", None)
+    print("   ✅ 路由同时返回输入语言")
+    
+    # 对话模式中控制指令不调用模型
+    import builtins
+    import main as agent
+    
+    def no_llm(*args, **kwargs):
+        raise AssertionError("控制指令不应调用模型")
+    
+    inputs = iter(["切换到英文", "exit"])
+    original_input, original_ask, original_settings = builtins.input, agent.ask_qwen, dict(agent.SETTINGS)
+    builtins.input = lambda prompt="": next(inputs)
+    agent.ask_qwen = no_llm
+    try:
+        assert agent.ai_chat_mode() == "exit"
+        assert agent.SETTINGS["language"] == "en"
+    finally:
+        builtins.input, agent.ask_qwen = original_input, original_ask
+        agent.SETTINGS.update(original_settings)
+    print("   ✅ 对话模式中控制指令在本地执行")
+    
+    return True
+
+
+def test_streaming_tool_turn():
+    """测试21：带工具调用的流式输出（离线）"""
+    print("\n" + "=" * 60)
+    print("2️⃣1️⃣ 测试带工具调用的流式输出（离线）")
+    print("=" * 60)
+    
+    import main as agent
+    
+    events = []
+    
+    def chunk(content=None, tool_calls=None):
+        delta = SimpleNamespace(content=content, tool_calls=tool_calls)
+        return SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+    
+    def call_delta(index, call_id=None, name=None, arguments=None):
+        return [SimpleNamespace(index=index, id=call_id, function=SimpleNamespace(name=name, arguments=arguments))]
+    
+    def first_round():
+        yield chunk(tool_calls=call_delta(0, "call_a", "weather_for_address", '{"address": '))
+        yield chunk(tool_calls=call_delta(0, arguments='"北京"}'))
+        yield chunk(tool_calls=call_delta(1, "call_b", "weather_for_address", '{"address": "上海"}'))
+        time.sleep(0.2)     # 模拟模型仍在输出时，第一个工具已开始执行
+        events.append("stream_end")
+    
+    def second_round():
+        for token in ["北京", "晴，", "上海", "多云"]:
+            yield chunk(content=token)
+    
+    rounds = iter([first_round(), second_round()])
+    fake_client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(
+        create=lambda **params: next(rounds) if params.get("stream") else None
+    )))
+    
+    def fake_execute_tool(tool_name, arguments, session=None):
+        events.append(f"tool:{arguments['address']}")
+        return json.dumps({"success": True, "address": arguments["address"]}, ensure_ascii=False)
+    
+    original_client, original_execute = agent.client, agent.execute_tool
+    agent.client, agent.execute_tool = fake_client, fake_execute_tool
+    try:
+        tokens = []
+        messages = [{"role": "user", "content": "北京和上海天气"}]
+        answer, nav_action = agent.ask_qwen("", messages=messages, use_tools=True, on_token=tokens.append)
+        
+        assert answer == "北京晴，上海多云" and nav_action is None
+        assert tokens == ["北京", "晴，", "上海", "多云"]
+        # 第一个调用的参数在第二个调用开始时即完整，流结束前已开始执行
+        assert events.index("tool:北京") < events.index("stream_end")
+        tool_messages = [m for m in messages if m["role"] == "tool"]
+        assert [m["tool_call_id"] for m in tool_messages] == ["call_a", "call_b"]
+        assert json.loads(tool_messages[0]["content"])["address"] == "北京"
+        print(f"   ✅ 工具提前执行，回答逐段输出: {tokens}")
+    finally:
+        agent.client, agent.execute_tool = original_client, original_execute
+    
+    return True
+
+
+def test_conversation_history():
+    """测试22：按 token 预算压缩对话历史（离线）"""
+    print("\n" + "=" * 60)
+    print("2️⃣2️⃣ 测试对话历史压缩（离线）")
+    print("=" * 60)
+    
+    assert estimate_tokens("北京天气") == 8 and estimate_tokens("weather") == 6
+    
+    history = ConversationHistory("你是一个智能助手。", token_budget=400, keep_turns=2, summary_tokens=120)
+    sizes = []
+    for i in range(60):
+        history.add("user", f"第 {i} 个问题：{'上海' * 20}明天天气怎么样？")
+        sizes.append(history.tokens())
+        history.add("assistant", f"第 {i} 个回答：" + "晴，气温 20°C。" * 8)
+    
+    # 提示词大小不随会话长度增长
+    assert max(sizes) <= 400 and max(sizes[30:]) - min(sizes[30:]) < 80, sizes
+    messages = history.messages()
+    assert messages[0] == {"role": "system", "content": "你是一个智能助手。"}
+    assert messages[1]["role"] == "system" and "summary" in messages[1]["content"]
+    # 最近几轮保持原文，摘要只保留最新几行
+    assert messages[-1]["content"].startswith("第 59 个回答") and messages[-2]["content"].startswith("第 59 个问题")
+    assert "第 0 个问题" not in messages[1]["content"] and "第 5" in messages[1]["content"]
+    stats = history.stats()
+    assert stats["turns"] >= 2 and stats["summarized_turns"] == 60 - stats["turns"]
+    print(f"   ✅ 60 轮后提示词约 {stats['tokens']} tokens: {stats}")
+    
+    return True
+
+
+def test_compact_tool_results():
+    """测试23：紧凑的单语言工具结果（离线）"""
+    print("\n" + "=" * 60)
+    print("2️⃣3️⃣ 测试紧凑工具结果（离线）")
+    print("=" * 60)
+    
+    import main as agent
+    
+    weather_api = OpenMeteoWeather(use_cache=False)
+    result = weather_api._format_weather_data(open_meteo_payload(39.9, 116.4, 3))
+    original = agent.COMPACT_TOOL_RESULTS
+    try:
+        agent.COMPACT_TOOL_RESULTS = False
+        full = agent.dump_tool_result(agent.build_weather_payload(weather_api, 39.9, 116.4, 3, result))
+        agent.COMPACT_TOOL_RESULTS = True
+        compact_cn = agent.dump_tool_result(agent.build_compact_weather_payload(weather_api, 39.9, 116.4, 3, result, "cn"))
+        compact_en = agent.dump_tool_result(agent.build_compact_weather_payload(weather_api, 39.9, 116.4, 3, result, "en"))
+    finally:
+        agent.COMPACT_TOOL_RESULTS = original
+    
+    # 只包含当前语言，结果稳定，token 明显减少
+    assert " / " not in compact_cn and not any("\u4e00" <= c <= "\u9fff" for c in compact_en)
+    assert compact_cn == agent.dump_tool_result(agent.build_compact_weather_payload(weather_api, 39.9, 116.4, 3, result, "cn"))
+    assert json.loads(compact_cn)["now"]["temp"] == round(result["current"]["temperature"], 1)
+    full_tokens, compact_tokens = estimate_tokens(full), estimate_tokens(compact_cn)
+    assert compact_tokens < full_tokens * 0.6, (full_tokens, compact_tokens)
+    print(f"   ✅ 天气结果 {full_tokens} → {compact_tokens} tokens（约减少 {1 - compact_tokens / full_tokens:.0%}）")
+    
+    return True
+
+
+def test_prompt_prefix_reuse():
+    """测试24：提示词前缀跨轮稳定（离线，本地模拟模型服务）"""
+    print("\n" + "=" * 60)
+    print("2️⃣4️⃣ 测试提示词前缀复用（离线）")
+    print("=" * 60)
+    
+    import main as agent
+    import bench_prompt_cache as bench
+    
+    # 语言切换只改变用户消息末尾的标记，系统提示词不变
+    history = ConversationHistory(agent.SYSTEM_PROMPT, token_budget=1000, keep_turns=2)
+    previous = history.messages()
+    for turn in range(12):
+        agent.SETTINGS["language"] = "cn" if turn % 2 == 0 else "en"
+        compactions = history.compactions
+        history.add("user", agent.with_language_tag(f"第{turn}个问题：北京天气怎么样？"))
+        history.add("assistant", "晴，15~22°C。" * 5)
+        current = history.messages()
+        assert current[0]["content"] == agent.SYSTEM_PROMPT
+        if history.compactions == compactions:
+            assert current[:len(previous)] == previous, f"第{turn}轮前缀发生变化"
+        previous = current
+    assert 0 < history.compactions < 6, history.stats()
+    print(f"   ✅ 12 轮对话压缩 {history.compactions} 次，其余轮次提示词均为上一轮的前缀")
+    
+    # 通过模拟服务跑完整请求，验证前缀复用率
+    server = bench.StandInServer(ms_per_token=1.0)
+    original_client, original_language = agent.client, agent.SETTINGS["language"]
+    try:
+        agent.client = bench.OpenAI(base_url=server.base_url, api_key="test")
+        records = {layout: bench.run_session(server, layout, 20) for layout in ("legacy", "stable")}
+    finally:
+        server.server.shutdown()
+        agent.client, agent.SETTINGS["language"] = original_client, original_language
+    
+    def reuse(rows):
+        return sum(r["reused_tokens"] for r in rows[1:]) / sum(r["prompt_tokens"] for r in rows[1:])
+    
+    assert reuse(records["stable"]) > 0.9, reuse(records["stable"])
+    assert reuse(records["stable"]) > reuse(records["legacy"])
+    print(f"   ✅ 前缀复用率 legacy {reuse(records['legacy']):.0%} → stable {reuse(records['stable']):.0%}")
+    
+    return True
+
+
+def test_model_warmup():
+    """测试25：模型预热与空闲保活（离线，本地模拟 Ollama）"""
+    print("\n" + "=" * 60)
+    print("2️⃣5️⃣ 测试模型预热与保活（离线）")
+    print("=" * 60)
+    
+    loaded = []
+    calls = {"generate": 0}
+    
+    def respond(path, query, headers):
+        if path == "/api/ps":
+            return {"models": [{"name": name, "model": name} for name in loaded]}
+        calls["generate"] += 1
+        if not loaded:
+            time.sleep(0.3)    # 模拟冷加载
+            loaded.append("qwen3:8b")
+            return {"model": "qwen3:8b", "done": True, "done_reason": "load", "load_duration": 300_000_000}
+        return {"model": "qwen3:8b", "done": True, "done_reason": "load", "load_duration": 1_000_000}
+    
+    server, base_url = start_stub_server(respond)
+    try:
+        assert native_api_url(base_url + "/v1/") == base_url + "/api"
+        warmer = ModelWarmer(base_url + "/v1", "qwen3:8b", interval=0.2, transport=HttpTransport())
+        warmer.start()
+        assert warmer.result(timeout=0) is None
+        result = warmer.result(timeout=5)
+        assert result["ok"] and result["status"] == "loaded" and result["load_seconds"] >= 0.3, result
+        print(f"   ✅ 后台预热完成：{result['seconds']:.2f}s（加载 {result['load_seconds']:.2f}s）")
+        
+        # 空闲超过间隔后发送保活请求，有活动时不发送
+        time.sleep(0.5)
+        assert warmer.pings >= 1, warmer.stats()
+        warmer.stop()
+        time.sleep(0.1)
+        pings = calls["generate"]
+        time.sleep(0.3)
+        assert calls["generate"] == pings
+        print(f"   ✅ 空闲保活 {warmer.pings} 次，停止后不再发送")
+        
+        again = ModelWarmer(base_url, "qwen3:8b", interval=0, transport=HttpTransport()).warm_up()
+        assert again["status"] == "already_loaded", again
+        print("   ✅ 模型已在内存中时报告 already_loaded")
+    finally:
+        server.shutdown()
+    
+    # 服务不可用时报告失败，不抛出异常
+    failed = ModelWarmer(base_url, "qwen3:8b", interval=0, timeout=1, transport=HttpTransport(max_retries=0)).warm_up()
+    assert not failed["ok"] and failed["status"] == "failed"
+    print("   ✅ 服务不可用时报告预热失败")
+    
+    return True
+
+
+def test_lazy_startup():
+    """测试26：启动时不导入重量级模块（子进程 -X importtime）"""
+    print("\n" + "=" * 60)
+    print("2️⃣6️⃣ 测试快速启动路径")
+    print("=" * 60)
+    
+    import bench_startup
+    
+    import_ms, loaded = bench_startup.measure_import("main")
+    heavy = [name for name in bench_startup.HEAVY_MODULES if name in loaded]
+    assert not heavy, f"启动时导入了: {heavy}"
+    assert "main" in loaded and import_ms > 0
+    print(f"   ✅ import main {import_ms:.1f} ms，未导入 {', '.join(bench_startup.HEAVY_MODULES)}")
+    assert "dotenv" not in loaded and "readline" not in loaded, "dotenv/readline 应在入口函数中加载"
+    
+    # 预算针对启动到输入提示符（含加载 .env、readline、预热线程和欢迎信息）
+    prompt_ms = bench_startup.measure_time_to_prompt()
+    assert prompt_ms > 0
+    print(f"   ✅ 启动到输入提示符 {prompt_ms:.1f} ms（含解释器启动）")
+    
+    # Client 在首次使用时创建，之后复用同一实例
+    import main as agent
+    original = agent.client
+    try:
+        agent.client = None
+        first = agent.get_client()
+        assert first is agent.get_client() and str(first.base_url).startswith(agent.OLLAMA_BASE_URL)
+    finally:
+        agent.client = original
+    print("   ✅ OpenAI Client 首次使用时创建并复用")
+    
+    # load_config 加载 .env 后重新读取模块配置
+    original_model = os.environ.get("MODEL_NAME")
+    try:
+        os.environ["MODEL_NAME"] = "bench-model"
+        agent.load_config()
+        assert agent.MODEL_NAME == "bench-model"
+    finally:
+        if original_model is None:
+            os.environ.pop("MODEL_NAME", None)
+        else:
+            os.environ["MODEL_NAME"] = original_model
+        agent.load_config()
+    print("   ✅ load_config 重新读取环境变量")
+    
+    return True
+
+
+def test_session_server():
+    """测试27：多会话 HTTP 服务（离线）"""
+    print("\n" + "=" * 60)
+    print("2️⃣7️⃣ 测试多会话 HTTP 服务（离线）")
+    print("=" * 60)
+    
+    import main as agent
+    from server import AgentServer, SessionStore
+    
+    active, overlaps = [0], []
+    
+    def fake_create(**params):
+        question = params["messages"][-1]["content"].split("\n")[0]
+        def stream():
+            if question.startswith("慢"):
+                # 慢速回答：逐段输出，期间记录同时进行的模型请求数
+                active[0] += 1
+                overlaps.append(active[0])
+                try:
+                    for i in range(20):
+                        time.sleep(0.02)
+                        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=f"{i} " * 200, tool_calls=None))])
+                finally:
+                    active[0] -= 1
+                return
+            for token in ["收到：", question]:
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token, tool_calls=None))])
+        return stream()
+    
+    fake_client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=fake_create)))
+    
+    async def request(port, method, path, payload=None):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        body = json.dumps(payload or {}, ensure_ascii=False).encode()
+        writer.write(f"{method} {path} HTTP/1.1\r\nHost: test\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+        raw = await reader.read()
+        writer.close()
+        head, _, data = raw.partition(b"\r\n\r\n")
+        status = int(head.split()[1])
+        if b"chunked" not in head:
+            return status, json.loads(data)
+        events = []
+        while data:
+            size, _, data = data.partition(b"\r\n")
+            if int(size, 16) == 0:
+                break
+            events.append(json.loads(data[:int(size, 16)]))
+            data = data[int(size, 16) + 2:]
+        return status, events
+    
+    async def scenario():
+        server = AgentServer(port=0, store=SessionStore(ttl=60), sweep_interval=0.1)
+        await server.start()
+        port = server.port
+        try:
+            _, a = await request(port, "POST", "/sessions")
+            _, b = await request(port, "POST", "/sessions")
+            a_path, b_path = f"/sessions/{a['session_id']}/messages", f"/sessions/{b['session_id']}/messages"
+            
+            # 两个会话并发对话，语言设置互不影响
+            (_, switched), (_, answered) = await asyncio.gather(
+                request(port, "POST", a_path, {"message": "switch to english"}),
+                request(port, "POST", b_path, {"message": "北京天气怎么样"})
+            )
+            assert switched[-1]["type"] == "done" and switched[-1]["language"] == "en", switched
+            assert [e["text"] for e in answered if e["type"] == "token"] == ["收到：", "北京天气怎么样"], answered
+            assert answered[-1]["answer"] == "收到：北京天气怎么样" and answered[-1]["language"] == "cn"
+            assert agent.SETTINGS["language"] == original_language    # 全局设置不受会话影响
+            
+            session_a = server.store.get(a["session_id"])
+            session_b = server.store.get(b["session_id"])
+            assert len(session_b.history.messages()) == 3 and len(session_a.history.messages()) == 1
+            print(f"   ✅ 两个会话并发：A 切换为 {session_a.language}，B 保持 {session_b.language}，回答逐段返回")
+            
+            # 结束会话、未知会话、空闲回收
+            assert (await request(port, "DELETE", f"/sessions/{a['session_id']}"))[0] == 200
+            assert (await request(port, "POST", a_path, {"message": "hi"}))[0] == 404
+            
+            # 客户端中途断开：本轮完成前同一会话的下一条消息排队等待，会话不被回收
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            body = json.dumps({"message": "慢一"}, ensure_ascii=False).encode()
+            writer.write(f"POST {b_path} HTTP/1.1\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+            await reader.readuntil(b'"token"')
+            writer.transport.abort()
+            server.store.ttl = 0
+            status, second = await request(port, "POST", b_path, {"message": "慢二"})
+            server.store.ttl = 60
+            assert status == 200 and second[-1]["type"] == "done", second[-1]
+            assert overlaps == [1, 1], f"同一会话的轮次并发执行: {overlaps}"
+            contents = [m["content"].split("\n")[0] for m in session_b.history.messages()[3:]]
+            assert contents[0] == "慢一" and contents[2] == "慢二" and len(contents) == 4, contents
+            assert b["session_id"] in server.store
+            print("   ✅ 客户端中途断开后，下一条消息等上一轮写完历史再执行")
+            
+            server.store.ttl = 0
+            await asyncio.sleep(0.3)
+            assert b["session_id"] not in server.store and server.store.evicted == 1
+            status, health = await request(port, "GET", "/health")
+            assert status == 200 and health["sessions"]["active"] == 0 and health["turns"] == 4
+            print(f"   ✅ 会话结束与空闲回收: {health['sessions']}")
+        finally:
+            await server.stop()
+    
+    original_client, original_language = agent.client, agent.SETTINGS["language"]
+    agent.client = fake_client
+    try:
+        asyncio.run(scenario())
+    finally:
+        agent.client = original_client
+    
+    return True
+
+
+def test_session_context():
+    """测试28：会话上下文隔离与并行执行（离线）"""
+    print("\n" + "=" * 60)
+    print("2️⃣8️⃣ 测试会话上下文（离线）")
+    print("=" * 60)
+    
+    import main as agent
+    
+    # 控制类工具只修改所在会话的设置
+    cn, en = Session(), Session()
+    original_settings = dict(agent.SETTINGS)
+    json.loads(agent.execute_tool("switch_language", {"language": "en"}, en))
+    json.loads(agent.execute_tool("toggle_thinking", {"enabled": True}, en))
+    assert en.language == "en" and en.show_thinking
+    assert cn.language == "cn" and not cn.show_thinking and agent.SETTINGS == original_settings
+    assert agent.t("goodbye", session=en) != agent.t("goodbye", session=cn)
+    assert agent.with_language_tag("hi", en).endswith("[current_language: en]")
+    print("   ✅ 切换语言和 thinking 只影响所在会话")
+    
+    # 每个会话使用自己的客户端，多个线程同时执行，语言标记各自独立
+    def slow_client(reply):
+        def create(**params):
+            time.sleep(0.3)
+            message = SimpleNamespace(content=f"{reply}|{params['messages'][-1]['content'][-3:-1]}", tool_calls=None)
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    
+    sessions = [Session(client=slow_client(f"s{i}")) for i in range(4)]
+    for i, session in enumerate(sessions):
+        session.language = "en" if i % 2 else "cn"
+    answers = [None] * len(sessions)
+    
+    def run(i):
+        session = sessions[i]
+        messages = [{"role": "user", "content": agent.with_language_tag("天气", session)}]
+        answers[i] = agent.ask_qwen("", messages=messages, use_tools=True, session=session)[0]
+    
+    original_scheduler = agent.get_default_scheduler
+    agent.get_default_scheduler = lambda: LLMScheduler(max_concurrency=len(sessions))
+    try:
+        start = time.time()
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(len(sessions))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+    finally:
+        agent.get_default_scheduler = original_scheduler
+    assert answers == ["s0|cn", "s1|en", "s2|cn", "s3|en"], answers
+    assert elapsed < 0.9, f"会话未并行执行: {elapsed:.2f}s"
+    print(f"   ✅ 4 个会话并行执行 {elapsed:.2f}s（串行约 1.2s）: {answers}")
+    
+    return True
+
+
+def test_llm_response_cache():
+    """测试29：模型回答缓存（离线）"""
+    print("\n" + "=" * 60)
+    print("2️⃣9️⃣ 测试模型回答缓存（离线）")
+    print("=" * 60)
+    
+    import main as agent
+    
+    # 规范化：全角/空白差异和工具调用 ID 不影响缓存键，temperature 不同则不同
+    def call(call_id, arguments):
+        return {"role": "assistant", "content": None, "tool_calls": [
+            {"id": call_id, "type": "function", "function": {"name": "get_weather", "arguments": arguments}}
+        ]}
+    base = [{"role": "user", "content": "北京天气 怎么样？"}, call("a", '{"latitude": 39.9, "longitude": 116.4}')]
+    variant = [{"role": "user", "content": " 北京天气  怎么样?"}, call("b", '{"longitude":116.4,"latitude":39.9}')]
+    assert make_cache_key("m", base, None, 0.7) == make_cache_key("m", variant, None, 0.7)
+    assert make_cache_key("m", base, None, 0.7) != make_cache_key("m", base, None, 0.2)
+    print("   ✅ 缓存键忽略全角/空白差异和工具调用 ID")
+    
+    # LRU 淘汰、过期、磁盘持久化
+    cache = LLMResponseCache(max_entries=2, ttl=60)
+    for key in ("a", "b", "c"):
+        cache.set(key, {"answer": key})
+    assert cache.get("a") is None and cache.get("c") == {"answer": "c"} and cache.evictions == 1
+    cache.set("short", {"answer": "x"}, ttl=0.05)
+    time.sleep(0.1)
+    assert cache.get("short") is None
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "llm.sqlite3")
+        disk = LLMResponseCache(ttl=60, path=path)
+        disk.set("k", {"answer": "持久化"})
+        disk.close()
+        reopened = LLMResponseCache(ttl=60, path=path)
+        assert reopened.get("k") == {"answer": "持久化"} and reopened.disk_hits == 1
+        reopened.close()
+    print("   ✅ LRU 淘汰、过期和磁盘持久化")
+    
+    # ask_qwen：相同的开场问题第二次直接命中缓存，不调用模型
+    calls = []
+    
+    def fake_create(**params):
+        calls.append(params["messages"][-1]["content"])
+        time.sleep(0.2)
+        tool_calls = None
+        question = params["messages"][-1]["content"]
+        if params["messages"][-1]["role"] == "user" and "英文" in question:
+            tool_calls = [SimpleNamespace(id="c1", function=SimpleNamespace(name="switch_language", arguments='{"language": "en"}'))]
+        message = SimpleNamespace(content=None if tool_calls else "晴，15°C", tool_calls=tool_calls)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+    
+    session = Session(client=SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=fake_create))))
+    shared = LLMResponseCache(ttl=600)
+    original_get = agent.get_default_llm_cache
+    agent.get_default_llm_cache = lambda: shared
+    try:
+        def ask(question):
+            messages = [{"role": "system", "content": agent.SYSTEM_PROMPT}, {"role": "user", "content": question}]
+            return agent.ask_qwen(question, messages=messages, use_tools=True, session=session)
+        
+        assert ask("今天北京天气怎么样") == ("晴，15°C", None) and len(calls) == 1
+        start = time.time()
+        tokens = []
+        messages = [{"role": "system", "content": agent.SYSTEM_PROMPT}, {"role": "user", "content": "今天北京天气怎么样"}]
+        answer, _ = agent.ask_qwen("", messages=messages, use_tools=True, on_token=tokens.append, session=session)
+        elapsed = time.time() - start
+        assert answer == "晴，15°C" and tokens == ["晴，15°C"] and len(calls) == 1
+        assert elapsed < 0.05, elapsed
+        print(f"   ✅ 相同问题第二次命中缓存：{elapsed * 1000:.1f} ms，未调用模型")
+        
+        # 调用了控制类工具的回答不缓存（重放会跳过切换语言的副作用）
+        ask("切换成英文然后回答")
+        session.language = "cn"
+        ask("切换成英文然后回答")
+        assert session.language == "en" and shared.stores == 1
+        print("   ✅ 含控制类工具的回答不缓存")
+    finally:
+        agent.get_default_llm_cache = original_get
+    
+    # 天气工具的回答有效期不超过天气数据的下一次更新
+    ttl = agent.response_cache_ttl({"weather_for_address"})
+    assert 0 < ttl <= 3600 and agent.response_cache_ttl({"geocode_address"}) is None
+    assert agent.response_cache_ttl({"navigate"}) == 0
+    print(f"   ✅ 天气类回答有效期 {ttl:.0f}s（至下次模型更新）")
+    
+    return True
+
+
+def test_llm_scheduler():
+    """测试30：模型请求调度（并发上限、优先级、排队期限）"""
+    print("\n" + "=" * 60)
+    print("3️⃣0️⃣ 测试模型请求调度")
+    print("=" * 60)
+    
+    import main as agent
+    
+    # 名额被占用时，后到的交互式请求排在先到的批量请求之前
+    scheduler = LLMScheduler(max_concurrency=1, max_queue=2, deadline=5)
+    order = []
+    scheduler.acquire()
+    
+    def worker(name, priority):
+        with scheduler.slot(priority):
+            order.append(name)
+    
+    batch = threading.Thread(target=worker, args=("batch", PRIORITY_BATCH))
+    batch.start()
+    time.sleep(0.05)
+    interactive = threading.Thread(target=worker, args=("interactive", PRIORITY_INTERACTIVE))
+    interactive.start()
+    time.sleep(0.05)
+    assert scheduler.stats()["queue_depth"] == 2
+    
+    # 队列已满时立即失败，排队超过期限时失败
+    start = time.time()
+    try:
+        scheduler.acquire()
+        assert False, "队列已满时应失败"
+    except SchedulerTimeout:
+        assert time.time() - start < 0.05
+    scheduler.release()
+    batch.join()
+    interactive.join()
+    assert order == ["interactive", "batch"], order
+    stats = scheduler.stats()
+    assert stats["running"] == 0 and stats["queue_depth"] == 0 and stats["rejected"] == 1 and stats["wait_max"] > 0
+    print(f"   ✅ 交互式请求优先于批量请求: {order}，队列满时拒绝")
+    
+    scheduler.acquire()
+    try:
+        scheduler.acquire(deadline=0.1)
+        assert False, "排队超时应失败"
+    except SchedulerTimeout:
+        pass
+    scheduler.release()
+    assert scheduler.stats()["timed_out"] == 1 and scheduler.stats()["running"] == 0
+    print("   ✅ 排队超过期限时失败，名额正确归还")
+    
+    # 并发上限：4 个会话同时请求，同一时刻最多 2 个在执行
+    active, peak = [0], [0]
+    lock = threading.Lock()
+    
+    def create(**params):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.1)
+        with lock:
+            active[0] -= 1
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="ok", tool_calls=None))])
+    
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    limited = LLMScheduler(max_concurrency=2, deadline=5)
+    original_scheduler = agent.get_default_scheduler
+    agent.get_default_scheduler = lambda: limited
+    try:
+        threads = [
+            threading.Thread(target=agent.ask_qwen, args=("hi",), kwargs={"session": Session(client=client)})
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert peak[0] == 2 and limited.stats()["completed"] == 4, (peak, limited.stats())
+        print(f"   ✅ 并发上限 2：{limited.stats()['completed']} 个请求，最长排队 {limited.stats()['wait_max']:.2f}s")
+        
+        # 排队超时时返回已有的超时提示
+        limited.acquire()
+        limited.acquire()
+        limited.deadline = 0.1
+        session = Session(client=client)
+        answer, _ = agent.ask_qwen("hi", session=session)
+        assert answer == agent.t("error_timeout", session=session), answer
+        print(f"   ✅ 排队超时返回: {answer}")
+    finally:
+        agent.get_default_scheduler = original_scheduler
+    
+    return True
+
+
 def main():
     """运行所有测试"""
     print("\n" + "=" * 60)
     print("🧪 天气功能完整测试套件")
     print("=" * 60)
-    print("测试项目：地理编码、天气查询、集成功能、格式展示、多城市对比")
+    print("测试项目：地理编码、天气查询、集成功能、格式展示、多城市对比、缓存、限流、连接池、批量查询、离线地名、反向地理编码、天气缓存、批量天气、请求合并、后台刷新、异步客户端、并发工具调用、天气预取、组合天气工具、本地意图路由、流式工具调用、对话历史压缩、紧凑工具结果、提示词前缀复用、模型预热、快速启动、多会话服务、会话上下文、模型回答缓存、模型请求调度")
     print("=" * 60 + "\n")
     
     all_passed = True
@@ -261,7 +1890,32 @@ def main():
         ("天气查询测试", test_weather),
         ("集成功能测试", test_integration),
         ("格式展示测试", test_display_format),
-        ("多城市对比测试", test_multiple_cities)
+        ("多城市对比测试", test_multiple_cities),
+        ("地理编码缓存测试", test_geocode_cache),
+        ("限流器测试", test_rate_limiter),
+        ("连接池测试", test_http_transport),
+        ("批量地理编码测试", test_geocode_many),
+        ("离线地名索引测试", test_gazetteer),
+        ("反向地理编码测试", test_reverse_geocode),
+        ("天气缓存测试", test_weather_cache),
+        ("多地点天气测试", test_weather_many),
+        ("请求合并测试", test_single_flight),
+        ("后台刷新测试", test_stale_while_revalidate),
+        ("异步客户端测试", test_async_clients),
+        ("并发工具调用测试", test_parallel_tool_calls),
+        ("天气预取测试", test_weather_prefetch),
+        ("组合天气工具测试", test_weather_for_address),
+        ("本地意图路由测试", test_intent_router),
+        ("流式工具调用测试", test_streaming_tool_turn),
+        ("对话历史压缩测试", test_conversation_history),
+        ("紧凑工具结果测试", test_compact_tool_results),
+        ("提示词前缀复用测试", test_prompt_prefix_reuse),
+        ("模型预热测试", test_model_warmup),
+        ("快速启动测试", test_lazy_startup),
+        ("多会话服务测试", test_session_server),
+        ("会话上下文测试", test_session_context),
+        ("模型回答缓存测试", test_llm_response_cache),
+        ("模型请求调度测试", test_llm_scheduler)
     ]
     
     for test_name, test_func in tests:
@@ -17,6 +17,11 @@ TEXTS = {
     "thank_you": {"cn": "👋 感谢使用，再见！", "en": "👋 Thank you for using, goodbye!"},
     "user_prompt": {"cn": "User：", "en": "User: "},
     "assistant_prompt": {"cn": "\nAssistant：{answer}\n", "en": "\nAssistant: {answer}\n"},
+    "warmup_waiting": {"cn": "⏳ 模型加载中，请稍候...", "en": "⏳ Loading model, please wait..."},
+    "warmup_loaded": {"cn": "🔥 模型已预热（{seconds:.1f} 秒，其中加载 {load:.1f} 秒）", "en": "🔥 Model warmed up ({seconds:.1f}s, load {load:.1f}s)"},
+    "warmup_already_loaded": {"cn": "🔥 模型已在内存中（{seconds:.1f} 秒）", "en": "🔥 Model already in memory ({seconds:.1f}s)"},
+    "warmup_failed": {"cn": "⚠️ 模型预热失败：{error}", "en": "⚠️ Model warm-up failed: {error}"},
+    "lang_auto_switch": {"cn": "已自动切换语言", "en": "Language switched automatically"},
     "ai_thinking": {"cn": "\n🤔 AI 正在思考...\n", "en": "\n🤔 AI is thinking...\n"},
     
     # AI 对话模式
@@ -36,6 +41,7 @@ TEXTS = {
     # 工具调用显示
     "tool_calling": {"cn": "🔧 正在调用工具: {tool}", "en": "🔧 Calling tool: {tool}"},
     "tool_query_address": {"cn": "📍 查询地址: {address}", "en": "📍 Query address: {address}"},
+    "tool_query_coordinates": {"cn": "🗺️ 查询坐标: ({latitude}, {longitude})", "en": "🗺️ Query coordinates: ({latitude}, {longitude})"},
     "tool_switch_lang": {"cn": "🌐 切换到: {lang}", "en": "🌐 Switch to: {lang}"},
     "tool_thinking_status": {"cn": "🤔 AI Thinking: {status}", "en": "🤔 AI Thinking: {status}"},
     "tool_navigation": {"cn": "🔄 操作: {action}", "en": "🔄 Action: {action}"},
@@ -0,0 +1,218 @@
+"""
+模型预热与保活
+启动时在后台通过 Ollama 原生接口加载模型并设置 keep_alive，与欢迎信息的打印并行；
+会话空闲时定期发送保活请求，避免模型被卸载后下一轮重新冷加载
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, Optional
+
+# http_transport 会导入 requests 和 httpx，在后台线程首次发送请求时才导入，不拖慢启动
+if TYPE_CHECKING:
+    from http_transport import HttpTransport
+
+logger = logging.getLogger(__name__)
+
+
+def native_api_url(base_url: str) -> str:
+    """
+    由 OpenAI 兼容地址推出 Ollama 原生接口地址
+
+    Args:
+        base_url: 例如 http://localhost:11434/v1
+
+    Returns:
+        例如 http://localhost:11434/api
+    """
+    base_url = base_url.rstrip("/")
+    if base_url.endswith("/v1"):
+        base_url = base_url[:-3]
+    return base_url + "/api"
+
+
+class ModelWarmer:
+    """
+    模型预热器
+    预热请求不含提示词，Ollama 只加载模型并按 keep_alive 保留在内存中；
+    保活请求与预热请求相同，只在距上次活动超过 interval 时发送
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        model: str,
+        keep_alive: str = "30m",
+        interval: float = 240,
+        timeout: float = 300,
+        transport: Optional["HttpTransport"] = None
+    ):
+        """
+        初始化预热器
+
+        Args:
+            base_url: Ollama 的 OpenAI 兼容地址
+            model: 模型名称
+            keep_alive: 模型在内存中保留的时长（Ollama 格式，如 "30m"、"-1" 表示一直保留）
+            interval: 空闲保活间隔（秒），0 表示不发送保活请求；OpenAI 兼容接口的请求使用
+                      Ollama 默认的 5 分钟 keep_alive，间隔需短于该时长
+            timeout: 单次请求超时（秒），需覆盖冷加载时间
+            transport: HTTP 传输层，默认使用共享连接池
+        """
+        self.api_url = native_api_url(base_url)
+        self.model = model
+        self.keep_alive = keep_alive
+        self.interval = interval
+        self.timeout = timeout
+        self._transport = transport
+        self._done = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_active = time.monotonic()
+        self._result: Optional[Dict] = None
+
+        # 统计计数
+        self.pings = 0
+        self.ping_failures = 0
+
+    @property
+    def transport(self) -> "HttpTransport":
+        """HTTP 传输层（未指定时首次使用共享连接池）"""
+        if self._transport is None:
+            from http_transport import get_default_transport
+            self._transport = get_default_transport()
+        return self._transport
+
+    def is_loaded(self) -> Optional[bool]:
+        """
+        查询模型当前是否已在内存中
+
+        Returns:
+            是否已加载，查询失败时返回 None
+        """
+        try:
+            response = self.transport.get(f"{self.api_url}/ps", timeout=5)
+            response.raise_for_status()
+            models = response.json().get("models", [])
+            names = {m.get("name") for m in models} | {m.get("model") for m in models}
+            return self.model in names or f"{self.model}:latest" in names
+        except Exception:
+            return None
+
+    def _load(self) -> Dict:
+        """发送一次不含提示词的生成请求，加载模型并刷新 keep_alive"""
+        started = time.monotonic()
+        response = self.transport.session.post(
+            f"{self.api_url}/generate",
+            json={"model": self.model, "keep_alive": self.keep_alive, "stream": False},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        data = response.json()
+        return {
+            "seconds": time.monotonic() - started,
+            "load_seconds": data.get("load_duration", 0) / 1e9
+        }
+
+    def warm_up(self) -> Dict:
+        """
+        预热模型（阻塞）
+
+        Returns:
+            包含 ok、status（already_loaded / loaded / failed）、耗时和模型加载时间的字典
+        """
+        was_loaded = self.is_loaded()
+        try:
+            result = dict(self._load(), ok=True, status="already_loaded" if was_loaded else "loaded")
+        except Exception as e:
+            result = {"ok": False, "status": "failed", "error": str(e)}
+        self._result = result
+        self._done.set()
+        if result["ok"]:
+            logger.info(
+                "model %s warm-up %s in %.2fs (load %.2fs, keep_alive %s)",
+                self.model, result["status"], result["seconds"], result["load_seconds"], self.keep_alive
+            )
+        else:
+            logger.warning("model %s warm-up failed: %s", self.model, result["error"])
+        return result
+
+    def start(self):
+        """在后台线程中预热模型，之后按空闲间隔发送保活请求"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="model-warmup", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        self.warm_up()
+        if self.interval <= 0:
+            return
+        while not self._stop.wait(self.interval / 4):
+            if time.monotonic() - self._last_active < self.interval:
+                continue
+            try:
+                self._load()
+                self.pings += 1
+            except Exception as e:
+                self.ping_failures += 1
+                logger.warning("model %s keep-alive ping failed: %s", self.model, e)
+            self._last_active = time.monotonic()
+
+    def touch(self):
+        """记录一次模型调用（真实请求本身会让模型保持加载，空闲计时从此重新开始）"""
+        self._last_active = time.monotonic()
+
+    def result(self, timeout: Optional[float] = None) -> Optional[Dict]:
+        """
+        获取预热结果（进行中则等待）
+
+        Args:
+            timeout: 最长等待时间（秒），None 表示一直等待
+
+        Returns:
+            warm_up() 的结果，尚未完成时返回 None
+        """
+        self._done.wait(timeout)
+        return self._result
+
+    def stop(self):
+        """停止保活线程"""
+        self._stop.set()
+
+    def stats(self) -> Dict:
+        """
+        返回预热和保活统计信息
+
+        Returns:
+            包含预热结果、保活次数和失败次数的字典
+        """
+        return {
+            "warmup": self._result,
+            "pings": self.pings,
+            "ping_failures": self.ping_failures
+        }
+
+
+def create_warmer(base_url: str, model: str) -> Optional[ModelWarmer]:
+    """
+    按环境变量创建预热器
+    可通过 WARMUP（0 关闭）、OLLAMA_KEEP_ALIVE、KEEPALIVE_INTERVAL 配置
+
+    Args:
+        base_url: Ollama 的 OpenAI 兼容地址
+        model: 模型名称
+
+    Returns:
+        ModelWarmer 实例，关闭预热时返回 None
+    """
+    if os.getenv("WARMUP", "1") == "0":
+        return None
+    return ModelWarmer(
+        base_url,
+        model,
+        keep_alive=os.getenv("OLLAMA_KEEP_ALIVE", "30m"),
+        interval=float(os.getenv("KEEPALIVE_INTERVAL", 240))
+    )
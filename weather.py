@@ -4,9 +4,33 @@ Open-Meteo Weather API 包装器
 文档: https://open-meteo.com/
 """
 
+import asyncio
+import os
+import httpx
 import requests
-from typing import Optional, Dict
+import threading
+from typing import Optional, Dict, List, Sequence, Tuple
 from datetime import datetime
+from http_transport import AsyncHttpTransport, HttpTransport, get_default_async_transport, get_default_transport
+from single_flight import AsyncSingleFlight, SingleFlight, get_shared_async_flight, get_shared_flight
+from weather_cache import WeatherCache, WeatherRefresher, get_default_weather_cache
+
+
+def _pick_language(text: str, lang: Optional[str]) -> str:
+    """
+    从 "中文 / English" 格式的双语文本中取出一种语言
+    
+    Args:
+        text: 双语文本
+        lang: 语言代码（cn/en），为 None 时原样返回
+    
+    Returns:
+        对应语言的文本
+    """
+    if lang is None or " / " not in text:
+        return text
+    chinese, english = text.split(" / ", 1)
+    return chinese if lang == "cn" else english
 
 
 class OpenMeteoWeather:
@@ -15,12 +39,35 @@ class OpenMeteoWeather:
     Open-Meteo 是免费的天气 API，无需 API key
     """
     
-    def __init__(self):
-        """初始化 Open-Meteo 天气查询器"""
+    def __init__(
+        self,
+        transport: Optional[HttpTransport] = None,
+        cache: Optional[WeatherCache] = None,
+        use_cache: bool = True,
+        single_flight: Optional[SingleFlight] = None,
+        refresher: Optional[WeatherRefresher] = None
+    ):
+        """
+        初始化 Open-Meteo 天气查询器
+        
+        Args:
+            transport: HTTP 传输层，默认使用进程共享的连接池
+            cache: 天气缓存，默认使用进程共享的缓存
+            use_cache: 是否启用缓存
+            single_flight: 请求合并器，默认在进程内共享
+            refresher: 过期数据的后台刷新器；使用默认缓存时默认启用进程共享的刷新器，
+                       未提供刷新器时不返回过期数据
+        """
         self.base_url = "https://api.open-meteo.com/v1/forecast"
         self.headers = {
             "User-Agent": "Mozilla/5.0 (compatible; AgentService/1.0)"
         }
+        self.transport = transport or get_default_transport()
+        self.cache = (cache or get_default_weather_cache()) if use_cache else None
+        self.single_flight = single_flight or get_shared_flight("open-meteo")
+        if refresher is None and cache is None and use_cache:
+            refresher = get_default_refresher()
+        self.refresher = refresher
     
     def get_weather(
         self, 
@@ -39,42 +86,16 @@ class OpenMeteoWeather:
         Returns:
             包含天气信息的字典，失败返回 None
         """
+        if self.cache is not None:
+            key = self.cache.key_for(latitude, longitude)
+            cached = self._from_cache(key, forecast_days)
+            if cached is not None:
+                return cached
+            # 按网格中心查询，结果对整个网格有效
+            latitude, longitude = key
+        
         try:
-            params = {
-                "latitude": latitude,
-                "longitude": longitude,
-                "current": [
-                    "temperature_2m",           # 当前气温
-                    "relative_humidity_2m",     # 相对湿度
-                    "apparent_temperature",     # 体感温度
-                    "precipitation",            # 降水量
-                    "weather_code",             # 天气代码
-                    "wind_speed_10m",           # 风速
-                ],
-                "daily": [
-                    "weather_code",             # 天气代码
-                    "temperature_2m_max",       # 最高温度
-                    "temperature_2m_min",       # 最低温度
-                    "precipitation_sum",        # 降水总量
-                    "wind_speed_10m_max",       # 最大风速
-                ],
-                "timezone": "auto",             # 自动时区
-                "forecast_days": forecast_days
-            }
-            
-            response = requests.get(
-                self.base_url,
-                params=params,
-                headers=self.headers,
-                timeout=30
-            )
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            # 解析并格式化数据
-            return self._format_weather_data(data)
-            
+            return self._revalidate(latitude, longitude, forecast_days)
         except requests.exceptions.RequestException as e:
             print(f"天气查询请求错误: {e}")
             return None
@@ -82,6 +103,250 @@ class OpenMeteoWeather:
             print(f"天气数据解析错误: {e}")
             return None
     
+    def _from_cache(self, key: Tuple[float, float], forecast_days: int) -> Optional[Dict]:
+        """
+        从缓存读取天气；有刷新器时允许返回过期数据并安排后台刷新
+        
+        Args:
+            key: 网格键
+            forecast_days: 预报天数
+        
+        Returns:
+            天气数据，未命中返回 None
+        """
+        data, stale = self.cache.lookup(key, forecast_days, allow_stale=self.refresher is not None)
+        if stale:
+            self.refresher.schedule(key, forecast_days)
+        return data
+    
+    def _revalidate(self, latitude: float, longitude: float, forecast_days: int) -> Dict:
+        """
+        重新获取天气（相同网格、相同天数的并发查询合并为一次请求）
+        
+        Args:
+            latitude: 纬度
+            longitude: 经度
+            forecast_days: 预报天数
+        
+        Returns:
+            格式化后的天气数据
+        """
+        return self.single_flight.do(
+            (latitude, longitude, forecast_days),
+            self._fetch_weather,
+            latitude,
+            longitude,
+            forecast_days
+        )
+    
+    def _fetch_weather(self, latitude: float, longitude: float, forecast_days: int) -> Dict:
+        """
+        请求 Open-Meteo 并写入缓存（网络和解析错误直接抛出）
+        
+        Args:
+            latitude: 纬度（启用缓存时为网格中心）
+            longitude: 经度（启用缓存时为网格中心）
+            forecast_days: 预报天数
+        
+        Returns:
+            格式化后的天气数据
+        """
+        params = self._build_params(latitude, longitude, forecast_days)
+        
+        response = self.transport.get(
+            self.base_url,
+            params=params,
+            headers=self.headers,
+            timeout=30
+        )
+        response.raise_for_status()
+        
+        return self._fill((latitude, longitude), response.json(), forecast_days)
+    
+    def _fill(self, key: Tuple[float, float], data: Dict, forecast_days: int) -> Dict:
+        """
+        格式化单个地点的原始数据并写入缓存
+        
+        Args:
+            key: 网格键（未启用缓存时为原始坐标）
+            data: Open-Meteo 返回的单个地点数据
+            forecast_days: 预报天数
+        
+        Returns:
+            格式化后的天气数据
+        """
+        result = self._format_weather_data(data)
+        if self.cache is not None:
+            self.cache.put(key, result, forecast_days)
+        return result
+    
+    def get_weather_many(
+        self,
+        points: Sequence[Tuple[float, float]],
+        forecast_days: int = 7,
+        chunk_size: int = 50
+    ) -> List[Optional[Dict]]:
+        """
+        批量获取多个地点的天气
+        缓存命中的直接返回，其余按 chunk_size 分组，每组一次多地点请求；
+        返回的地点数与请求不符时，该组改为逐个地点查询
+        
+        Args:
+            points: (纬度, 经度) 列表
+            forecast_days: 预报天数 (1-16)
+            chunk_size: 单次请求包含的最多地点数
+        
+        Returns:
+            与 points 一一对应的天气数据列表，失败的地点为 None
+        """
+        results, missing = self._plan_many(points, forecast_days)
+        
+        keys = list(missing)
+        for start in range(0, len(keys), chunk_size):
+            chunk = keys[start:start + chunk_size]
+            try:
+                params = self._build_params(
+                    ",".join(str(latitude) for latitude, _ in chunk),
+                    ",".join(str(longitude) for _, longitude in chunk),
+                    forecast_days
+                )
+                response = self.transport.get(
+                    self.base_url,
+                    params=params,
+                    headers=self.headers,
+                    timeout=30
+                )
+                response.raise_for_status()
+                
+                items = self._split_chunk(chunk, response.json())
+                if items is None:
+                    self._fetch_points(chunk, forecast_days, missing, results)
+                    continue
+                for key, item in zip(chunk, items):
+                    # 与单点查询经同一个请求合并器写入缓存：同网格同天数的并发写入只执行一次
+                    result = self.single_flight.do(
+                        (key[0], key[1], forecast_days), self._fill, key, item, forecast_days
+                    )
+                    for index in missing[key]:
+                        results[index] = result
+                
+            except requests.exceptions.RequestException as e:
+                print(f"天气查询请求错误: {e}")
+            except (KeyError, ValueError, IndexError, TypeError) as e:
+                print(f"天气数据解析错误: {e}")
+        
+        return results
+    
+    def _plan_many(
+        self,
+        points: Sequence[Tuple[float, float]],
+        forecast_days: int
+    ) -> Tuple[List[Optional[Dict]], Dict[Tuple[float, float], List[int]]]:
+        """
+        批量查询前先读取缓存
+        
+        Args:
+            points: (纬度, 经度) 列表
+            forecast_days: 预报天数
+        
+        Returns:
+            (与 points 对应的结果列表, 未命中的 {网格键: [下标]})
+        """
+        results: List[Optional[Dict]] = [None] * len(points)
+        missing: Dict[Tuple[float, float], List[int]] = {}
+        
+        for index, (latitude, longitude) in enumerate(points):
+            key = (latitude, longitude)
+            if self.cache is not None:
+                key = self.cache.key_for(latitude, longitude)
+                cached = self._from_cache(key, forecast_days)
+                if cached is not None:
+                    results[index] = cached
+                    continue
+            missing.setdefault(key, []).append(index)
+        return results, missing
+    
+    def _split_chunk(self, chunk: List[Tuple[float, float]], data) -> Optional[List[Dict]]:
+        """
+        将一次多地点请求的响应拆分为与 chunk 一一对应的列表
+        
+        Args:
+            chunk: 本次请求的网格键列表
+            data: API 返回的 JSON
+        
+        Returns:
+            每个地点的原始数据列表，地点数与请求不符时记录并返回 None
+        """
+        # 单个地点时 API 返回对象，多个地点时返回列表
+        if isinstance(data, dict):
+            data = [data]
+        if len(data) != len(chunk):
+            print(f"天气批量查询返回 {len(data)} 个地点，请求了 {len(chunk)} 个，改为逐个查询")
+            return None
+        return data
+    
+    def _fetch_points(
+        self,
+        chunk: List[Tuple[float, float]],
+        forecast_days: int,
+        missing: Dict[Tuple[float, float], List[int]],
+        results: List[Optional[Dict]]
+    ):
+        """
+        逐个地点查询（批量请求失败时的回退），经 _revalidate 合并并发请求
+        
+        Args:
+            chunk: 网格键列表
+            forecast_days: 预报天数
+            missing: 网格键到结果下标的映射
+            results: 结果列表
+        """
+        for key in chunk:
+            try:
+                result = self._revalidate(key[0], key[1], forecast_days)
+            except requests.exceptions.RequestException as e:
+                print(f"天气查询请求错误: {e}")
+                continue
+            except (KeyError, ValueError, IndexError, TypeError) as e:
+                print(f"天气数据解析错误: {e}")
+                continue
+            for index in missing[key]:
+                results[index] = result
+    
+    def _build_params(self, latitude, longitude, forecast_days: int) -> Dict:
+        """
+        构造 Open-Meteo 查询参数
+        
+        Args:
+            latitude: 纬度，多个地点时为逗号分隔的字符串
+            longitude: 经度，多个地点时为逗号分隔的字符串
+            forecast_days: 预报天数
+        
+        Returns:
+            查询参数字典
+        """
+        return {
+            "latitude": latitude,
+            "longitude": longitude,
+            "current": [
+                "temperature_2m",           # 当前气温
+                "relative_humidity_2m",     # 相对湿度
+                "apparent_temperature",     # 体感温度
+                "precipitation",            # 降水量
+                "weather_code",             # 天气代码
+                "wind_speed_10m",           # 风速
+            ],
+            "daily": [
+                "weather_code",             # 天气代码
+                "temperature_2m_max",       # 最高温度
+                "temperature_2m_min",       # 最低温度
+                "precipitation_sum",        # 降水总量
+                "wind_speed_10m_max",       # 最大风速
+            ],
+            "timezone": "auto",             # 自动时区
+            "forecast_days": forecast_days
+        }
+    
     def _format_weather_data(self, data: Dict) -> Dict:
         """
         格式化天气数据为易读格式
@@ -129,15 +394,16 @@ class OpenMeteoWeather:
             "longitude": data.get("longitude")
         }
     
-    def _get_weather_description(self, code: int) -> str:
+    def _get_weather_description(self, code: int, lang: Optional[str] = None) -> str:
         """
         根据 WMO 天气代码返回天气描述
         
         Args:
             code: WMO 天气代码
+            lang: 语言代码（cn/en），为 None 时返回中英双语
         
         Returns:
-            天气描述（中英双语）
+            天气描述
         """
         weather_codes = {
             0: "晴天 / Clear sky",
@@ -165,18 +431,19 @@ class OpenMeteoWeather:
             96: "雷暴伴小冰雹 / Thunderstorm with slight hail",
             99: "雷暴伴大冰雹 / Thunderstorm with heavy hail"
         }
-        return weather_codes.get(code, f"未知天气 / Unknown ({code})")
+        return _pick_language(weather_codes.get(code, f"未知天气 / Unknown ({code})"), lang)
     
-    def get_clothing_advice(self, temperature: float, weather_code: int) -> str:
+    def get_clothing_advice(self, temperature: float, weather_code: int, lang: Optional[str] = None) -> str:
         """
         根据温度和天气状况给出穿衣建议
         
         Args:
             temperature: 气温（摄氏度）
             weather_code: 天气代码
+            lang: 语言代码（cn/en），为 None 时返回中英双语
         
         Returns:
-            穿衣建议（中英双语）
+            穿衣建议
         """
         advice = []
         
@@ -211,18 +478,28 @@ class OpenMeteoWeather:
             advice.append("雷暴天气，尽量避免外出")
             advice.append("Thunderstorm - avoid going out if possible")
         
+        # 建议按 中文、English 交替排列
+        if lang == "cn":
+            advice = advice[0::2]
+        elif lang == "en":
+            advice = advice[1::2]
         return " | ".join(advice)
     
-    def get_temperature_description(self, temperature: float) -> str:
+    def get_temperature_description(self, temperature: float, lang: Optional[str] = None) -> str:
         """
         根据温度返回描述性文字
         
         Args:
             temperature: 气温（摄氏度）
+            lang: 语言代码（cn/en），为 None 时返回中英双语
         
         Returns:
-            温度描述（中英双语）
+            温度描述
         """
+        return _pick_language(self._temperature_description(temperature), lang)
+    
+    def _temperature_description(self, temperature: float) -> str:
+        """返回中英双语的温度描述"""
         if temperature < -20:
             return "极寒天气 / Extreme cold"
         elif temperature < -10:
@@ -247,6 +524,207 @@ class OpenMeteoWeather:
             return "酷热天气 / Very hot"
 
 
+class AsyncOpenMeteoWeather(OpenMeteoWeather):
+    """
+    OpenMeteoWeather 的 asyncio 版本
+    返回结构与同步版本一致，与同步版本共享天气缓存；
+    过期数据的后台刷新仍由共享的刷新器线程完成
+    """
+    
+    def __init__(
+        self,
+        transport: Optional[AsyncHttpTransport] = None,
+        cache: Optional[WeatherCache] = None,
+        use_cache: bool = True,
+        single_flight: Optional[AsyncSingleFlight] = None,
+        refresher: Optional[WeatherRefresher] = None,
+        timeout: float = 30
+    ):
+        """
+        初始化异步天气查询器
+        
+        Args:
+            transport: 异步 HTTP 传输层，默认使用当前事件循环共享的连接池
+            cache: 天气缓存，默认使用进程共享的缓存
+            use_cache: 是否启用缓存
+            single_flight: 异步请求合并器，默认在进程内共享
+            refresher: 过期数据的后台刷新器（规则同 OpenMeteoWeather）
+            timeout: 每次调用的默认截止时间（秒）
+        """
+        super().__init__(cache=cache, use_cache=use_cache, refresher=refresher)
+        # 连接池绑定事件循环，未指定时在调用时按当前事件循环获取
+        self.transport = transport
+        self.single_flight = single_flight or get_shared_async_flight("open-meteo")
+        self.timeout = timeout
+    
+    async def _get_json(self, params: Dict):
+        """发送请求并返回 JSON（网络和解析错误直接抛出）"""
+        transport = self.transport or get_default_async_transport()
+        response = await transport.get(self.base_url, params=params, headers=self.headers, timeout=30)
+        response.raise_for_status()
+        return response.json()
+    
+    async def get_weather(
+        self,
+        latitude: float,
+        longitude: float,
+        forecast_days: int = 7,
+        timeout: Optional[float] = None
+    ) -> Optional[Dict]:
+        """
+        根据经纬度获取天气信息
+        
+        Args:
+            latitude: 纬度
+            longitude: 经度
+            forecast_days: 预报天数 (1-16)
+            timeout: 截止时间（秒），默认使用 self.timeout
+        
+        Returns:
+            包含天气信息的字典，失败或超时返回 None
+        """
+        if self.cache is not None:
+            key = self.cache.key_for(latitude, longitude)
+            cached = self._from_cache(key, forecast_days)
+            if cached is not None:
+                return cached
+            # 按网格中心查询，结果对整个网格有效
+            latitude, longitude = key
+        
+        try:
+            return await asyncio.wait_for(
+                self.single_flight.do(
+                    (latitude, longitude, forecast_days),
+                    self._fetch_weather_async,
+                    latitude,
+                    longitude,
+                    forecast_days
+                ),
+                self.timeout if timeout is None else timeout
+            )
+        except asyncio.TimeoutError:
+            print(f"天气查询超时: {latitude}, {longitude}")
+            return None
+        except httpx.HTTPError as e:
+            print(f"天气查询请求错误: {e}")
+            return None
+        except (KeyError, ValueError, IndexError) as e:
+            print(f"天气数据解析错误: {e}")
+            return None
+    
+    async def _fetch_weather_async(self, latitude: float, longitude: float, forecast_days: int) -> Dict:
+        """
+        请求 Open-Meteo 并写入缓存（网络和解析错误直接抛出）
+        
+        Args:
+            latitude: 纬度（启用缓存时为网格中心）
+            longitude: 经度（启用缓存时为网格中心）
+            forecast_days: 预报天数
+        
+        Returns:
+            格式化后的天气数据
+        """
+        data = await self._get_json(self._build_params(latitude, longitude, forecast_days))
+        return self._fill((latitude, longitude), data, forecast_days)
+    
+    async def _fill_async(self, key: Tuple[float, float], data: Dict, forecast_days: int) -> Dict:
+        """_fill 的协程版本，供异步请求合并器调用"""
+        return self._fill(key, data, forecast_days)
+    
+    async def get_weather_many(
+        self,
+        points: Sequence[Tuple[float, float]],
+        forecast_days: int = 7,
+        chunk_size: int = 50,
+        timeout: Optional[float] = None
+    ) -> List[Optional[Dict]]:
+        """
+        批量获取多个地点的天气，各分组请求并发进行
+        返回的地点数与请求不符时，该组改为逐个地点查询
+        
+        Args:
+            points: (纬度, 经度) 列表
+            forecast_days: 预报天数 (1-16)
+            chunk_size: 单次请求包含的最多地点数
+            timeout: 每个分组请求的截止时间（秒），默认使用 self.timeout
+        
+        Returns:
+            与 points 一一对应的天气数据列表，失败的地点为 None
+        """
+        results, missing = self._plan_many(points, forecast_days)
+        keys = list(missing)
+        
+        async def fetch_chunk(chunk: List[Tuple[float, float]]):
+            params = self._build_params(
+                ",".join(str(latitude) for latitude, _ in chunk),
+                ",".join(str(longitude) for _, longitude in chunk),
+                forecast_days
+            )
+            try:
+                data = await asyncio.wait_for(
+                    self._get_json(params),
+                    self.timeout if timeout is None else timeout
+                )
+                items = self._split_chunk(chunk, data)
+                if items is None:
+                    points = await asyncio.gather(*(
+                        self.get_weather(latitude, longitude, forecast_days, timeout)
+                        for latitude, longitude in chunk
+                    ))
+                else:
+                    points = [
+                        await self.single_flight.do(
+                            (key[0], key[1], forecast_days), self._fill_async, key, item, forecast_days
+                        )
+                        for key, item in zip(chunk, items)
+                    ]
+                for key, result in zip(chunk, points):
+                    for index in missing[key]:
+                        results[index] = result
+            except asyncio.TimeoutError:
+                print(f"天气查询超时: {len(chunk)} 个地点")
+            except httpx.HTTPError as e:
+                print(f"天气查询请求错误: {e}")
+            except (KeyError, ValueError, IndexError, TypeError) as e:
+                print(f"天气数据解析错误: {e}")
+        
+        await asyncio.gather(*(
+            fetch_chunk(keys[start:start + chunk_size])
+            for start in range(0, len(keys), chunk_size)
+        ))
+        return results
+
+
+_default_refresher = None
+_default_refresher_lock = threading.Lock()
+
+
+def get_default_refresher() -> WeatherRefresher:
+    """
+    获取默认天气缓存的后台刷新器（首次调用时创建）
+    主动刷新线程在第一次安排后台刷新时启动，长期运行的服务也可在启动时调用 start()；
+    刷新统一由一个共享的查询器完成，不会每次刷新都新建查询器
+    可通过 WEATHER_REFRESH_CONCURRENCY、WEATHER_REFRESH_TOP_N、WEATHER_REFRESH_INTERVAL 配置
+    
+    Returns:
+        WeatherRefresher 实例
+    """
+    global _default_refresher
+    with _default_refresher_lock:
+        if _default_refresher is None:
+            refresher = WeatherRefresher(
+                get_default_weather_cache(),
+                fetch=None,
+                max_concurrency=int(os.getenv("WEATHER_REFRESH_CONCURRENCY", 2)),
+                top_n=int(os.getenv("WEATHER_REFRESH_TOP_N", 20)),
+                interval=float(os.getenv("WEATHER_REFRESH_INTERVAL", 30)),
+                autostart=True
+            )
+            refresher.fetch = OpenMeteoWeather(refresher=refresher)._revalidate
+            _default_refresher = refresher
+        return _default_refresher
+
+
 def main():
     """命令行交互式天气查询工具"""
     print("🌤️  Open-Meteo 天气查询工具")
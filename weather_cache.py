@@ -0,0 +1,406 @@
+"""
+天气查询缓存
+按预报模型网格对齐坐标作为缓存键，在模型更新时刻过期，而不是固定 TTL；
+可选 stale-while-revalidate：过期不久的数据先返回，同时在后台刷新
+"""
+
+import copy
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+GridKey = Tuple[float, float]
+
+
+class WeatherCache:
+    """
+    天气结果缓存
+    同一网格内的坐标共享一条记录；每条记录保存已获取的最多预报天数，
+    请求更少天数时直接截取
+    """
+
+    def __init__(
+        self,
+        grid_deg: float = 0.1,
+        update_interval: float = 3600,
+        update_offset: float = 0,
+        max_entries: int = 1024,
+        stale_ttl: float = 0
+    ):
+        """
+        初始化天气缓存
+
+        Args:
+            grid_deg: 坐标对齐的网格大小（度），应与预报模型分辨率相当
+            update_interval: 模型数据更新周期（秒）
+            update_offset: 更新时刻相对整点周期的偏移（秒），用于对齐数据发布延迟
+            max_entries: 最大条目数，超出后淘汰最久未使用的条目
+            stale_ttl: 过期后仍可返回旧数据的时长（秒），0 表示关闭 stale-while-revalidate
+        """
+        self.grid_deg = grid_deg
+        self.update_interval = update_interval
+        self.update_offset = update_offset
+        self.max_entries = max_entries
+        self.stale_ttl = stale_ttl
+        self._entries: "OrderedDict[GridKey, Dict]" = OrderedDict()
+        # 访问频率表（按模型更新周期衰减），用于挑选需要主动刷新的热门网格
+        self._frequency: Dict[GridKey, float] = {}
+        self._decayed_at = time.time()
+        self._lock = threading.Lock()
+
+        # 统计计数
+        self.hits = 0
+        self.misses = 0
+        self.stale_served = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def key_for(self, latitude: float, longitude: float) -> GridKey:
+        """
+        将坐标对齐到网格中心
+
+        Args:
+            latitude: 纬度
+            longitude: 经度
+
+        Returns:
+            (网格纬度, 网格经度)
+        """
+        return (
+            round(round(latitude / self.grid_deg) * self.grid_deg, 4),
+            round(round(longitude / self.grid_deg) * self.grid_deg, 4)
+        )
+
+    def next_update(self, fetched_at: float) -> float:
+        """
+        计算获取时刻之后的下一个模型更新时刻
+
+        Args:
+            fetched_at: 数据获取时间戳
+
+        Returns:
+            过期时间戳
+        """
+        cycles = math.floor((fetched_at - self.update_offset) / self.update_interval) + 1
+        return cycles * self.update_interval + self.update_offset
+
+    def get(self, key: GridKey, forecast_days: int) -> Optional[Dict]:
+        """
+        查询缓存（只返回未过期的数据）
+
+        Args:
+            key: 网格键（见 key_for）
+            forecast_days: 需要的预报天数
+
+        Returns:
+            天气数据（预报截取到 forecast_days 天），未命中返回 None
+        """
+        return self.lookup(key, forecast_days, allow_stale=False)[0]
+
+    def lookup(
+        self,
+        key: GridKey,
+        forecast_days: int,
+        allow_stale: bool = True
+    ) -> Tuple[Optional[Dict], bool]:
+        """
+        查询缓存，可返回 stale_ttl 范围内的过期数据
+
+        Args:
+            key: 网格键（见 key_for）
+            forecast_days: 需要的预报天数
+            allow_stale: 是否允许返回过期数据
+
+        Returns:
+            (天气数据, 是否已过期)，未命中返回 (None, False)
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry["forecast_days"] < forecast_days:
+                self.misses += 1
+                return (None, False)
+
+            stale = entry["expires_at"] <= now
+            if stale and (not allow_stale or entry["expires_at"] + self.stale_ttl <= now):
+                del self._entries[key]
+                self._frequency.pop(key, None)
+                self.expirations += 1
+                self.misses += 1
+                return (None, False)
+
+            self._entries.move_to_end(key)
+            self._frequency[key] = self._frequency.get(key, 0.0) + 1
+            if stale:
+                self.stale_served += 1
+            else:
+                self.hits += 1
+            data = entry["data"]
+
+        result = copy.deepcopy(data)
+        result["forecast"] = result["forecast"][:forecast_days]
+        return (result, stale)
+
+    def cached_days(self, key: GridKey) -> int:
+        """
+        返回网格已缓存的预报天数（含已过期的条目）
+
+        Args:
+            key: 网格键
+
+        Returns:
+            预报天数，未缓存时返回 0
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry["forecast_days"] if entry is not None else 0
+
+    def hot_expired(self, top_n: int, decay: float = 0.5) -> List[Tuple[GridKey, int]]:
+        """
+        返回访问最频繁的 top_n 个网格中已到达模型更新时刻的条目，并衰减访问频率
+        衰减按距上次调用经过的时间折算，与调用周期无关：上一个更新周期内的热门网格
+        在下一个更新时刻仍排在前面
+
+        Args:
+            top_n: 参与挑选的热门网格数量
+            decay: 每经过一个模型更新周期访问频率乘以的系数
+
+        Returns:
+            [(网格键, 预报天数)] 列表
+        """
+        now = time.time()
+        with self._lock:
+            hot = sorted(self._frequency.items(), key=lambda item: -item[1])[:top_n]
+            expired = [
+                (key, self._entries[key]["forecast_days"])
+                for key, _ in hot
+                if key in self._entries and self._entries[key]["expires_at"] <= now
+            ]
+            factor = decay ** ((now - self._decayed_at) / self.update_interval)
+            self._decayed_at = now
+            self._frequency = {
+                key: count * factor
+                for key, count in self._frequency.items()
+                if key in self._entries and count * factor >= 0.01
+            }
+        return expired
+
+    def put(self, key: GridKey, data: Dict, forecast_days: int):
+        """
+        写入缓存
+        未过期的条目包含更多预报天数时保留原条目，每个网格始终保存已获取的最多天数
+
+        Args:
+            key: 网格键
+            data: 格式化后的天气数据
+            forecast_days: 数据包含的预报天数
+        """
+        now = time.time()
+        with self._lock:
+            existing = self._entries.get(key)
+            if existing is not None and existing["expires_at"] > now and existing["forecast_days"] > forecast_days:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = {
+                "data": copy.deepcopy(data),
+                "forecast_days": forecast_days,
+                "fetched_at": now,
+                "expires_at": self.next_update(now)
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._frequency.pop(evicted, None)
+                self.evictions += 1
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._frequency.clear()
+            self._decayed_at = time.time()
+
+    def stats(self) -> Dict:
+        """
+        返回缓存统计信息
+
+        Returns:
+            包含命中率、过期和淘汰次数以及当前条目数的字典
+        """
+        lookups = self.hits + self.stale_served + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "stale_served": self.stale_served,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+            "size": len(self._entries)
+        }
+
+
+class WeatherRefresher:
+    """
+    后台刷新器
+    返回过期数据的同时在后台重新获取；并周期性地主动刷新热门网格，
+    让热门城市在用户访问之前就拿到新一轮模型数据
+    """
+
+    def __init__(
+        self,
+        cache: WeatherCache,
+        fetch: Callable[[float, float, int], Dict],
+        max_concurrency: int = 2,
+        top_n: int = 20,
+        interval: float = 30,
+        autostart: bool = False
+    ):
+        """
+        初始化后台刷新器
+
+        Args:
+            cache: 要刷新的天气缓存
+            fetch: 获取函数 (纬度, 经度, 预报天数)，需自行把结果写入缓存
+            max_concurrency: 同时进行的最大刷新数
+            top_n: 主动刷新的热门网格数量
+            interval: 主动刷新的检查周期（秒）
+            autostart: 是否在第一次安排后台刷新时启动主动刷新线程
+        """
+        self.cache = cache
+        self.fetch = fetch
+        self.max_concurrency = max_concurrency
+        self.top_n = top_n
+        self.interval = interval
+        self.autostart = autostart
+        self._executor = None
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+        # 统计计数
+        self.scheduled = 0
+        self.refreshed = 0
+        self.failed = 0
+        self.proactive = 0
+        self.dropped = 0
+
+    def schedule(self, key: GridKey, forecast_days: int) -> bool:
+        """
+        安排一次后台刷新（同一网格同时只刷新一次）
+        刷新的天数取请求天数和已缓存天数的较大值，避免较短的请求让条目变短
+
+        Args:
+            key: 网格键
+            forecast_days: 预报天数
+
+        Returns:
+            是否成功安排
+        """
+        forecast_days = max(forecast_days, self.cache.cached_days(key))
+        with self._lock:
+            if key in self._in_flight:
+                return False
+            # 限制排队长度，避免上游故障时任务无限堆积
+            if len(self._in_flight) >= self.max_concurrency * 4:
+                self.dropped += 1
+                return False
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_concurrency,
+                    thread_name_prefix="weather-refresh"
+                )
+            self._in_flight.add(key)
+            self.scheduled += 1
+        self._executor.submit(self._refresh, key, forecast_days)
+        if self.autostart:
+            self.start()
+        return True
+
+    def _refresh(self, key: GridKey, forecast_days: int):
+        try:
+            self.fetch(key[0], key[1], forecast_days)
+            with self._lock:
+                self.refreshed += 1
+        except Exception as e:
+            print(f"天气后台刷新失败 {key}: {e}")
+            with self._lock:
+                self.failed += 1
+        finally:
+            with self._lock:
+                self._in_flight.discard(key)
+
+    def refresh_hot(self) -> int:
+        """
+        主动刷新已到达模型更新时刻的热门网格
+        （在更新时刻之前刷新只会取回同一轮模型数据，因此在过期后立即刷新）
+
+        Returns:
+            本次安排的刷新数
+        """
+        count = 0
+        for key, forecast_days in self.cache.hot_expired(self.top_n):
+            if self.schedule(key, forecast_days):
+                count += 1
+        with self._lock:
+            self.proactive += count
+        return count
+
+    def start(self):
+        """启动周期性主动刷新线程（守护线程）"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="weather-refresh-loop", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.refresh_hot()
+
+    def stats(self) -> Dict:
+        """
+        返回刷新统计信息
+
+        Returns:
+            包含安排、完成、失败、主动刷新次数和进行中刷新数的字典
+        """
+        with self._lock:
+            return {
+                "scheduled": self.scheduled,
+                "refreshed": self.refreshed,
+                "failed": self.failed,
+                "proactive": self.proactive,
+                "dropped": self.dropped,
+                "in_flight": len(self._in_flight)
+            }
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_weather_cache() -> WeatherCache:
+    """
+    获取进程内共享的默认天气缓存
+    可通过 WEATHER_CACHE_GRID、WEATHER_UPDATE_INTERVAL、WEATHER_UPDATE_OFFSET、
+    WEATHER_CACHE_MAX_ENTRIES、WEATHER_STALE_TTL 环境变量配置
+
+    Returns:
+        WeatherCache 实例
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = WeatherCache(
+                grid_deg=float(os.getenv("WEATHER_CACHE_GRID", 0.1)),
+                update_interval=float(os.getenv("WEATHER_UPDATE_INTERVAL", 3600)),
+                update_offset=float(os.getenv("WEATHER_UPDATE_OFFSET", 0)),
+                max_entries=int(os.getenv("WEATHER_CACHE_MAX_ENTRIES", 1024)),
+                stale_ttl=float(os.getenv("WEATHER_STALE_TTL", 1800))
+            )
+        return _default_cache
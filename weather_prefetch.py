@@ -0,0 +1,178 @@
+"""
+天气预取
+地理编码成功后立即在后台查询该坐标的天气；模型随后发起的 get_weather 调用
+直接使用进行中（或已完成）的预取结果，网络耗时与模型推理重叠
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, Optional, Tuple
+
+from weather import OpenMeteoWeather
+from weather_cache import GridKey, get_default_weather_cache
+
+
+class WeatherPrefetcher:
+    """
+    按网格键记录预取任务
+    每次预取获取最多天数的预报，后续请求更少天数时直接截取；
+    超过 ttl 仍未被使用的预取计为浪费
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[float, float, int], Optional[Dict]],
+        key_for: Callable[[float, float], GridKey],
+        forecast_days: int = 7,
+        ttl: float = 120,
+        max_workers: int = 2
+    ):
+        """
+        初始化预取器
+
+        Args:
+            fetch: 获取函数 (纬度, 经度, 预报天数)，失败返回 None
+            key_for: 坐标到网格键的映射，与天气缓存一致
+            forecast_days: 预取的预报天数
+            ttl: 预取结果等待被使用的最长时间（秒）
+            max_workers: 预取线程数（与工具线程池分开，避免互相等待）
+        """
+        self.fetch = fetch
+        self.key_for = key_for
+        self.forecast_days = forecast_days
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self._executor = None
+        self._pending: Dict[GridKey, Tuple[Future, float]] = {}
+        self._lock = threading.Lock()
+
+        # 统计计数
+        self.started = 0
+        self.hits = 0
+        self.overlapped = 0
+        self.wasted = 0
+        self.failed = 0
+
+    def prefetch(self, latitude: float, longitude: float) -> bool:
+        """
+        在后台预取坐标所在网格的天气（同一网格已有未使用的预取时跳过）
+
+        Args:
+            latitude: 纬度
+            longitude: 经度
+
+        Returns:
+            是否新开始了一次预取
+        """
+        key = self.key_for(latitude, longitude)
+        with self._lock:
+            self._expire()
+            if key in self._pending:
+                return False
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="weather-prefetch"
+                )
+            future = self._executor.submit(self.fetch, latitude, longitude, self.forecast_days)
+            self._pending[key] = (future, time.monotonic())
+            self.started += 1
+        return True
+
+    def take(
+        self,
+        latitude: float,
+        longitude: float,
+        forecast_days: int,
+        timeout: Optional[float] = None
+    ) -> Optional[Dict]:
+        """
+        取出坐标所在网格的预取结果（进行中则等待完成）
+
+        Args:
+            latitude: 纬度
+            longitude: 经度
+            forecast_days: 需要的预报天数
+            timeout: 等待进行中预取的最长时间（秒）
+
+        Returns:
+            天气数据（预报截取到 forecast_days 天），没有可用的预取结果时返回 None
+        """
+        if forecast_days > self.forecast_days:
+            return None
+        key = self.key_for(latitude, longitude)
+        with self._lock:
+            self._expire()
+            entry = self._pending.pop(key, None)
+        if entry is None:
+            return None
+
+        future = entry[0]
+        ready = future.done()
+        try:
+            result = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            result = None
+        except Exception as e:
+            print(f"天气预取失败 {key}: {e}")
+            result = None
+
+        with self._lock:
+            if result is None:
+                self.failed += 1
+                return None
+            self.hits += 1
+            if ready:
+                self.overlapped += 1
+        return dict(result, forecast=result["forecast"][:forecast_days])
+
+    def _expire(self):
+        """丢弃超过 ttl 未被使用的预取（调用方需持有锁）"""
+        now = time.monotonic()
+        for key, (_, started_at) in list(self._pending.items()):
+            if now - started_at > self.ttl:
+                del self._pending[key]
+                self.wasted += 1
+
+    def stats(self) -> Dict:
+        """
+        返回预取统计信息
+
+        Returns:
+            包含预取次数、命中次数（其中等待前已完成的次数）、浪费和失败次数的字典
+        """
+        with self._lock:
+            self._expire()
+            return {
+                "started": self.started,
+                "hits": self.hits,
+                "overlapped": self.overlapped,
+                "wasted": self.wasted,
+                "failed": self.failed,
+                "pending": len(self._pending)
+            }
+
+
+_default_prefetcher = None
+_default_prefetcher_lock = threading.Lock()
+
+
+def get_default_prefetcher() -> WeatherPrefetcher:
+    """
+    获取进程内共享的默认预取器（通过 OpenMeteoWeather 查询，写入默认天气缓存）
+    可通过 WEATHER_PREFETCH_TTL 环境变量配置
+
+    Returns:
+        WeatherPrefetcher 实例
+    """
+    global _default_prefetcher
+    with _default_prefetcher_lock:
+        if _default_prefetcher is None:
+            _default_prefetcher = WeatherPrefetcher(
+                fetch=lambda latitude, longitude, days: OpenMeteoWeather().get_weather(latitude, longitude, days),
+                key_for=get_default_weather_cache().key_for,
+                ttl=float(os.getenv("WEATHER_PREFETCH_TTL", 120))
+            )
+        return _default_prefetcher